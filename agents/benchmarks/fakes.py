@@ -0,0 +1,384 @@
+"""
+Offline stand-ins for the LLM, Dune and OpenAI clients used by the benchmark
+
+Every stand-in sleeps for a latency drawn from a configurable distribution,
+fails at a configurable rate and records how long each call took per stage.
+"""
+
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from types import SimpleNamespace
+
+import dspy
+import numpy as np
+import pandas as pd
+from dune_client.models import ExecutionState
+
+
+class LatencyModel:
+    """
+    Latency distribution parsed from a spec string (in seconds)
+
+    Supported specs: "fixed:2", "uniform:1,3", "normal:2,0.5", "lognormal:2,0.5"
+    (lognormal takes the median and the sigma of the underlying normal).
+    """
+
+    def __init__(self, spec: str, time_scale: float = 1.0, rng: random.Random = None):
+        self.spec = spec
+        self.time_scale = time_scale
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            value = self.params[0]
+        elif self.kind == "uniform":
+            value = self.rng.uniform(self.params[0], self.params[1])
+        elif self.kind == "normal":
+            value = self.rng.gauss(self.params[0], self.params[1])
+        elif self.kind == "lognormal":
+            value = self.rng.lognormvariate(np.log(self.params[0]), self.params[1])
+        else:
+            raise ValueError(f"Unknown latency distribution: {self.spec}")
+        return max(value, 0.0)
+
+    def sleep(self) -> float:
+        """Sleep for a sampled (scaled) latency and return the unscaled latency"""
+        value = self.sample()
+        time.sleep(value * self.time_scale)
+        return value
+
+
+class StageRecorder:
+    """Thread-safe collection of call durations per pipeline stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.failures = defaultdict(int)
+
+    def record(self, stage: str, seconds: float, failed: bool = False):
+        with self._lock:
+            self.durations[stage].append(seconds)
+            if failed:
+                self.failures[stage] += 1
+
+    def reset(self):
+        with self._lock:
+            self.durations = defaultdict(list)
+            self.failures = defaultdict(int)
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = {}
+            for stage, values in self.durations.items():
+                values = np.array(values)
+                stages[stage] = {
+                    "count": int(len(values)),
+                    "failures": int(self.failures[stage]),
+                    "mean": round(float(values.mean()), 4),
+                    "p50": round(float(np.percentile(values, 50)), 4),
+                    "p95": round(float(np.percentile(values, 95)), 4),
+                    "max": round(float(values.max()), 4),
+                }
+            return stages
+
+
+# Output fields of each agent signature, used to tell the stages apart
+STAGE_BY_OUTPUT_FIELD = {
+    "tasks": "plan",
+    "base_sql": "shared_base_plan",
+    "most_relevant_table": "table_retrieval",
+    "output_filename": "sql_generation",
+    "optimized_trino_sql_query": "sql_optimization",
+    "refined_trino_sql_query": "sql_retry",
+    "delta_trino_sql_query": "delta_sql_rewrite",
+    "local_sql": "local_answer",
+    "trino_sql_query": "sql_generation",
+    "plot_code": "plot",
+    "refined_code": "plot_refine",
+}
+
+PLOT_CODE_TEMPLATE = """const GeneratedViz = () => {
+  const chartRef = React.useRef(null);
+
+  React.useEffect(() => {
+    const container = chartRef.current;
+
+    const renderChart = () => {
+      const width = container.clientWidth;
+      const height = container.clientHeight;
+      d3.select(container).select("svg").remove();
+      const svg = d3.select(container)
+        .append("svg")
+        .attr("width", width)
+        .attr("height", height)
+        .attr("viewBox", [0, 0, width, height]);
+      d3.csv("__FILE_NAME__").then(data => {
+        svg.append("text").attr("x", 20).attr("y", 20).attr("fill", "white").text("Benchmark");
+      });
+    };
+
+    renderChart();
+    const resizeObserver = new ResizeObserver(() => { renderChart(); });
+    resizeObserver.observe(chartRef.current);
+    return () => { resizeObserver.disconnect(); };
+  }, []);
+
+  return React.createElement("div", { ref: chartRef, className: "w-full h-full bg-[#22222E]" });
+};
+"""
+
+
+class FakeLM(dspy.BaseLM):
+    """dspy LM that answers every agent signature with canned, well-formed outputs"""
+
+    def __init__(
+        self,
+        recorder: StageRecorder,
+        latency: LatencyModel,
+        failure_rate: float = 0.0,
+        tasks_per_prompt: int = 3,
+        plot_code_chars: int = 12000,
+        table_names: list[str] = None,
+        shared_base_rate: float = 0.0,
+        plot_invalid_rate: float = 0.0,
+        rng: random.Random = None,
+    ):
+        super().__init__(model="bench/fake-lm", cache=False)
+        self.shared_base_rate = shared_base_rate
+        self.plot_invalid_rate = plot_invalid_rate
+        self.recorder = recorder
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.tasks_per_prompt = tasks_per_prompt
+        self.plot_code_chars = plot_code_chars
+        self.table_names = table_names or ["tokens.transfers"]
+        self.rng = rng or random.Random()
+        self._rng_lock = threading.Lock()
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self.rng.random()
+
+    def _output_fields(self, messages: list[dict]) -> list[str]:
+        system = messages[0]["content"]
+        section = system.split("Your output fields are:", 1)[1].split("\n\n", 1)[0]
+        return re.findall(r"`(\w+)`", section)
+
+    def _input_field(self, messages: list[dict], name: str) -> str:
+        match = re.search(
+            rf"\[\[ ## {name} ## \]\]\n(.*?)(?:\n\n\[\[ ## |\n\nRespond with|\Z)",
+            messages[-1]["content"],
+            re.DOTALL,
+        )
+        return match.group(1).strip() if match else ""
+
+    def _value(self, field: str, messages: list[dict]) -> str:
+        if field == "tasks":
+            prompt = self._input_field(messages, "prompt")
+            tasks = [f"Task {i + 1} of: {prompt}" for i in range(self.tasks_per_prompt)]
+            return json.dumps(tasks, ensure_ascii=False)
+        if field == "most_relevant_table":
+            return self.table_names[int(self._random() * len(self.table_names))]
+        if field in ("trino_sql_query", "optimized_trino_sql_query", "refined_trino_sql_query"):
+            # Unique alias so that tasks do not coalesce into one Dune execution
+            return (
+                f"SELECT block_date, SUM(amount_usd) AS volume_{uuid.uuid4().hex[:8]} "
+                "FROM tokens.transfers WHERE block_date >= current_date - interval '7' day "
+                "GROUP BY 1 ORDER BY 1"
+            )
+        if field == "delta_trino_sql_query":
+            return (
+                self._input_field(messages, "original_trino_sql_query")
+                + f" -- WHERE block_time >= {self._input_field(messages, 'boundary')}"
+            )
+        if field == "output_filename":
+            return f"bench_{uuid.uuid4().hex[:12]}.csv"
+        if field == "answerable":
+            return "False"
+        if field == "use_shared_base":
+            return str(self._random() < self.shared_base_rate)
+        if field == "base_table":
+            return "tokens.transfers"
+        if field == "base_sql":
+            return (
+                "SELECT block_date, amount_usd AS volume, blockchain FROM tokens.transfers "
+                "WHERE block_date >= current_date - interval '30' day LIMIT 100000"
+            )
+        if field in ("task_queries", "output_filenames"):
+            task_count = len(json.loads(self._input_field(messages, "tasks") or "[]"))
+            if field == "task_queries":
+                values = ["SELECT block_date, SUM(volume) AS volume FROM base GROUP BY 1 ORDER BY 1"] * task_count
+            else:
+                values = [f"bench_{uuid.uuid4().hex[:12]}.csv" for _ in range(task_count)]
+            return json.dumps(values)
+        if field in ("plot_code", "refined_code"):
+            code = PLOT_CODE_TEMPLATE.replace(
+                "__FILE_NAME__", self._input_field(messages, "file_name")
+            )
+            if field == "plot_code" and self._random() < self.plot_invalid_rate:
+                # A draft that fails the static checks, so that it gets refined
+                code = code.replace("resizeObserver.disconnect(); ", "")
+            padding = max(self.plot_code_chars - len(code), 0)
+            return code + "// " + "x" * padding
+        return "Benchmark placeholder."
+
+    def forward_stream(self, on_text, prompt=None, messages=None, **kwargs):
+        """forward, with the completion handed to on_text in small chunks as a streaming LM would"""
+        response = self.forward(prompt=prompt, messages=messages, **kwargs)
+        content = response.choices[0].message.content
+        for i in range(0, len(content), 64):
+            on_text(content[i:i + 64])
+        return response
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        fields = self._output_fields(messages)
+        stage = next(
+            (STAGE_BY_OUTPUT_FIELD[f] for f in fields if f in STAGE_BY_OUTPUT_FIELD),
+            "llm_other",
+        )
+
+        start = time.perf_counter()
+        self.latency.sleep()
+        if self._random() < self.failure_rate:
+            self.recorder.record(stage, time.perf_counter() - start, failed=True)
+            raise RuntimeError(f"Simulated LLM failure in stage {stage}")
+
+        content = "\n\n".join(
+            f"[[ ## {field} ## ]]\n{self._value(field, messages)}" for field in fields
+        )
+        content += "\n\n[[ ## completed ## ]]"
+        self.recorder.record(stage, time.perf_counter() - start)
+
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+            model=self.model,
+        )
+
+
+class FakeDuneClient:
+    """Stand-in for dune_client.client.DuneClient"""
+
+    def __init__(
+        self,
+        recorder: StageRecorder,
+        create_latency: LatencyModel,
+        execute_latency: LatencyModel,
+        rows: LatencyModel,
+        failure_rate: float = 0.0,
+        large_speedup: float = 2.0,
+        rng: random.Random = None,
+    ):
+        self.recorder = recorder
+        self.create_latency = create_latency
+        self.execute_latency = execute_latency
+        self.rows = rows
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.large_speedup = large_speedup
+        self._next_query_id = 1
+        self._executions = {}
+
+    def create_query(self, name, query_sql, params=None, is_private=True):
+        start = time.perf_counter()
+        self.create_latency.sleep()
+        with self._lock:
+            query_id = self._next_query_id
+            self._next_query_id += 1
+        self.recorder.record("dune_create", time.perf_counter() - start)
+        base = SimpleNamespace(query_id=query_id, query_sql=query_sql, params=params)
+        return SimpleNamespace(base=base)
+
+    def execute_query(self, query, performance=None):
+        """Start a simulated execution that finishes after a sampled latency"""
+        duration = self.execute_latency.sample() * self.execute_latency.time_scale
+        if performance == "large":
+            duration /= self.large_speedup
+        with self._lock:
+            execution_id = f"bench-{uuid.uuid4().hex[:12]}"
+            self._executions[execution_id] = {
+                "started": time.perf_counter(),
+                "finish_at": time.perf_counter() + duration,
+                "failed": self.rng.random() < self.failure_rate,
+                "rows": int(self.rows.sample()),
+                "cancelled": False,
+                "recorded": False,
+            }
+        return SimpleNamespace(execution_id=execution_id, state=ExecutionState.PENDING)
+
+    def get_execution_status(self, execution_id):
+        with self._lock:
+            execution = self._executions[execution_id]
+            if execution["cancelled"]:
+                state = ExecutionState.CANCELLED
+            elif time.perf_counter() < execution["finish_at"]:
+                state = ExecutionState.EXECUTING
+            elif execution["failed"]:
+                state = ExecutionState.FAILED
+            else:
+                state = ExecutionState.COMPLETED
+            if state in ExecutionState.terminal_states() and not execution["recorded"]:
+                execution["recorded"] = True
+                self.recorder.record(
+                    "dune_execute",
+                    time.perf_counter() - execution["started"],
+                    failed=state != ExecutionState.COMPLETED,
+                )
+        error = 'Simulated Dune failure: column "amount" does not exist' if state == ExecutionState.FAILED else None
+        return SimpleNamespace(execution_id=execution_id, state=state, error=error)
+
+    def cancel_execution(self, execution_id):
+        with self._lock:
+            self._executions[execution_id]["cancelled"] = True
+        return True
+
+    def get_execution_results_csv(self, execution_id, **kwargs):
+        with self._lock:
+            row_count = self._executions.pop(execution_id)["rows"]
+        df = pd.DataFrame(
+            {
+                "block_date": pd.date_range("2024-01-01", periods=row_count, freq="h"),
+                "volume": np.random.default_rng(row_count).random(row_count) * 1e6,
+                "blockchain": "ethereum",
+            }
+        )
+        return SimpleNamespace(data=io.BytesIO(df.to_csv(index=False).encode("utf-8")), next_uri=None)
+
+
+class FakeOpenAI:
+    """Stand-in for the (sync or async) OpenAI client used by AnalyzeFigureAgent"""
+
+    def __init__(self, recorder: StageRecorder, latency: LatencyModel, failure_rate: float = 0.0, rng=None):
+        self.recorder = recorder
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        start = time.perf_counter()
+        self.latency.sleep()
+        if self.rng.random() < self.failure_rate:
+            self.recorder.record("figure_analysis", time.perf_counter() - start, failed=True)
+            raise RuntimeError("Simulated vision model failure")
+        self.recorder.record("figure_analysis", time.perf_counter() - start)
+        message = SimpleNamespace(content="Benchmark analysis of the figure.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
@@ -0,0 +1,381 @@
+"""
+Offline benchmark of the generate_figures / process_prompt pipeline
+
+Runs the real agents against simulated LLM, Dune and OpenAI clients (see
+agents/benchmarks/fakes.py), so it needs no network or API keys, and writes a
+JSON report that can be compared across commits.
+
+Usage:
+    python -m agents.benchmarks.run_pipeline --output bench.json
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from agents.utils.scheduler import BACKGROUND, INTERACTIVE, work_priority
+from agents.utils.tracing import request_context
+from agents.benchmarks.fakes import (
+    FakeDuneClient,
+    FakeLM,
+    FakeOpenAI,
+    LatencyModel,
+    StageRecorder,
+)
+
+
+class ThreadSampler:
+    """Samples the number of live threads in the background"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        samples = self.samples or [threading.active_count()]
+        return {"peak": int(max(samples)), "mean": round(float(np.mean(samples)), 2)}
+
+
+def _latency_summary(latencies: list[float]) -> dict:
+    if not latencies:
+        return {}
+    values = np.array(latencies)
+    return {
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(np.percentile(values, 50)), 4),
+        "p90": round(float(np.percentile(values, 90)), 4),
+        "p99": round(float(np.percentile(values, 99)), 4),
+        "max": round(float(values.max()), 4),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def _run_generate_figures(agents, prompts, concurrency, workdir, background_prompts=(), background_latencies=None):
+    """
+    Drive agents.main.generate_figures from `concurrency` threads
+
+    background_prompts run at the same time from as many other threads in
+    the background priority class (like batch runs), their latencies are
+    appended to background_latencies rather than reported with the others.
+    """
+    def run_one(idx, prompt, priority=INTERACTIVE):
+        viz_dir = os.path.join(workdir, "viz", f"{priority}{idx % concurrency}")
+        start = time.perf_counter()
+        with request_context(wallet_address=f"0xbench{idx % concurrency:04x}"), work_priority(priority):
+            results = agents.generate_figures(prompt, os.path.join(workdir, "csv"), viz_dir)
+        return time.perf_counter() - start, results
+
+    latencies, errors, figures = [], 0, 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as background_executor:
+        background = [
+            background_executor.submit(run_one, i, p, BACKGROUND) for i, p in enumerate(background_prompts)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(run_one, i, p) for i, p in enumerate(prompts)]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    latency, results = future.result()
+                    latencies.append(latency)
+                    figures += sum(1 for r in results if r.get("result") == "success")
+                except Exception:
+                    errors += 1
+        for future in background:
+            try:
+                background_latencies.append(future.result()[0])
+            except Exception:
+                errors += 1
+    return latencies, errors, figures
+
+
+def _run_process_prompt(backend, prompts, concurrency):
+    """Drive backend.main.process_prompt on one event loop, like uvicorn does"""
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(idx, prompt):
+            async with semaphore:
+                data = {
+                    "prompt": prompt,
+                    "conversationId": f"bench-conversation-{idx}",
+                    "walletAddress": f"0xbench{idx % concurrency:04x}",
+                }
+                start = time.perf_counter()
+                response = await backend.process_prompt(data)
+                return time.perf_counter() - start, response
+
+        return await asyncio.gather(
+            *(run_one(i, p) for i, p in enumerate(prompts)), return_exceptions=True
+        )
+
+    latencies, errors, figures = [], 0, 0
+    for outcome in asyncio.run(run_all()):
+        if isinstance(outcome, BaseException):
+            errors += 1
+            continue
+        latency, response = outcome
+        latencies.append(latency)
+        figures += len(response.get("filenames", []))
+    return latencies, errors, figures
+
+
+def _run_figure_analysis(agents, analyzer_client, prompts, concurrency, workdir):
+    """Drive AnalyzeFigureAgent with generated screenshots"""
+    from PIL import Image
+
+    image_path = os.path.join(workdir, "figure.png")
+    Image.new("RGB", (2400, 1400), (34, 34, 46)).save(image_path)
+    analyzer = agents.AnalyzeFigureAgent(client=analyzer_client, async_client=analyzer_client, use_cache=False)
+
+    def run_one(prompt):
+        start = time.perf_counter()
+        analyzer.analyze_figures([image_path], prompt)
+        return time.perf_counter() - start
+
+    latencies, errors = [], 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run_one, p) for p in prompts]:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    return latencies, errors, 0
+
+
+def run_benchmark(args) -> dict:
+    rng = random.Random(args.seed)
+    recorder = StageRecorder()
+    workdir = tempfile.mkdtemp(prefix="visualyze-bench-")
+
+    # The backend reads its database location at import time
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault("USAGE_DB", os.path.join(workdir, "usage.db"))
+    # Dune timeouts and request deadlines are read at import time too; scale them like the simulated latencies
+    for name, seconds in (
+        ("DUNE_MEDIUM_TIMEOUT", 30),
+        ("DUNE_QUERY_TIMEOUT", 300),
+        ("REQUEST_DEADLINE_SECONDS", 120),
+        ("DEADLINE_SQL_OPTIMIZATION_SECONDS", 30),
+        ("DEADLINE_SQL_RETRY_SECONDS", 45),
+        ("DEADLINE_PLOT_REFINE_SECONDS", 30),
+    ):
+        os.environ.setdefault(name, str(seconds * args.time_scale))
+
+    # Shared base extracts are opt-in, plan them when the fake LM may offer one
+    if args.shared_base_rate > 0:
+        os.environ.setdefault("SHARED_BASE_QUERY", "true")
+
+    # The fakes have no rate limits, do not let the shared limiters throttle them
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "0")
+    os.environ.setdefault("DUNE_REQUESTS_PER_MINUTE", "0")
+
+    with open("agents/utils/table_list.json", "r") as f:
+        table_names = [table["table_name"] for table in json.load(f)]
+
+    fake_lm = FakeLM(
+        recorder,
+        LatencyModel(args.llm_latency, args.time_scale, rng),
+        failure_rate=args.llm_failure_rate,
+        tasks_per_prompt=args.tasks_per_prompt,
+        plot_code_chars=args.plot_code_chars,
+        table_names=table_names,
+        shared_base_rate=args.shared_base_rate,
+        plot_invalid_rate=args.plot_invalid_rate,
+        rng=random.Random(args.seed + 1),
+    )
+    fake_dune = FakeDuneClient(
+        recorder,
+        LatencyModel(args.dune_create_latency, args.time_scale, rng),
+        LatencyModel(args.dune_latency, args.time_scale, rng),
+        LatencyModel(args.rows, 1.0, rng),
+        failure_rate=args.dune_failure_rate,
+        large_speedup=args.dune_large_speedup,
+        rng=random.Random(args.seed + 2),
+    )
+    fake_openai = FakeOpenAI(
+        recorder,
+        LatencyModel(args.vision_latency, args.time_scale, rng),
+        failure_rate=args.vision_failure_rate,
+        rng=random.Random(args.seed + 3),
+    )
+
+    import agents.main as agents
+    from agents.utils.dune_client import DuneQueryClient
+    from agents.utils.query_history import QueryHistory
+    from agents.utils.result_store import ResultStore
+
+    agents.init_agents(
+        lm_override=fake_lm,
+        dune_client_override=DuneQueryClient(
+            api_key="benchmark",
+            client=fake_dune,
+            history=QueryHistory(os.path.join(workdir, "query_history.db")),
+            store=ResultStore(os.path.join(workdir, "results")),
+            poll_seconds=args.time_scale,
+        ),
+    )
+
+    backend = None
+    if "process_prompt" in args.scenarios:
+        import backend.main as backend
+
+        backend.VISUALIZATIONS_DIR = os.path.join(workdir, "visualizations")
+        backend.DATA_DIR = os.path.join(workdir, "csv")
+        backend.TARGET_DATA_DIR = os.path.join(workdir, "public_data")
+        os.makedirs(backend.TARGET_DATA_DIR, exist_ok=True)
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+        },
+        "results": [],
+    }
+
+    for scenario in args.scenarios:
+        for concurrency in args.concurrency:
+            prompts = [
+                f"Benchmark prompt {i} about token transfer volume" for i in range(args.requests)
+            ]
+            background_prompts = [
+                f"Background prompt {i} about token transfer volume" for i in range(args.background_requests)
+            ]
+            background_latencies = []
+            recorder.reset()
+            if args.trace_memory:
+                tracemalloc.start()
+            stdout = io.StringIO() if not args.verbose else sys.stdout
+            with ThreadSampler() as sampler, contextlib.redirect_stdout(stdout):
+                start = time.perf_counter()
+                if scenario == "generate_figures":
+                    latencies, errors, figures = _run_generate_figures(
+                        agents, prompts, concurrency, workdir, background_prompts, background_latencies
+                    )
+                elif scenario == "process_prompt":
+                    latencies, errors, figures = _run_process_prompt(backend, prompts, concurrency)
+                elif scenario == "figure_analysis":
+                    latencies, errors, figures = _run_figure_analysis(
+                        agents, fake_openai, prompts, concurrency, workdir
+                    )
+                else:
+                    raise ValueError(f"Unknown scenario: {scenario}")
+                wall = time.perf_counter() - start
+            peak_memory = None
+            if args.trace_memory:
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            result = {
+                "scenario": scenario,
+                "concurrency": concurrency,
+                "requests": args.requests,
+                "errors": errors,
+                "figures": figures,
+                "wall_seconds": round(wall, 4),
+                "throughput_rps": round(len(latencies) / wall, 4) if wall else None,
+                "latency": _latency_summary(latencies),
+                "background_latency": _latency_summary(background_latencies),
+                "stages": recorder.summary(),
+                "peak_traced_memory_mb": round(peak_memory / 1024 / 1024, 2) if peak_memory else None,
+                "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+                "threads": sampler.summary(),
+            }
+            report["results"].append(result)
+            print(
+                f"{scenario:>16} c={concurrency:<3} {result['throughput_rps']} req/s "
+                f"p50={result['latency'].get('p50')}s p99={result['latency'].get('p99')}s errors={errors}",
+                file=sys.stderr,
+            )
+
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="generate_figures,process_prompt,figure_analysis",
+                        type=lambda s: s.split(","))
+    parser.add_argument("--concurrency", default="1,2,4,8", type=lambda s: [int(c) for c in s.split(",")])
+    parser.add_argument("--requests", default=8, type=int, help="Requests per concurrency level")
+    parser.add_argument("--background-requests", default=0, type=int,
+                        help="Background-priority prompts run alongside each generate_figures level")
+    parser.add_argument("--tasks-per-prompt", default=3, type=int)
+    parser.add_argument("--llm-latency", default="lognormal:3,0.5", help="Latency distribution of one LLM call")
+    parser.add_argument("--llm-failure-rate", default=0.0, type=float)
+    parser.add_argument("--shared-base-rate", default=0.5, type=float,
+                        help="Fraction of prompts whose tasks can share one base extract")
+    parser.add_argument("--plot-code-chars", default=12000, type=int, help="Size of the generated plot code")
+    parser.add_argument("--plot-invalid-rate", default=0.3, type=float,
+                        help="Share of generated plot code that fails the static checks and is refined")
+    parser.add_argument("--dune-create-latency", default="lognormal:0.5,0.3")
+    parser.add_argument("--dune-latency", default="lognormal:20,0.8", help="Latency distribution of one Dune execution")
+    parser.add_argument("--dune-failure-rate", default=0.1, type=float)
+    parser.add_argument("--dune-large-speedup", default=2.0, type=float,
+                        help="How much faster an execution runs on the large tier")
+    parser.add_argument("--rows", default="uniform:50,5000", help="Distribution of the result row count")
+    parser.add_argument("--vision-latency", default="lognormal:4,0.4")
+    parser.add_argument("--vision-failure-rate", default=0.0, type=float)
+    parser.add_argument("--time-scale", default=0.01, type=float,
+                        help="Multiplier applied to every simulated latency")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Track peak Python allocations with tracemalloc (slows the run down)")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's own output")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -1,48 +1,211 @@
+import asyncio
 import base64
-from openai import OpenAI
+import hashlib
+import io
 import os
+import threading
+import time
+from collections import OrderedDict
+from openai import AsyncOpenAI, OpenAI
+from PIL import Image, ImageOps
 from dotenv import load_dotenv
+from agents.utils.usage import usage_tracker
+from agents.utils.rate_limit import acall_with_backoff, call_with_backoff, llm_limiter
+from agents.utils.http_pool import async_http_client, http_client
 
 load_dotenv()
 
-client = OpenAI()
+# Longest side (in pixels) sent to the vision model, larger images are downscaled
+MAX_IMAGE_SIDE = int(os.getenv("FIGURE_MAX_IMAGE_SIDE", "1568"))
+# Quality used when re-encoding images as JPEG
+JPEG_QUALITY = int(os.getenv("FIGURE_JPEG_QUALITY", "85"))
+# Number of analysis results kept in memory
+ANALYSIS_CACHE_SIZE = int(os.getenv("FIGURE_ANALYSIS_CACHE_SIZE", "256"))
+
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+# One OpenAI client per process on top of the shared connection pool
+_client = None
+_client_lock = threading.Lock()
+
+
+def _shared_client() -> OpenAI:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Retries are coordinated by call_with_backoff and the shared rate limiter
+                _client = OpenAI(http_client=http_client(), max_retries=0)
+    return _client
 
 
 class AnalyzeFigureAgent:
-    def __init__(self):
-        self.client = OpenAI()
+    def __init__(
+        self,
+        max_image_side: int = MAX_IMAGE_SIDE,
+        jpeg_quality: int = JPEG_QUALITY,
+        use_cache: bool = True,
+        client: OpenAI = None,
+        async_client: AsyncOpenAI = None,
+    ):
+        self.client = client or _shared_client()
+        # Created per call unless injected, its connections belong to the running event loop
+        self.async_client = async_client
+        self.max_image_side = max_image_side
+        self.jpeg_quality = jpeg_quality
+        self.use_cache = use_cache
 
     def encode_image(self, image_path: str) -> str:
         """Encode image to base64 string"""
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode("utf-8")
 
-    def analyze_figures(
-        self, image_paths: list[str], prompt: str = "请分析这些图片并比较它们的内容"
-    ) -> str:
+    def preprocess_image(self, image_bytes: bytes) -> tuple[bytes, str]:
         """
-        Analyze multiple images using OpenAI Vision API
+        Downscale and recompress an image before it is sent to the vision model
 
         Args:
-            image_paths: List of paths to image files
-            prompt: Custom prompt for analysis
+            image_bytes: Raw bytes of the image file
+
+        Returns:
+            tuple: (encoded image bytes, mime type)
         """
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            original_mime = Image.MIME.get(image.format, "image/png")
+            image = ImageOps.exif_transpose(image)
+            resized = max(image.size) > self.max_image_side
+            if resized:
+                image.thumbnail(
+                    (self.max_image_side, self.max_image_side), Image.Resampling.LANCZOS
+                )
+
+            buffer = io.BytesIO()
+            image.convert("RGB").save(
+                buffer, format="JPEG", quality=self.jpeg_quality, optimize=True
+            )
+            encoded = buffer.getvalue()
+
+        # Keep the original file if recompressing does not make it smaller
+        if not resized and len(encoded) >= len(image_bytes):
+            return image_bytes, original_mime
+        return encoded, "image/jpeg"
+
+    def _cache_key(self, image_hashes: list[str], prompt: str) -> str:
+        key = hashlib.sha256()
+        key.update(os.getenv("MODEL_NAME", "").encode("utf-8"))
+        key.update(f"{self.max_image_side}:{self.jpeg_quality}".encode("utf-8"))
+        key.update(prompt.encode("utf-8"))
+        for image_hash in image_hashes:
+            key.update(image_hash.encode("utf-8"))
+        return key.hexdigest()
+
+    def _read_images(self, image_paths: list[str]) -> list[bytes]:
+        images = []
+        for image_path in image_paths:
+            with open(image_path, "rb") as image_file:
+                images.append(image_file.read())
+        return images
+
+    def _get_cached(self, cache_key: str):
+        if not self.use_cache:
+            return None
+        with _analysis_cache_lock:
+            if cache_key in _analysis_cache:
+                _analysis_cache.move_to_end(cache_key)
+                return _analysis_cache[cache_key]
+        return None
+
+    def _set_cached(self, cache_key: str, analysis: str):
+        if not self.use_cache:
+            return
+        with _analysis_cache_lock:
+            _analysis_cache[cache_key] = analysis
+            _analysis_cache.move_to_end(cache_key)
+            while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+                _analysis_cache.popitem(last=False)
+
+    def _build_request(self, images: list[bytes], prompt: str) -> dict:
         # Create message content starting with the text prompt
         content = [{"type": "text", "text": prompt}]
 
         # Add each image to the content
-        for image_path in image_paths:
-            base64_image = self.encode_image(image_path)
+        for image in images:
+            image_bytes, mime_type = self.preprocess_image(image)
+            base64_image = base64.b64encode(image_bytes).decode("utf-8")
             content.append(
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image}"},
+                    "image_url": {"url": f"data:{mime_type};base64,{base64_image}"},
                 }
             )
 
-        response = self.client.chat.completions.create(
-            model=os.getenv("MODEL_NAME"),
-            messages=[{"role": "user", "content": content}],
-            max_tokens=1000,
+        return {
+            "model": os.getenv("MODEL_NAME"),
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": 1000,
+        }
+
+    def _record_usage(self, response, seconds: float):
+        usage = getattr(response, "usage", None)
+        usage_tracker.record(
+            stage="figure_analysis",
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            seconds=seconds,
         )
-        return response.choices[0].message.content
+
+    def analyze_figures(
+        self, image_paths: list[str], prompt: str = "请分析这些图片并比较它们的内容"
+    ) -> str:
+        """
+        Analyze multiple images using OpenAI Vision API
+
+        Args:
+            image_paths: List of paths to image files
+            prompt: Custom prompt for analysis
+        """
+        images = self._read_images(image_paths)
+
+        # Identical images with the same prompt reuse the previous analysis
+        image_hashes = [hashlib.sha256(image).hexdigest() for image in images]
+        cache_key = self._cache_key(image_hashes, prompt)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+
+        request = self._build_request(images, prompt)
+        start = time.perf_counter()
+        response = call_with_backoff(llm_limiter, self.client.chat.completions.create, **request)
+        self._record_usage(response, time.perf_counter() - start)
+        analysis = response.choices[0].message.content
+        self._set_cached(cache_key, analysis)
+        return analysis
+
+    async def aanalyze_figures(
+        self, image_paths: list[str], prompt: str = "请分析这些图片并比较它们的内容"
+    ) -> str:
+        """
+        Async version of analyze_figures using the async OpenAI client
+
+        Args:
+            image_paths: List of paths to image files
+            prompt: Custom prompt for analysis
+        """
+        # Reading and preprocessing are blocking, keep them off the event loop
+        images = await asyncio.to_thread(self._read_images, image_paths)
+
+        image_hashes = [hashlib.sha256(image).hexdigest() for image in images]
+        cache_key = self._cache_key(image_hashes, prompt)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+
+        request = await asyncio.to_thread(self._build_request, images, prompt)
+        start = time.perf_counter()
+        async_client = self.async_client or AsyncOpenAI(http_client=async_http_client(), max_retries=0)
+        response = await acall_with_backoff(llm_limiter, async_client.chat.completions.create, **request)
+        self._record_usage(response, time.perf_counter() - start)
+        analysis = response.choices[0].message.content
+        self._set_cached(cache_key, analysis)
+        return analysis
@@ -0,0 +1,141 @@
+import dspy
+import os
+from typing import Optional
+import pandas as pd
+from prometheus_client import Counter
+from agents.utils.data_structures import ConversationDataset
+from agents.utils.dataset_store import DatasetMetadata, load_metadata
+from agents.utils.conversation_index import conversation_dataset_paths
+from agents.utils.local_engine import LOCAL_SQL_DIALECT, chain_local_queries, local_query_problem, run_local_query
+from agents.utils.tracing import span
+
+LOCAL_ANSWERS = Counter(
+    "visualyze_local_answers_total",
+    "Tasks answered from the datasets of their conversation instead of Dune",
+    ["outcome"],
+)
+
+
+class LocalAnswerability(dspy.Signature):
+    """You are an expert in data analysis. You are given a retrieval task and the datasets already fetched from Dune earlier in the same conversation. Decide whether the task can be answered from one of these datasets alone, e.g. by re-aggregating it (weekly instead of daily), filtering it (only Ethereum), ranking it or selecting some of its columns.
+    If so, write one local SQL query that computes the task's result from that dataset.
+
+    # Guidelines
+    1. Only answer locally when the dataset contains every column, row and time range the task needs; tasks that need other tables, a longer time range, a finer granularity or rows the dataset was filtered out must go to Dune, set answerable to False
+    2. The local query is a single SELECT statement that only reads from the table named `base`, written in the given local SQL dialect
+    3. Use the values as they appear in the sample rows when filtering (e.g. the spelling of a blockchain or token symbol)
+    4. Output a short csv filename that represents the result
+    """
+
+    task: str = dspy.InputField(prefix="The task:")
+    datasets: list[ConversationDataset] = dspy.InputField(prefix="Datasets of the conversation:")
+    local_sql_dialect: str = dspy.InputField(prefix="Local SQL dialect:")
+    reasoning: str = dspy.OutputField(prefix="Reasoning:")
+    answerable: bool = dspy.OutputField(prefix="Whether the task can be answered from one dataset:")
+    dataset_name: str = dspy.OutputField(prefix="The name of the dataset to use:")
+    local_sql: str = dspy.OutputField(prefix="The local SQL query over `base`:")
+    output_filename: str = dspy.OutputField(prefix="The csv filename:")
+
+
+class LoadedDataset:
+    def __init__(self, csv_path: str, metadata: DatasetMetadata, df: pd.DataFrame) -> None:
+        self.csv_path = csv_path
+        self.metadata = metadata
+        self.df = df
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(os.path.basename(self.csv_path))[0]
+
+    def describe(self) -> ConversationDataset:
+        time_range = "not a time series"
+        if self.metadata.time_column and self.metadata.time_column in self.df.columns:
+            values = self.df[self.metadata.time_column]
+            time_range = f"{self.metadata.time_column} from {values.min()} to {values.max()}"
+        return ConversationDataset(
+            name=self.name,
+            task=self.metadata.task,
+            columns={str(c): str(t) for c, t in self.df.dtypes.items()},
+            rows=len(self.df),
+            time_range=time_range,
+            sample_rows=self.df.head(3).to_dict(orient="records"),
+        )
+
+
+class LocalAnswer:
+    def __init__(self, df: pd.DataFrame, filename: str, sql: str, local_sql: str, source: str) -> None:
+        self.df = df
+        self.filename = filename
+        # Dune query and local query that recompute the dataset, e.g. on refresh
+        self.sql = sql
+        self.local_sql = local_sql
+        self.source = source
+
+
+def load_conversation_datasets(csv_dir: str, conversation_id: str) -> list[LoadedDataset]:
+    """Datasets generated earlier in the conversation, most recent first"""
+    datasets = []
+    for csv_path in conversation_dataset_paths(csv_dir, conversation_id):
+        metadata = load_metadata(csv_path)
+        if metadata is None:
+            continue
+        try:
+            datasets.append(LoadedDataset(csv_path, metadata, pd.read_csv(csv_path)))
+        except Exception as e:
+            print(f"⚠️ Could not load dataset {csv_path}: {str(e)}")
+    return datasets
+
+
+class LocalAnswerAgent:
+    def __init__(self, engine=None) -> None:
+        self.engine = engine
+        self.check_answerability = dspy.Predict(LocalAnswerability)
+
+    def answer(self, task: str, datasets: list[LoadedDataset]) -> Optional[LocalAnswer]:
+        """Answer the task from one of the conversation's datasets, None if it needs Dune"""
+        if not datasets:
+            return None
+        by_name = {dataset.name: dataset for dataset in datasets}
+
+        with span("local_answer", datasets=len(datasets)) as s:
+            response = self.check_answerability(
+                task=task,
+                datasets=[dataset.describe() for dataset in datasets],
+                local_sql_dialect=LOCAL_SQL_DIALECT,
+            )
+            print(f"Local answer reasoning: {response.reasoning}")
+            dataset = by_name.get(response.dataset_name)
+            if not response.answerable or dataset is None:
+                LOCAL_ANSWERS.labels(outcome="not_answerable").inc()
+                s.set(answerable=False)
+                return None
+
+            # The query is written from the user's prompt, only a read-only SELECT over base may run
+            problem = local_query_problem(response.local_sql, ["base"])
+            if problem:
+                print(f"❌Local query rejected for task {task}: {problem}")
+                LOCAL_ANSWERS.labels(outcome="rejected").inc()
+                s.fail(problem)
+                return None
+
+            try:
+                df = run_local_query(response.local_sql, {"base": dataset.df})
+            except Exception as e:
+                # A wrong local query costs milliseconds, the task just goes to Dune
+                print(f"❌Local query failed for task {task}: {str(e)}")
+                LOCAL_ANSWERS.labels(outcome="failed").inc()
+                s.fail(str(e))
+                return None
+            if df.empty:
+                LOCAL_ANSWERS.labels(outcome="empty").inc()
+                s.set(answerable=True, rows=0)
+                return None
+
+            LOCAL_ANSWERS.labels(outcome="answered").inc()
+            s.set(answerable=True, dataset=dataset.name, rows=len(df))
+
+        print(f"✅Answered task from dataset {dataset.name}: {response.local_sql}")
+        local_sql = response.local_sql
+        if dataset.metadata.local_sql:
+            local_sql = chain_local_queries(dataset.metadata.local_sql, local_sql)
+        return LocalAnswer(df, response.output_filename, dataset.metadata.sql, local_sql, dataset.name)
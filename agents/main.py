@@ -1,4 +1,5 @@
 import dspy
+import litellm
 from dotenv import load_dotenv
 import os
 import logging
@@ -8,7 +9,28 @@ from agents.utils.dune_client import DuneQueryClient
 from agents.planner import Planner
 from agents.plotter import PlotterAgent
 import concurrent.futures
+import threading
+import uuid
+from datetime import datetime, timezone
 from agents.figure_analyzer import AnalyzeFigureAgent
+from agents.local_answerer import LocalAnswerAgent, load_conversation_datasets
+from agents.pipeline import Completed, run_stages, stage_pool
+from agents.utils.tracing import request_context, request_id_var, span
+from agents.utils.metered_lm import MeteredLM
+from agents.utils.local_engine import LOCAL_SQL_DIALECT, run_local_query
+from agents.utils.dataset_store import record_dataset
+from agents.utils.scheduler import BACKGROUND, work_priority
+from agents.refresher import DatasetRefresher
+from agents.utils.sql_analysis import canonicalize_sql
+from agents.utils.http_pool import http_client
+from agents.utils.sql_retry import execute_with_retries
+from agents.utils.deadline import (
+    DEADLINES_EXCEEDED,
+    REQUEST_DEADLINE_SECONDS,
+    DeadlineExceeded,
+    deadline_scope,
+    remaining,
+)
 
 dspy.disable_litellm_logging()
 dspy.disable_logging()
@@ -20,18 +42,61 @@ for logger_name in loggers:
 
 load_dotenv()
 
+# Answer the tasks of a prompt from one shared Dune extract when they read the same subset. Opt-in:
+# planning the extract is one more LLM call before any task starts, paid even when the tasks share nothing
+SHARED_BASE_QUERY = os.getenv("SHARED_BASE_QUERY", "false").lower() == "true"
+# Row cap of the shared extract; a capped extract is incomplete and is not used
+BASE_EXTRACT_MAX_ROWS = int(os.getenv("BASE_EXTRACT_MAX_ROWS", "100000"))
+# Answer follow-up tasks from the datasets already fetched in the conversation when possible
+LOCAL_ANSWERS_ENABLED = os.getenv("LOCAL_ANSWERS_ENABLED", "true").lower() == "true"
+
+
+# The LM and the Dune client are created on first use (or by warm_up), so that
+# importing this module neither needs the API keys nor pays for client setup
+lm = None
+dune_client = None
+_init_lock = threading.Lock()
+
+
+def init_agents(lm_override=None, dune_client_override=None):
+    """
+    Configure the dspy LM and create the Dune client if not done yet
+
+    dspy only allows the thread that first configured it to reconfigure, so
+    overrides have to be passed on the first call (e.g. by benchmarks).
+    """
+    global lm, dune_client
+    if lm is not None and dune_client is not None:
+        return lm, dune_client
+
+    with _init_lock:
+        if lm is None:
+            # The OpenAI clients litellm creates reuse the shared connection pool
+            litellm.client_session = http_client()
+            lm = MeteredLM(
+                lm_override
+                or dspy.LM(
+                    model=os.getenv("MODEL_NAME"),
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    api_base=os.getenv("OPENAI_BASE_URL"),
+                    # Retries are coordinated by the shared rate limiter of MeteredLM
+                    num_retries=0,
+                )
+            )
+            dspy.configure(lm=lm)
+        if dune_client is None:
+            dune_client = dune_client_override or DuneQueryClient(
+                api_key=os.getenv("DUNE_API_KEY")
+            )
+    return lm, dune_client
 
-lm = dspy.LM(
-    model=os.getenv("MODEL_NAME"),
-    api_key=os.getenv("OPENAI_API_KEY"),
-    api_base=os.getenv("OPENAI_BASE_URL"),
-)
-dspy.configure(lm=lm)
 
-dune_client = DuneQueryClient(api_key=os.getenv("DUNE_API_KEY"))
+def warm_up():
+    """Initialize the agent stack ahead of the first request"""
+    init_agents()
 
 
-def plot_graph(prompt: str, task: str, csv_filepath: str):
+def plot_graph(prompt: str, task: str, csv_filepath: str, on_partial=None):
     df = pd.read_csv(csv_filepath)
     description = df.describe()
     sample_data = df.head(5)
@@ -39,7 +104,9 @@ def plot_graph(prompt: str, task: str, csv_filepath: str):
 
     file_name = os.path.basename(csv_filepath)
     file_name = "/data/" + file_name
-    viz_code = plotter.plot_by_prompt(prompt, task, file_name, description, sample_data)
+    viz_code = plotter.plot_by_prompt(
+        prompt, task, file_name, description, sample_data, on_partial=on_partial
+    )
     return viz_code
 
 
@@ -48,9 +115,154 @@ def analyze_figure(prompt: str, attachments: list[str]):
     return analyzer.analyze_figures(attachments, prompt)
 
 
-def generate_figures(prompt: str, csv_dir: str, viz_dir: str):
+async def aanalyze_figure(prompt: str, attachments: list[str]):
+    analyzer = AnalyzeFigureAgent()
+    return await analyzer.aanalyze_figures(attachments, prompt)
+
+
+def unique_filename(filename: str) -> str:
+    """Suffix a file name chosen by the LLM so that concurrent requests and worker processes never collide"""
+    return f"{os.path.basename(filename).replace('.csv', '')}_{uuid.uuid4().hex[:8]}"
+
+
+def derive_tasks_from_shared_base(prompt, tasks, planner, sql_generator, dune_client):
+    """
+    Run one shared base extract in Dune and derive each task's data from it locally
+
+    Returns:
+        dict: task -> (DataFrame, filename, base SQL, local SQL) for the tasks that could be derived;
+        the other tasks fall back to their own Dune query
+    """
+    with span("shared_base", tasks=len(tasks)) as s:
+        plan = planner.plan_shared_base(
+            prompt,
+            tasks,
+            sql_generator.candidate_tables(prompt),
+            local_sql_dialect=LOCAL_SQL_DIALECT,
+            max_base_rows=BASE_EXTRACT_MAX_ROWS,
+        )
+        if plan is None:
+            return {}
+
+        try:
+            base_table = sql_generator.catalog.get(plan.base_table)
+        except KeyError:
+            base_table = None
+        # The extract is LLM output like any task query: cost guard, and its own row cap
+        base_sql = sql_generator.guard_sql(prompt, base_table, plan.base_sql, max_rows=BASE_EXTRACT_MAX_ROWS)
+
+        base_df, error = dune_client.execute_query(base_sql)
+        if error:
+            print(f"❌Shared base extract failed: {error}")
+            s.fail(error)
+            return {}
+        if len(base_df) >= BASE_EXTRACT_MAX_ROWS:
+            print(f"❌Shared base extract hit the {BASE_EXTRACT_MAX_ROWS} row cap, querying each task instead")
+            s.set(rows=len(base_df), truncated=True)
+            return {}
+
+        derived = {}
+        for task, sql, filename in zip(tasks, plan.task_queries, plan.output_filenames):
+            try:
+                with span("local_query") as local:
+                    df = run_local_query(sql, {"base": base_df})
+                    local.set(rows=len(df))
+            except Exception as e:
+                print(f"❌Local query failed for task {task}: {str(e)}")
+                continue
+            if not df.empty:
+                if "stored_at" in base_df.attrs:
+                    df.attrs["stored_at"] = base_df.attrs["stored_at"]
+                derived[task] = (df, unique_filename(filename), base_sql, sql)
+        s.set(rows=len(base_df), derived=len(derived))
+        print(f"✅Derived {len(derived)}/{len(tasks)} tasks from the shared base extract")
+        return derived
+
+
+def refresh_dataset(csv_path: str, full: bool = False, request_id: str = None):
+    """Refresh a dataset written by generate_figures, incrementally when it is a time series"""
+    _, dune_client = init_agents()
+    with request_context(request_id), work_priority(BACKGROUND):
+        return DatasetRefresher(dune_client).refresh(csv_path, full=full)
+
+
+def prewarm_popular_queries(top_n: int, max_age: float, days: int = 7) -> dict:
+    """
+    Re-execute the most requested queries so that their results stay in the result store
+
+    Args:
+        top_n: number of popular queries to keep warm
+        max_age: stored results younger than this (in seconds) are left alone
+        days: popularity window
+
+    Returns:
+        dict: counts of refreshed, skipped and failed queries
+    """
+    _, dune_client = init_agents()
+    stats = {"refreshed": 0, "skipped": 0, "failed": 0}
+    with request_context(), work_priority(BACKGROUND), span("prewarm", top_n=top_n) as s:
+        for query in dune_client.history.popular_queries(limit=top_n, days=days):
+            age = dune_client.store.age(canonicalize_sql(query["sql"]))
+            if age is not None and age < max_age:
+                stats["skipped"] += 1
+                continue
+            _, error = dune_client.execute_query(query["sql"], refresh=True, prewarm=True)
+            if error:
+                print(f"❌Prewarming query {query['sql_key']} failed: {error}")
+                stats["failed"] += 1
+            else:
+                stats["refreshed"] += 1
+        s.set(**stats)
+    return stats
+
+
+def _terminate_queries(dune_client, request_id: str):
+    try:
+        cancelled = dune_client.terminate_queries(request_id)
+        print(f"🛑 Terminated {cancelled} ongoing Dune client queries")
+    except Exception as e:
+        print(f"⚠️ Could not terminate Dune client queries: {str(e)}")
+
+
+def generate_figures(
+    prompt: str,
+    csv_dir: str,
+    viz_dir: str,
+    request_id: str = None,
+    deadline_seconds: float = REQUEST_DEADLINE_SECONDS,
+    conversation_id: str = None,
+    on_partial=None,
+):
+    """
+    Plan the prompt into tasks and produce one dataset and visualization per task
+
+    Tasks that only re-aggregate or filter a dataset fetched earlier in the
+    conversation are answered locally instead of in Dune. The request
+    returns at its deadline with the tasks completed so far; the tasks
+    still running are listed with result "timeout".
+
+    With on_partial, the plot code is streamed: on_partial(event) receives
+    the reasoning and code of each task as they are generated, and the
+    visualization is written progressively to `<file>.js.partial`.
+    """
+    with request_context(request_id), deadline_scope(deadline_seconds), span("generate_figures") as s:
+        try:
+            results = _generate_figures(prompt, csv_dir, viz_dir, conversation_id, on_partial)
+        except DeadlineExceeded as e:
+            # The deadline passed while planning, no task was started
+            DEADLINES_EXCEEDED.inc()
+            print(f"⏱️ {str(e)}")
+            results = []
+        s.set(figures=sum(1 for r in results if r["result"] == "success"))
+        return results
+
+
+def _generate_figures(
+    prompt: str, csv_dir: str, viz_dir: str, conversation_id: str = None, on_partial=None
+):
     os.makedirs(csv_dir, exist_ok=True)
     os.makedirs(viz_dir, exist_ok=True)
+    _, dune_client = init_agents()
 
     planner = Planner()
     sql_generator = SqlGenerateAgent(
@@ -64,116 +276,207 @@ def generate_figures(prompt: str, csv_dir: str, viz_dir: str):
     tasks = planner.split_task_by_prompt(prompt)
     results = []
 
-    def process_task(task, sql_generator, dune_client, csv_dir, viz_dir, prompt):
-        result = {"task": task, "result": "failed"}
+    conversation_datasets = []
+    if LOCAL_ANSWERS_ENABLED and conversation_id:
+        conversation_datasets = load_conversation_datasets(csv_dir, conversation_id)
+    local_answerer = LocalAnswerAgent()
 
-        sql_result, output_filename, table_detail = (
-            sql_generator.generate_sql_by_prompt(task)
-        )
-        task_filename = os.path.basename(output_filename).replace(".csv", "")
-        msg = f"✅Processing task: {task}"
-        msg += f"\n✅SQL Result: {sql_result}"
-        msg += f"\n✅Task Filename: {task_filename}"
-        print(msg)
-
-        df, error = dune_client.execute_query(sql_result)
-
-        if error:
-            print(f"❌Error: {error}")
-            refined_sql = sql_generator.retry_generate_sql_by_prompt(
-                task, sql_result, error, table_detail
+    shared_results = {}
+    if SHARED_BASE_QUERY and len(tasks) > 1:
+        try:
+            shared_results = derive_tasks_from_shared_base(
+                prompt, tasks, planner, sql_generator, dune_client
             )
-            print(f"✅Refined SQL: {refined_sql}")
-            df, error = dune_client.execute_query(refined_sql)
+        except Exception as e:
+            print(f"❌Shared base planning failed: {str(e)}")
 
-        # if still error, skip the task
-        if error:
-            print(f"❌Error: {error}")
-            result["error"] = error
-            return result
-
-        print(f"✅Successfully executed query: {task_filename}")
+    def _answer_locally(task):
+        if not conversation_datasets:
+            return None
+        try:
+            return local_answerer.answer(task, conversation_datasets)
+        except Exception as e:
+            print(f"❌Local answer failed for task {task}: {str(e)}")
+            return None
+
+    # Each task runs as three stages on the process-wide pools: the SQL stage (LLM bound),
+    # the Dune stage (waits on executions) and the plot stage (LLM bound); a stage only
+    # takes a worker of its own pool, see agents/pipeline.py
+    def sql_stage(task):
+        with span("task_sql"):
+            if task in shared_results:
+                df, task_filename, sql, local_sql = shared_results[task]
+                print(f"✅Using the shared base extract for task: {task}")
+                return {"task": task, "df": df, "file_name": task_filename, "sql": sql, "local_sql": local_sql}
+
+            local_answer = _answer_locally(task)
+            if local_answer is not None:
+                print(f"✅Using dataset {local_answer.source} of the conversation for task: {task}")
+                return {
+                    "task": task,
+                    "df": local_answer.df,
+                    "file_name": unique_filename(local_answer.filename),
+                    "sql": local_answer.sql,
+                    "local_sql": local_answer.local_sql,
+                }
+
+            sql_result, output_filename, table_detail = (
+                sql_generator.generate_sql_by_prompt(task)
+            )
+            task_filename = unique_filename(output_filename)
+            msg = f"✅Processing task: {task}"
+            msg += f"\n✅SQL Result: {sql_result}"
+            msg += f"\n✅Task Filename: {task_filename}"
+            print(msg)
+            return {
+                "task": task,
+                "df": None,
+                "file_name": task_filename,
+                "sql": sql_result,
+                "local_sql": None,
+                "table_detail": table_detail,
+            }
+
+    def dune_stage(job):
+        task = job["task"]
+        if job["df"] is None:
+            with span("task_dune") as s:
+                # Fix SQL errors with the LLM, re-run transient failures, give up on permanent ones
+                df, error, sql, _ = execute_with_retries(
+                    job["sql"],
+                    execute=dune_client.execute_query,
+                    fix=lambda sql, error: sql_generator.retry_generate_sql_by_prompt(
+                        task, sql, error, job["table_detail"]
+                    ),
+                )
+                # if still error, skip the task
+                if error:
+                    print(f"❌Error: {error}")
+                    s.fail(error)
+                    return Completed({"task": task, "result": "failed", "error": error})
+                job["df"], job["sql"] = df, sql
+
+        print(f"✅Successfully executed query: {job['file_name']}")
 
         # if df is empty, skip the task
-        if df.empty:
-            print(f"❌Error: {error}")
-            result["result"] = "No information found for this task"
-            return result
-
-        csv_path = os.path.join(csv_dir, f"{task_filename}.csv")
-        if df is not None:
-            df.to_csv(csv_path, index=False)
-            viz_path = os.path.join(viz_dir, f"{task_filename}.js")
-            if df is not None:
-                viz_code = plot_graph(prompt, task, csv_path)
-                with open(viz_path, "w") as f:
-                    f.write(viz_code)
-                result["file_name"] = task_filename
-                result["result"] = "success"
-        else:
-            result["result"] = "No information found for this task"
-            return result
+        if job["df"] is None or job["df"].empty:
+            return Completed({"task": task, "result": "No information found for this task"})
+        return job
+
+    def plot_stage(job):
+        task, task_filename, df = job["task"], job["file_name"], job["df"]
+        with span("task_plot"):
+            csv_path = os.path.join(csv_dir, f"{task_filename}.csv")
+            with span("csv_write", rows=len(df)) as s:
+                df.to_csv(csv_path, index=False)
+                s.set(bytes=os.path.getsize(csv_path))
+            # Remember the query and the time axis so the dataset can be refreshed later
+            try:
+                record_dataset(csv_path, df, task, job["sql"], job["local_sql"], conversation_id)
+            except Exception as e:
+                print(f"⚠️ Could not record dataset metadata: {str(e)}")
 
+            viz_path = os.path.join(viz_dir, f"{task_filename}.js")
+            plot_partial = _plot_partial_writer(task, task_filename, viz_path) if on_partial else None
+            viz_code = plot_graph(prompt, task, csv_path, on_partial=plot_partial)
+            with open(viz_path, "w") as f:
+                f.write(viz_code)
+            if plot_partial is not None and os.path.exists(f"{viz_path}.partial"):
+                os.remove(f"{viz_path}.partial")
+        result = {"task": task, "result": "success", "file_name": task_filename}
+        if "stored_at" in df.attrs:
+            # Served from the result store rather than executed now, the user sees how old the data is
+            result["data_as_of"] = datetime.fromtimestamp(df.attrs["stored_at"], timezone.utc).isoformat()
         return result
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [
-            executor.submit(
-                process_task, task, sql_generator, dune_client, csv_dir, viz_dir, prompt
-            )
-            for task in tasks
-        ]
-        
-        # Add 1 minute timeout
-        try:
-            # Set a timeout for the entire group of futures
-            completed_futures = []
-            for future in concurrent.futures.as_completed(futures, timeout=60):
-                try:
-                    result = future.result()
-                    completed_futures.append(future)
-                    if result.get('result') == 'failed':
-                        print(f"❌ Task failed with error: {result.get('error')}")
-                    else:
-                        results.append(result)
-                        print(f"✅ Task completed successfully: {result.get('task', 'Unknown')[:50]}...")
-                except Exception as e:
-                    print(f"❌ Task failed with error: {str(e)}")
-        except concurrent.futures.TimeoutError:
-            print("❌ Timeout reached after 1 minute. Cancelling remaining tasks...")
-            # Cancel any pending futures
-            timed_out_futures = [f for f in futures if f not in completed_futures]
-            print(f"⏱️ {len(timed_out_futures)} tasks timed out and will be cancelled")
-            
-            # Get results from completed tasks only
-            for future in completed_futures:
-                if future.done() and not future.cancelled():
-                    try:
-                        if future.result() not in results:  # Avoid duplicates
-                            results.append(future.result())
-                    except Exception as e:
-                        print(f"❌ Error retrieving result: {str(e)}")
-            
-            # Cancel remaining tasks and force terminate Dune client connections
-            for future in timed_out_futures:
-                future.cancel()
-            
-            # Force stop any ongoing Dune client operations
+    def _plot_partial_writer(task, task_filename, viz_path):
+        """Forward the streamed plot code of a task and write it to the partial visualization file"""
+        partial_path = f"{viz_path}.partial"
+        current_stage = None
+
+        def plot_partial(stage, field, delta):
+            nonlocal current_stage
+            if field in ("plot_code", "refined_code"):
+                # The refined code replaces the draft
+                with open(partial_path, "w" if stage != current_stage else "a") as f:
+                    f.write(delta)
+                current_stage = stage
             try:
-                # This will depend on how your DuneQueryClient is implemented
-                dune_client.terminate_all_queries()
-                print("🛑 Terminated all ongoing Dune client queries")
+                on_partial({
+                    "task": task,
+                    "fileName": task_filename,
+                    "stage": stage,
+                    "field": field,
+                    "delta": delta,
+                })
             except Exception as e:
-                print(f"⚠️ Could not terminate Dune client queries: {str(e)}")
+                print(f"⚠️ Could not forward partial plot output: {str(e)}")
+
+        return plot_partial
+
+    def collect(future):
+        try:
+            result = future.result()
+            if result.get('result') == 'failed':
+                print(f"❌ Task failed with error: {result.get('error')}")
+            else:
+                results.append(result)
+                print(f"✅ Task completed successfully: {result.get('task', 'Unknown')[:50]}...")
+        except Exception as e:
+            print(f"❌ Task failed with error: {str(e)}")
+
+    stages = [
+        (stage_pool("sql"), sql_stage),
+        (stage_pool("dune"), dune_stage),
+        (stage_pool("plot"), plot_stage),
+    ]
+    # The stages run in the current context to keep the request ID and deadline
+    futures = {run_stages(stages, task): task for task in tasks}
+    collected = set()
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=remaining()):
+            collected.add(future)
+            collect(future)
+    except concurrent.futures.TimeoutError:
+        DEADLINES_EXCEEDED.inc()
+        for future, task in futures.items():
+            if future in collected:
+                continue
+            if future.done():
+                collect(future)
+            else:
+                results.append({"task": task, "result": "timeout"})
+        timed_out = sum(1 for r in results if r["result"] == "timeout")
+        print(f"⏱️ Deadline reached, returning partial results; {timed_out} tasks did not finish")
+
+        # Cancel the Dune executions started by this request so their workers return,
+        # in the background so that the partial results are returned right away
+        threading.Thread(
+            target=_terminate_queries, args=(dune_client, request_id_var.get()), daemon=True
+        ).start()
+    finally:
+        # Return without waiting for running stages, they stop at their next deadline check;
+        # the stages not started yet are skipped
+        for future in futures:
+            future.cancel()
 
     return results
 
 
-def main(prompt: str, csv_dir: str, viz_dir: str, attachments: list[str] = None):
+def main(
+    prompt: str,
+    csv_dir: str,
+    viz_dir: str,
+    attachments: list[str] = None,
+    conversation_id: str = None,
+    on_partial=None,
+):
     if attachments:
         return analyze_figure(prompt, attachments)
     else:
-        return generate_figures(prompt, csv_dir, viz_dir)
+        return generate_figures(
+            prompt, csv_dir, viz_dir, conversation_id=conversation_id, on_partial=on_partial
+        )
 
 
 if __name__ == "__main__":
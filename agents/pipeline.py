@@ -0,0 +1,213 @@
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from prometheus_client import Gauge, Histogram
+
+from agents.utils.scheduler import BACKGROUND, INTERACTIVE, FairQueue, background_limit, priority_var
+from agents.utils.tracing import wallet_address_var
+
+# Workers of each stage pool, shared by all requests of the process. SQL generation and plotting
+# are bound by the LLM, Dune execution mostly waits on polling, so it gets many more workers.
+PIPELINE_SQL_WORKERS = int(os.getenv("PIPELINE_SQL_WORKERS", "8"))
+PIPELINE_DUNE_WORKERS = int(os.getenv("PIPELINE_DUNE_WORKERS", "32"))
+PIPELINE_PLOT_WORKERS = int(os.getenv("PIPELINE_PLOT_WORKERS", "8"))
+
+STAGE_QUEUED = Gauge(
+    "visualyze_pipeline_queued", "Task stages waiting for a worker of their pool", ["pool"]
+)
+STAGE_QUEUE_SECONDS = Histogram(
+    "visualyze_pipeline_queue_seconds",
+    "Time a task stage waited for a worker of its pool",
+    ["pool"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+class Completed:
+    """Returned by a stage to finish the task early, the remaining stages are skipped"""
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+
+class StagePool:
+    """
+    Worker threads dedicated to one kind of work (LLM calls, Dune polling, ...)
+
+    Queued stages are dispatched by priority class and fair share of wallets
+    (see FairQueue), and background stages hold at most a share of the
+    workers, so that interactive requests keep finding a free one.
+    """
+
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self.max_background = background_limit(max_workers)
+        self._queue = FairQueue(name)
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._idle = 0
+        self._running_background = 0
+        self._shutdown = False
+
+    def submit(self, context: contextvars.Context, fn: Callable, *args) -> concurrent.futures.Future:
+        """Run fn(*args) on the pool inside a copy of the given context"""
+        priority = context.get(priority_var, INTERACTIVE)
+        future = concurrent.futures.Future()
+        queued_at = time.monotonic()
+
+        def run():
+            STAGE_QUEUE_SECONDS.labels(pool=self.name).observe(time.monotonic() - queued_at)
+            return context.copy().run(fn, *args)
+
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError(f"The {self.name} pool was shut down")
+            self._queue.push((future, run), priority, context.get(wallet_address_var))
+            STAGE_QUEUED.labels(pool=self.name).inc()
+            if self._idle:
+                self._wake()
+            elif len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._work, name=f"pipeline-{self.name}-{len(self._threads)}", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def _next(self):
+        """The next stage to run, None once the pool is shut down"""
+        with self._condition:
+            while True:
+                if self._shutdown:
+                    return None
+                entry = self._queue.pop(allow_background=self._running_background < self.max_background)
+                if entry is not None:
+                    STAGE_QUEUED.labels(pool=self.name).dec()
+                    priority, (future, run) = entry
+                    if priority == BACKGROUND:
+                        self._running_background += 1
+                    return priority, future, run
+                self._idle += 1
+                self._condition.wait()
+
+    def _wake(self):
+        # Counted here rather than by the woken worker, so that two submits do not notify the same one
+        self._idle -= 1
+        self._condition.notify()
+
+    def _work(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            priority, future, run = entry
+            try:
+                # False when the task was cancelled while queued
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(run())
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                if priority == BACKGROUND:
+                    with self._condition:
+                        self._running_background -= 1
+                        # A background stage may be waiting for this slot
+                        if self._idle and self._queue.queued(BACKGROUND):
+                            self._wake()
+
+    def shutdown(self, wait: bool = True):
+        with self._condition:
+            self._shutdown = True
+            queued = self._queue.drain()
+            STAGE_QUEUED.labels(pool=self.name).dec(len(queued))
+            self._condition.notify_all()
+        for future, _ in queued:
+            future.cancel()
+        if wait:
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+
+_pools: Dict[str, StagePool] = {}
+_pools_lock = threading.Lock()
+
+
+def stage_pool(name: str) -> StagePool:
+    """The process-wide pool of a stage: "sql", "dune" or "plot\""""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            max_workers = {
+                "sql": PIPELINE_SQL_WORKERS,
+                "dune": PIPELINE_DUNE_WORKERS,
+                "plot": PIPELINE_PLOT_WORKERS,
+            }[name]
+            pool = _pools[name] = StagePool(name, max_workers)
+        return pool
+
+
+def shutdown_pools(wait: bool = True):
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait)
+
+
+def run_stages(stages: List[Tuple[StagePool, Callable]], value: Any = None) -> concurrent.futures.Future:
+    """
+    Run a task as a chain of stages, each on its own pool
+
+    Each stage function receives the result of the previous one (the first
+    one receives `value`) and is queued on its pool only when the previous
+    stage is done, so a task never holds a worker of one pool while it
+    waits for another. Stages run in the context of the caller (request ID,
+    deadline, ...).
+
+    Returns:
+        Future: result of the last stage, or the value of a Completed
+        returned earlier; cancelling it skips the stages not started yet
+    """
+    context = contextvars.copy_context()
+    result = concurrent.futures.Future()
+
+    def finish(set_outcome, outcome):
+        try:
+            set_outcome(outcome)
+        except concurrent.futures.InvalidStateError:
+            # Cancelled in the meantime, e.g. at the request deadline
+            pass
+
+    def start(index: int, value: Any):
+        if result.cancelled():
+            return
+        if isinstance(value, Completed):
+            return finish(result.set_result, value.value)
+        if index == len(stages):
+            return finish(result.set_result, value)
+
+        pool, fn = stages[index]
+        try:
+            future = pool.submit(context, fn, value)
+        except RuntimeError as e:
+            # The pool was shut down
+            return finish(result.set_exception, e)
+
+        def on_done(future: concurrent.futures.Future):
+            if future.cancelled():
+                return finish(result.set_exception, concurrent.futures.CancelledError())
+            if future.exception() is not None:
+                return finish(result.set_exception, future.exception())
+            start(index + 1, future.result())
+
+        future.add_done_callback(on_done)
+
+    start(0, value)
+    return result
@@ -1,6 +1,10 @@
 import dspy
 from pydantic import BaseModel
 import json
+from typing import Optional
+from agents.utils.data_structures import FullTable, SharedBasePlan
+from agents.utils.tracing import span
+from agents.utils.usage import usage_tracker
 
 
 class TaskSplitter(dspy.Signature):
@@ -15,19 +19,89 @@ class TaskSplitter(dspy.Signature):
     tasks: list[str] = dspy.OutputField(prefix="The list of tasks:")
 
 
+class SharedBaseQueryPlanner(dspy.Signature):
+    """You are an expert in Dune Analytics. You are given a user's prompt and the list of tasks it was split into. Decide whether the tasks can all be answered from one shared subset of a single table (e.g. the same table filtered by the same wallet, token, chain or time range).
+    If so, write one Trino SQL query that extracts this subset from Dune as a compact base extract, and for each task one local SQL query that derives the task's result from the extract.
+
+    # Guidelines
+    1. Only use a shared base when every task reads the same table with compatible filters, otherwise set use_shared_base to False
+    2. The base query selects only the columns the tasks need and applies the shared filters; pre-aggregate (e.g. per day) when every task allows it
+    3. The base query must end with LIMIT max_base_rows
+    4. Each local query reads from the table named `base` and is written in the given local SQL dialect
+    5. Return exactly one local query and one short csv filename per task, in the order of the tasks
+    6. For varbinary type columns, you should output the hex format of the column value instead of string (i.e., 0x1234567890 instead of '0x1234567890')
+    """
+
+    prompt: str = dspy.InputField(prefix="User's prompt:")
+    tasks: list[str] = dspy.InputField(prefix="The list of tasks:")
+    table_list: list[FullTable] = dspy.InputField(prefix="Available table list:")
+    local_sql_dialect: str = dspy.InputField(prefix="Local SQL dialect:")
+    max_base_rows: int = dspy.InputField(prefix="Maximum number of rows of the base extract:")
+    reasoning: str = dspy.OutputField(prefix="Reasoning:")
+    use_shared_base: bool = dspy.OutputField(prefix="Whether to use a shared base extract:")
+    base_table: str = dspy.OutputField(prefix="The table of the base extract:")
+    base_sql: str = dspy.OutputField(prefix="The Trino SQL query of the base extract:")
+    task_queries: list[str] = dspy.OutputField(prefix="The local SQL query of each task:")
+    output_filenames: list[str] = dspy.OutputField(prefix="The csv filename of each task:")
+
+
 class Planner:
     def __init__(self, engine=None) -> None:
         self.engine = engine
         self.split_task = dspy.Predict(TaskSplitter)
+        self.plan_base = dspy.Predict(SharedBaseQueryPlanner)
 
     def split_task_by_prompt(self, prompt: str):
+        # Do not pay for planning a request the budget does not cover
+        usage_tracker.check_budget()
+
+        with span("plan") as s:
+            response = self.split_task(prompt=prompt)
+            reasoning = response.reasoning
+            tasks = response.tasks
+            s.set(tasks=len(tasks))
 
-        response = self.split_task(prompt=prompt)
-        reasoning = response.reasoning
-        tasks = response.tasks
+        # Degrade gracefully when the token budget is tight
+        max_tasks = usage_tracker.max_planner_tasks()
+        if max_tasks and len(tasks) > max_tasks:
+            print(f"Capping {len(tasks)} tasks to {max_tasks} to stay within the token budget")
+            tasks = tasks[:max_tasks]
         print(f"Reasoning: {reasoning}")
         print(f"The list of tasks:")
         for idx, task in enumerate(tasks):
             print(f"  {idx+1}. {task}")
 
         return tasks
+
+    def plan_shared_base(
+        self,
+        prompt: str,
+        tasks: list[str],
+        table_list: list[FullTable],
+        local_sql_dialect: str,
+        max_base_rows: int,
+    ) -> Optional[SharedBasePlan]:
+        """Plan one Dune base extract that all tasks can be derived from, None if there is none"""
+        with span("shared_base_plan", tasks=len(tasks)) as s:
+            response = self.plan_base(
+                prompt=prompt,
+                tasks=tasks,
+                table_list=table_list,
+                local_sql_dialect=local_sql_dialect,
+                max_base_rows=max_base_rows,
+            )
+            s.set(use_shared_base=bool(response.use_shared_base))
+        print(f"Shared base reasoning: {response.reasoning}")
+
+        if not response.use_shared_base:
+            return None
+        if len(response.task_queries) != len(tasks) or len(response.output_filenames) != len(tasks):
+            print(f"Shared base plan does not cover every task, falling back to one query per task")
+            return None
+        print(f"Shared base extract of {response.base_table}: {response.base_sql}")
+        return SharedBasePlan(
+            base_table=response.base_table,
+            base_sql=response.base_sql,
+            task_queries=response.task_queries,
+            output_filenames=response.output_filenames,
+        )
@@ -1,6 +1,23 @@
 import dspy
+import os
 from pydantic import BaseModel
 import json
+from prometheus_client import Counter
+from agents.utils.tracing import span
+from agents.utils.usage import usage_tracker
+from agents.utils.deadline import has_time_for
+from agents.utils.llm_stream import FieldStreamParser, stream_llm_output
+from agents.utils.js_validator import validate_plot_code
+from contextlib import contextmanager, nullcontext
+
+# Refine every plot, as before the static checks, instead of only the plots that fail them
+PLOT_ALWAYS_REFINE = os.getenv("PLOT_ALWAYS_REFINE", "false").lower() == "true"
+
+PLOT_REFINE_DECISIONS = Counter(
+    "visualyze_plot_refine_decisions_total",
+    "Whether the generated plot code was refined, by reason",
+    ["decision"],
+)
 
 
 class Plotter(dspy.Signature):
@@ -81,7 +98,7 @@ class CodeRefiner(dspy.Signature):
     """You are an expert in D3.js. You are given a user's prompt and a table. You need to plot the data in the table using d3js. Read the data from the csv file and plot the data using d3js.
 
     # Guidelines:
-    1. Fix the bugs in the d3js code.
+    1. Fix the bugs in the d3js code, starting with the problems found by the static checks.
     2. Do not return jsx element, use this method:   return React.createElement("div", { ref: chartRef, className: "w-full h-full bg-[#22222E]" });
     3. Put your rendering logic in a function and use a resize observer to call the rendering function so that the graph adjust dynamically based on the container size
     ```javascript
@@ -101,6 +118,7 @@ class CodeRefiner(dspy.Signature):
     description = dspy.InputField(prefix="The description of the table:")
     sample_data = dspy.InputField(prefix="The sample data of the table (first 5 rows):")
     plot_code = dspy.InputField(prefix="The plot d3.js code:")
+    problems: str = dspy.InputField(prefix="Problems found by the static checks of the code:")
     refined_code: str = dspy.OutputField(prefix="The refined d3.js code:")
 
 
@@ -131,27 +149,91 @@ class PlotterAgent:
         self.refine_js = dspy.Predict(CodeRefiner, max_tokens=16000)
         self.refine_responsive_js = dspy.Predict(ResponsivePlotter, max_tokens=16000)
 
+    @contextmanager
+    def _streaming(self, stage: str, on_partial):
+        """Forward the fields of the LLM completion to on_partial(stage, field, delta) as they arrive"""
+        parser = FieldStreamParser()
+
+        def on_text(text):
+            if text is None:
+                parser.reset()
+                return
+            for field, delta in parser.feed(text):
+                on_partial(stage, field, delta)
+
+        with stream_llm_output(on_text):
+            yield
+        for field, delta in parser.flush():
+            on_partial(stage, field, delta)
+
     def plot_by_prompt(
-        self, prompt: str, task: str, file_name: str, description: str, sample_data: str
+        self,
+        prompt: str,
+        task: str,
+        file_name: str,
+        description: str,
+        sample_data: str,
+        on_partial=None,
     ):
-        response = self.plot_js(
-            prompt=prompt,
-            task=task,
-            file_name=file_name,
-            description=description,
-            sample_data=sample_data,
-        )
-        plot_code = response.plot_code
+        """
+        Generate the d3.js code of a figure, and refine it if it fails the static checks
+
+        With on_partial, both completions are streamed and their reasoning and
+        code are passed to on_partial(stage, field, delta) as they arrive.
+        """
+        def streaming(stage):
+            return self._streaming(stage, on_partial) if on_partial else nullcontext()
+
+        with span("plot", file_name=file_name) as s, streaming("plot"):
+            response = self.plot_js(
+                prompt=prompt,
+                task=task,
+                file_name=file_name,
+                description=description,
+                sample_data=sample_data,
+            )
+            plot_code = response.plot_code
+            s.set(bytes=len(plot_code))
         # print(f"The plot code: {plot_code}")
 
-        plot_code = self.refine_js(
-            prompt=prompt,
-            task=task,
-            file_name=file_name,
-            description=description,
-            sample_data=sample_data,
-            plot_code=plot_code,
-        ).refined_code
+        # Only code that fails the static checks pays for the refinement pass
+        with span("plot_validation", file_name=file_name) as s:
+            problems = validate_plot_code(plot_code, file_name)
+            s.set(problems=len(problems))
+        if not problems and not PLOT_ALWAYS_REFINE:
+            PLOT_REFINE_DECISIONS.labels(decision="valid").inc()
+            return plot_code
+        if problems:
+            print(f"Plot code failed {len(problems)} static checks: {problems}")
+
+        # Skip the refinement pass once the token budget is used up
+        if usage_tracker.budget_exceeded():
+            PLOT_REFINE_DECISIONS.labels(decision="budget").inc()
+            print("Token budget exceeded, skipping plot code refinement")
+            return plot_code
+        if not has_time_for("plot_refine"):
+            PLOT_REFINE_DECISIONS.labels(decision="deadline").inc()
+            print("Deadline is near, skipping plot code refinement")
+            return plot_code
+
+        PLOT_REFINE_DECISIONS.labels(decision="refined" if problems else "always").inc()
+        with span("plot_refine", file_name=file_name, problems=len(problems)) as s, streaming("plot_refine"):
+            refined_code = self.refine_js(
+                prompt=prompt,
+                task=task,
+                file_name=file_name,
+                description=description,
+                sample_data=sample_data,
+                plot_code=plot_code,
+                problems="\n".join(f"- {problem}" for problem in problems) or "No problems found",
+            ).refined_code
+            refined_problems = validate_plot_code(refined_code, file_name)
+            s.set(bytes=len(refined_code), remaining_problems=len(refined_problems))
+        # Keep the draft if the refinement made things worse, e.g. a truncated completion
+        if len(refined_problems) > len(problems):
+            print(f"Refined plot code fails more static checks ({refined_problems}), keeping the draft")
+            return plot_code
+        plot_code = refined_code
 
         # response = self.refine_responsive_js(
         #     prompt=prompt,
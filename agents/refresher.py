@@ -0,0 +1,116 @@
+import dspy
+import os
+from datetime import datetime
+import pandas as pd
+from agents.utils.dataset_store import (
+    boundary_literal,
+    load_metadata,
+    merge_delta,
+    parse_times,
+    save_metadata,
+    wrap_delta_sql,
+)
+from agents.utils.file_lock import LockBusy, file_lock
+from agents.utils.local_engine import run_local_query
+from agents.utils.sql_analysis import without_order_and_limit
+from agents.utils.tracing import span
+
+
+class IncrementalSqlRewriter(dspy.Signature):
+    """Given a Trino SQL query that produced a time-series dataset, rewrite it so that it only computes the rows from the high-water mark on, directly return the Trino SQL query without including ```sql```.
+
+    # Guidelines
+    1. Add the filter on the raw time column of the source table (e.g. block_time >= boundary) so that Dune only scans the delta window; keep existing partition filters such as block_date
+    2. The boundary is the start of the last bucket of the existing dataset, filter with >= so that this bucket is recomputed completely
+    3. Keep the selected columns, their names, the grouping and the ordering unchanged
+    4. Remove any LIMIT that would cut the delta window short
+    """
+
+    original_trino_sql_query: str = dspy.InputField(prefix="The original Trino SQL query:")
+    time_column: str = dspy.InputField(prefix="The time column of the result:")
+    boundary: str = dspy.InputField(prefix="The boundary timestamp literal:")
+    delta_trino_sql_query: str = dspy.OutputField(prefix="The Trino SQL query of the delta window:")
+
+
+class DatasetRefresher:
+    def __init__(self, dune_client, engine=None) -> None:
+        self.engine = engine
+        self.dune_client = dune_client
+        self.rewrite_sql = dspy.Predict(IncrementalSqlRewriter)
+
+    def delta_sql(self, sql: str, time_column: str, high_water_mark: str) -> str:
+        """Ask the LLM for a delta query that filters the source scan, wrap the original query otherwise"""
+        boundary = boundary_literal(high_water_mark)
+        try:
+            with span("delta_sql_rewrite") as s:
+                delta_sql = self.rewrite_sql(
+                    original_trino_sql_query=sql, time_column=time_column, boundary=boundary
+                ).delta_trino_sql_query
+                s.set(bytes=len(delta_sql))
+            # The rewrite has to actually use the boundary, otherwise it is not a delta query
+            if boundary.split("'")[1] in delta_sql:
+                # A LIMIT kept from the original query would cut the delta window short
+                return without_order_and_limit(delta_sql)
+            print(f"Delta query does not filter on {boundary}, wrapping the original query instead")
+        except Exception as e:
+            print(f"Could not rewrite the query for the delta window: {str(e)}")
+        return wrap_delta_sql(sql, time_column, high_water_mark)
+
+    def _run(self, sql: str, local_sql: str = None):
+        # Always execute, a stored result would be as old as the dataset itself
+        df, error = self.dune_client.execute_query(sql, refresh=True)
+        if error:
+            raise RuntimeError(error)
+        if local_sql:
+            df = run_local_query(local_sql, {"base": df})
+        return df
+
+    def refresh(self, csv_path: str, full: bool = False) -> dict:
+        """
+        Bring a stored dataset up to date
+
+        Datasets with a time column are refreshed incrementally: only the delta
+        window from the high-water mark on is executed and merged into the
+        csv file. Other datasets (or full=True) re-run the whole query.
+
+        Raises LockBusy if the dataset is already being refreshed.
+        """
+        # Another worker may refresh the same dataset, hold its lock from read to write. The
+        # execution can take minutes, so a second refresh fails right away instead of waiting
+        with file_lock(csv_path, blocking=False) as acquired:
+            if not acquired:
+                raise LockBusy(f"A refresh of {os.path.basename(csv_path)} is already in progress")
+            metadata = load_metadata(csv_path)
+            if metadata is None:
+                raise FileNotFoundError(f"No dataset metadata for {csv_path}")
+
+            incremental = metadata.incremental and not full
+            with span("dataset_refresh", incremental=incremental) as s:
+                existing = pd.read_csv(csv_path)
+                if incremental:
+                    sql = self.delta_sql(metadata.sql, metadata.time_column, metadata.high_water_mark)
+                    delta = self._run(sql, metadata.local_sql)
+                    df = merge_delta(existing, delta, metadata.time_column, metadata.high_water_mark)
+                    rows_fetched = len(delta)
+                else:
+                    df = self._run(metadata.sql, metadata.local_sql)
+                    rows_fetched = len(df)
+                s.set(rows=rows_fetched)
+
+                tmp_path = f"{csv_path}.tmp"
+                df.to_csv(tmp_path, index=False)
+                os.replace(tmp_path, csv_path)
+
+            if metadata.time_column is not None and len(df):
+                metadata.high_water_mark = parse_times(df[metadata.time_column]).max().isoformat()
+            metadata.rows = len(df)
+            metadata.refreshed_at = datetime.now().isoformat()
+            save_metadata(csv_path, metadata)
+
+        return {
+            "mode": "incremental" if incremental else "full",
+            "rows": len(df),
+            "rows_fetched": rows_fetched,
+            "rows_added": len(df) - len(existing),
+            "high_water_mark": metadata.high_water_mark,
+        }
@@ -1,7 +1,13 @@
 import dspy
+from typing import Optional
 from pydantic import BaseModel
-import json
 from agents.utils.data_structures import FullTable
+from agents.utils.tracing import span
+from agents.utils.deadline import has_time_for
+from agents.utils.schema_compactor import compact_table_schema
+from agents.utils.sql_analysis import QueryCost, estimate_query_cost
+from agents.utils.sql_guard import SQL_GUARD_ACTIONS, SQL_MAX_ROWS, clamp_limit, cost_hints, is_too_costly
+from agents.utils.table_catalog import get_table_catalog
 
 
 class TableRetriever(dspy.Signature):
@@ -66,6 +72,9 @@ class SqlOptimizer(dspy.Signature):
     original_trino_sql_query: str = dspy.InputField(
         prefix="The original Trino SQL query:"
     )
+    cost_hints: str = dspy.InputField(
+        prefix="Cost issues found in the original query, fix all of them:"
+    )
     optimized_trino_sql_query: str = dspy.OutputField(
         prefix="The optimized Trino SQL query:"
     )
@@ -99,12 +108,16 @@ class SqlGenerateAgent:
         self.optimize_sql = dspy.Predict(SqlOptimizer)
         self.retry_generate_sql = dspy.Predict(RetrySQLGenerator)
 
-        with open(table_list_file_path, "r") as f:
-            data = json.load(f)
-        self.full_table_list = [FullTable(**item) for item in data]
-        self.full_table_list_dict = {
-            table.table_name: table for table in self.full_table_list
-        }
+        # Loaded once per process and shared by all agents, reloaded when the file changes
+        self.catalog = get_table_catalog(table_list_file_path)
+
+    @property
+    def full_table_list(self) -> list[FullTable]:
+        return self.catalog.tables()
+
+    def candidate_tables(self, prompt: str) -> list[FullTable]:
+        """Tables offered to the LLM for the prompt, prefiltered from the catalog"""
+        return self.catalog.search(prompt)
 
     def generate_sql_by_prompt_with_full_table(self, prompt: str):
         response = self.generate_sql_with_full_table(
@@ -114,38 +127,108 @@ class SqlGenerateAgent:
 
     def generate_sql_by_prompt(self, prompt: str):
         print(f"The user's prompt: {prompt}")
-        response = self.retrieve_table(prompt=prompt, table_list=self.full_table_list)
-        reasoning = response.reasoning
-        table_name = response.most_relevant_table
+        with span("table_retrieval", tables=len(self.catalog)) as s:
+            candidates = self.candidate_tables(prompt)
+            response = self.retrieve_table(prompt=prompt, table_list=candidates)
+            reasoning = response.reasoning
+            table_name = response.most_relevant_table
+            s.set(table=table_name, candidates=len(candidates))
         print(f"Reasoning: {reasoning}")
         print(f"The most relevant table: {table_name}")
 
-        table_detail = self.full_table_list_dict[table_name]
+        table_detail = self.catalog.get(table_name)
         # print(f"The table detail: {table_detail}")
 
-        result = self.generate_sql(prompt=prompt, most_relevant_table=table_detail)
+        # Only the columns relevant to the task go into the generation prompts,
+        # the SQL fix after an error still sees the full table
+        with span("schema_compaction", table=table_name) as s:
+            compact_table = compact_table_schema(prompt, table_detail)
+            s.set(columns=len(compact_table.columns), total_columns=len(table_detail.columns))
+
+        with span("sql_generation", table=table_name) as s:
+            result = self.generate_sql(prompt=prompt, most_relevant_table=compact_table)
+            s.set(bytes=len(result.trino_sql_query))
         print(f"The generated Trino SQL query: {result.trino_sql_query}")
 
-        optimized_sql = self.optimize_sql(
-            prompt=prompt,
-            most_relevant_table=table_detail,
-            original_trino_sql_query=result.trino_sql_query,
-        )
-        print(
-            f"The optimized Trino SQL query: {optimized_sql.optimized_trino_sql_query}"
-        )
+        sql = result.trino_sql_query
+        cost = estimate_query_cost(sql, partition_columns=self.catalog.partition_columns)
+        # Skip the optimization pass when the request deadline is near
+        if not has_time_for("sql_optimization"):
+            print("Deadline is near, skipping SQL optimization")
+        else:
+            sql, cost = self._optimize(prompt, compact_table, sql, cost, "sql_optimization")
+        sql = self.guard_sql(prompt, compact_table, sql, cost)
 
-        sql = optimized_sql.optimized_trino_sql_query
         filename = result.output_filename
         return sql, filename, table_detail
 
+    def guard_sql(
+        self,
+        prompt: str,
+        table: Optional[FullTable],
+        sql: str,
+        cost: Optional[QueryCost] = None,
+        max_rows: int = SQL_MAX_ROWS,
+    ) -> str:
+        """
+        Pre-execution guard, run on every query written by the LLM before it goes to Dune
+
+        A query that is still expensive gets one more optimization pass focused
+        on the remaining issues (when its table is known and the deadline
+        allows), then its LIMIT is clamped to max_rows.
+
+        Returns:
+            str: the query to execute
+        """
+        if cost is None:
+            cost = estimate_query_cost(sql, partition_columns=self.catalog.partition_columns)
+        if is_too_costly(cost):
+            if table is None:
+                SQL_GUARD_ACTIONS.labels(action="unknown_table").inc()
+            elif has_time_for("sql_optimization"):
+                rewritten_sql, rewritten_cost = self._optimize(
+                    prompt, table, sql, cost, "sql_guard_rewrite", max_rows=max_rows
+                )
+                if rewritten_cost.score < cost.score:
+                    SQL_GUARD_ACTIONS.labels(action="rewritten").inc()
+                    sql = rewritten_sql
+                else:
+                    SQL_GUARD_ACTIONS.labels(action="rewrite_rejected").inc()
+            else:
+                SQL_GUARD_ACTIONS.labels(action="deadline").inc()
+
+        # Never download more rows than the figures can use
+        return clamp_limit(sql, max_rows=max_rows)
+
+    def _optimize(
+        self, prompt: str, table: FullTable, sql: str, cost, span_name: str, max_rows: int = SQL_MAX_ROWS
+    ):
+        hints = cost_hints(cost, partition_columns=self.catalog.partition_columns, max_rows=max_rows)
+        with span(span_name, table=table.table_name, cost_score=cost.score) as s:
+            optimized_sql = self.optimize_sql(
+                prompt=prompt,
+                most_relevant_table=table,
+                original_trino_sql_query=sql,
+                cost_hints="\n".join(f"- {hint}" for hint in hints) or "No cost issues found",
+            )
+            optimized_sql = optimized_sql.optimized_trino_sql_query
+            optimized_cost = estimate_query_cost(
+                optimized_sql, partition_columns=self.catalog.partition_columns
+            )
+            s.set(bytes=len(optimized_sql), optimized_cost_score=optimized_cost.score)
+        print(f"The optimized Trino SQL query (cost {cost.score} -> {optimized_cost.score}): {optimized_sql}")
+        return optimized_sql, optimized_cost
+
     def retry_generate_sql_by_prompt(
         self, prompt: str, original_sql: str, error: str, table_detail: FullTable
     ):
-        result = self.retry_generate_sql(
-            prompt=prompt,
-            most_relevant_table=table_detail,
-            original_trino_sql_query=original_sql,
-            error=error,
-        )
-        return result.refined_trino_sql_query
+        with span("sql_retry", table=table_detail.table_name) as s:
+            result = self.retry_generate_sql(
+                prompt=prompt,
+                most_relevant_table=table_detail,
+                original_trino_sql_query=original_sql,
+                error=error,
+            )
+            s.set(bytes=len(result.refined_trino_sql_query))
+        # The fixed query is new LLM output, it goes through the same guard as the first one
+        return self.guard_sql(prompt, table_detail, result.refined_trino_sql_query)
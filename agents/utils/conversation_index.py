@@ -0,0 +1,54 @@
+import json
+import os
+import re
+from typing import List
+
+from agents.utils.file_lock import atomic_write_json, file_lock
+
+# Datasets of a conversation offered for local answers, most recent first
+CONVERSATION_MAX_DATASETS = int(os.getenv("CONVERSATION_MAX_DATASETS", "10"))
+
+
+def conversation_index_path(csv_dir: str, conversation_id: str) -> str:
+    """Index of the csv files generated in a conversation, kept next to the datasets"""
+    safe_id = re.sub(r"[^\w-]", "_", conversation_id)
+    return os.path.join(csv_dir, "conversations", f"{safe_id}.json")
+
+
+def _read(path: str) -> List[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def add_conversation_dataset(csv_path: str, conversation_id: str):
+    """Record that a csv file was generated in a conversation"""
+    path = conversation_index_path(os.path.dirname(csv_path), conversation_id)
+    file_name = os.path.basename(csv_path)
+    # Concurrent tasks and workers append to the same index
+    with file_lock(path):
+        file_names = _read(path)
+        if file_name not in file_names:
+            file_names.append(file_name)
+            atomic_write_json(path, file_names)
+
+
+def conversation_dataset_paths(
+    csv_dir: str, conversation_id: str, limit: int = CONVERSATION_MAX_DATASETS
+) -> List[str]:
+    """Paths of the csv files generated in a conversation that still exist, most recent first"""
+    file_names = _read(conversation_index_path(csv_dir, conversation_id))
+    paths = []
+    for file_name in reversed(file_names):
+        path = os.path.join(csv_dir, file_name)
+        if os.path.exists(path):
+            paths.append(path)
+            if len(paths) >= limit:
+                break
+    return paths
+
+
+def has_conversation_datasets(csv_dir: str, conversation_id: str) -> bool:
+    return bool(conversation_id) and bool(conversation_dataset_paths(csv_dir, conversation_id, limit=1))
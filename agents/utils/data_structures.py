@@ -10,3 +10,20 @@ class FullTable(BaseModel):
     table_name: str
     description: str
     columns: dict
+
+
+class SharedBasePlan(BaseModel):
+    base_table: str
+    base_sql: str
+    task_queries: list[str]
+    output_filenames: list[str]
+
+
+class ConversationDataset(BaseModel):
+    name: str
+    task: str
+    # Column name -> dtype
+    columns: dict
+    rows: int
+    time_range: str
+    sample_rows: list[dict]
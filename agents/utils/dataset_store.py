@@ -0,0 +1,155 @@
+import json
+import os
+import re
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+from pydantic import BaseModel
+
+from agents.utils.conversation_index import add_conversation_dataset
+from agents.utils.sql_analysis import without_order_and_limit
+
+# Column names that usually hold the time axis of a Dune result
+TIME_COLUMN_NAMES = [
+    "block_time", "block_date", "block_hour", "block_month", "evt_block_time",
+    "time", "timestamp", "date", "day", "hour", "week", "month",
+]
+
+
+class DatasetMetadata(BaseModel):
+    task: str
+    sql: str
+    # Set when the dataset was derived locally from a shared base extract (sql is then the base query)
+    local_sql: Optional[str] = None
+    time_column: Optional[str] = None
+    # Latest value of the time column, i.e. the start of the last (possibly partial) bucket
+    high_water_mark: Optional[str] = None
+    incremental: bool = False
+    rows: int
+    created_at: str
+    refreshed_at: Optional[str] = None
+    # Conversation the dataset was generated in, its follow-up tasks may be answered from it locally
+    conversation_id: Optional[str] = None
+    columns: List[str] = []
+
+
+def metadata_path(csv_path: str) -> str:
+    return f"{os.path.splitext(csv_path)[0]}.meta.json"
+
+
+def parse_times(values: pd.Series) -> pd.Series:
+    """Parse a time column as returned by Dune (e.g. "2024-01-01 00:00:00.000 UTC")"""
+    return pd.to_datetime(values, errors="coerce", utc=True)
+
+
+def detect_time_column(df: pd.DataFrame) -> Optional[str]:
+    """Find the column holding the time axis, None if the dataset is not a time series"""
+    candidates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    candidates += [c for c in df.columns if str(c).lower() in TIME_COLUMN_NAMES and c not in candidates]
+    for column in candidates:
+        parsed = parse_times(df[column])
+        if len(parsed) and parsed.notna().mean() >= 0.9:
+            return column
+    return None
+
+
+def is_incremental_sql(sql: str) -> bool:
+    """
+    Whether new rows can be computed from the delta window alone
+
+    Window functions (running totals, ranks, moving averages) depend on rows
+    before the window, so such datasets are always refreshed in full.
+    """
+    return re.search(r"\bover\s*\(", sql, re.IGNORECASE) is None
+
+
+def record_dataset(
+    csv_path: str,
+    df: pd.DataFrame,
+    task: str,
+    sql: str,
+    local_sql: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+) -> DatasetMetadata:
+    """Write the sidecar metadata of a dataset next to its csv file and add it to its conversation"""
+    time_column = detect_time_column(df)
+    high_water_mark = None
+    if time_column is not None:
+        high_water_mark = parse_times(df[time_column]).max().isoformat()
+    metadata = DatasetMetadata(
+        task=task,
+        sql=sql,
+        local_sql=local_sql,
+        time_column=time_column,
+        high_water_mark=high_water_mark,
+        # Derived datasets are refreshed in full: their time column need not exist in the base extract
+        incremental=time_column is not None and local_sql is None and is_incremental_sql(sql),
+        rows=len(df),
+        created_at=datetime.now().isoformat(),
+        conversation_id=conversation_id,
+        columns=[str(c) for c in df.columns],
+    )
+    save_metadata(csv_path, metadata)
+    if conversation_id:
+        add_conversation_dataset(csv_path, conversation_id)
+    return metadata
+
+
+def load_metadata(csv_path: str) -> Optional[DatasetMetadata]:
+    path = metadata_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return DatasetMetadata(**json.load(f))
+
+
+def save_metadata(csv_path: str, metadata: DatasetMetadata):
+    path = metadata_path(csv_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata.model_dump(), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def boundary_literal(high_water_mark: str) -> str:
+    """Trino timestamp literal of the high-water mark"""
+    return f"TIMESTAMP '{pd.Timestamp(high_water_mark).strftime('%Y-%m-%d %H:%M:%S')}'"
+
+
+def wrap_delta_sql(sql: str, time_column: str, high_water_mark: str) -> str:
+    """
+    Restrict a query to the delta window by filtering its output
+
+    Always correct, but only saves scanning when Trino can push the filter
+    down to the source table (e.g. when grouping by the raw time column).
+    The ORDER BY and LIMIT of the query (e.g. the row cap of the SQL guard)
+    are dropped: inside the wrapper they would apply before the filter and
+    could cut off the newest rows. merge_delta restores the order.
+    """
+    sql = without_order_and_limit(sql)
+    return f'SELECT * FROM (\n{sql}\n) AS base_query\nWHERE "{time_column}" >= {boundary_literal(high_water_mark)}'
+
+
+def merge_delta(
+    existing: pd.DataFrame, delta: pd.DataFrame, time_column: str, high_water_mark: str
+) -> pd.DataFrame:
+    """
+    Append the delta window to a dataset
+
+    The delta starts at the high-water mark, i.e. it recomputes the last
+    bucket of the existing dataset, which may have been partial. The rows of
+    that bucket are replaced instead of being duplicated.
+    """
+    boundary = pd.Timestamp(high_water_mark)
+    delta = delta[parse_times(delta[time_column]) >= boundary]
+    if delta.empty:
+        # Nothing new (e.g. the source has not caught up yet), keep the last bucket as it is
+        return existing
+    keep = existing[parse_times(existing[time_column]) < boundary]
+    merged = pd.concat([keep, delta[existing.columns]], ignore_index=True)
+    # Keep the direction the dataset was sorted in
+    times = parse_times(merged[time_column])
+    descending = len(existing) > 1 and parse_times(existing[time_column]).is_monotonic_decreasing
+    order = times.sort_values(ascending=not descending, kind="stable").index
+    return merged.loc[order].reset_index(drop=True)
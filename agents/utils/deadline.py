@@ -0,0 +1,76 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import Counter
+
+# Time a figure request may take from planning to the last plot
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "120"))
+
+# Time an optional stage needs to be worth starting; it is skipped when less is left
+STAGE_MIN_SECONDS = {
+    "sql_optimization": float(os.getenv("DEADLINE_SQL_OPTIMIZATION_SECONDS", "30")),
+    "sql_retry": float(os.getenv("DEADLINE_SQL_RETRY_SECONDS", "45")),
+    "plot_refine": float(os.getenv("DEADLINE_PLOT_REFINE_SECONDS", "30")),
+}
+
+# Deadline of the request being processed (time.monotonic()), propagated to worker threads with copy_context()
+deadline_var = contextvars.ContextVar("deadline", default=None)
+
+STAGES_SKIPPED = Counter(
+    "visualyze_stages_skipped_total", "Optional pipeline stages skipped because the deadline was near", ["stage"]
+)
+DEADLINES_EXCEEDED = Counter(
+    "visualyze_deadlines_exceeded_total", "Requests that returned partial results at their deadline"
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Give the enclosed work `seconds` to finish, an enclosing deadline that is earlier still applies"""
+    if seconds is None:
+        yield deadline_var.get()
+        return
+    deadline = time.monotonic() + seconds
+    outer = deadline_var.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = deadline_var.set(deadline)
+    try:
+        yield deadline
+    finally:
+        deadline_var.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current deadline, None without a deadline"""
+    deadline = deadline_var.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check_deadline(stage: str):
+    """Raise DeadlineExceeded instead of starting work whose result nobody waits for"""
+    if expired():
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+
+def has_time_for(stage: str) -> bool:
+    """Whether an optional stage should run; records a skip otherwise"""
+    left = remaining()
+    if left is None or left >= STAGE_MIN_SECONDS.get(stage, 0.0):
+        return True
+    STAGES_SKIPPED.labels(stage=stage).inc()
+    return False
@@ -1,29 +1,148 @@
 import logging
 from typing import Tuple, List, Dict, Any, Optional, Union
 import os
+import re
+import threading
 import time
 import pandas as pd
+import requests
 from dune_client.client import DuneClient
 from dune_client.query import QueryBase
 from dune_client.types import QueryParameter
-from dune_client.models import QueryFailed  # 导入正确的异常类
+from dune_client.models import ExecutionState
+from prometheus_client import Counter
+from agents.utils.tracing import span, request_id_var
+from agents.utils.sql_analysis import QueryCost, canonicalize_sql, estimate_query_cost, sql_fingerprint
+from agents.utils.single_flight import SingleFlight
+from agents.utils.query_history import QueryHistory, query_history
+from agents.utils.result_store import SOURCE_INTERACTIVE, SOURCE_PREWARM, ResultStore, result_key, result_store
+from agents.utils.http_pool import mount_pooled_adapter
+from agents.utils.deadline import remaining
+from agents.utils.rate_limit import RATE_LIMIT, TRANSIENT, call_with_backoff, classify_error, dune_limiter
 
 logger = logging.getLogger(__name__)
 
+# 执行层级选择: "adaptive" 根据SQL形态和历史记录选择, 或固定为 "medium" / "large"
+DUNE_PERFORMANCE = os.getenv("DUNE_PERFORMANCE", "adaptive")
+# 成本分数达到该值的查询直接使用large层级 (约等于扫描大表180天)
+DUNE_LARGE_COST_SCORE = float(os.getenv("DUNE_LARGE_COST_SCORE", "180"))
+# medium层级执行超过该秒数后取消并升级到large层级
+DUNE_MEDIUM_TIMEOUT = float(os.getenv("DUNE_MEDIUM_TIMEOUT", "30"))
+# 单个查询 (包括升级后的重试) 的总超时秒数
+DUNE_QUERY_TIMEOUT = float(os.getenv("DUNE_QUERY_TIMEOUT", "300"))
+DUNE_POLL_SECONDS = float(os.getenv("DUNE_POLL_SECONDS", "1"))
+DUNE_MAX_POLL_SECONDS = 5.0
+
+DUNE_EXECUTIONS = Counter(
+    "visualyze_dune_executions_total", "Dune executions by tier and outcome", ["performance", "state"]
+)
+DUNE_ESCALATIONS = Counter(
+    "visualyze_dune_escalations_total", "Dune executions escalated from medium to large after a timeout"
+)
+
+# 查询错误的类别: LLM可修复的SQL错误, 重试无用的永久错误 (限流和暂时性错误见rate_limit)
+QUERY_ERROR_SQL = "sql"
+QUERY_ERROR_PERMANENT = "permanent"
+
+# (模式, 提示模板, 类别), 按顺序匹配
+SQL_ERROR_PATTERNS = [
+    (r'syntax error at or near "([^"]+)"', "SQL语法错误，在 {} 附近", QUERY_ERROR_SQL),
+    (r"mismatched input '([^']+)'", "SQL语法错误，在 {} 附近", QUERY_ERROR_SQL),
+    (r'column "([^"]+)" does not exist', "列 {} 不存在", QUERY_ERROR_SQL),
+    (r"column '([^']+)' cannot be resolved", "列 {} 不存在", QUERY_ERROR_SQL),
+    (r'relation "([^"]+)" does not exist', "表 {} 不存在", QUERY_ERROR_SQL),
+    (r"table '([^']+)' does not exist", "表 {} 不存在", QUERY_ERROR_SQL),
+    (r"function '([^']+)' not registered", "函数 {} 不存在", QUERY_ERROR_SQL),
+    (r"invalid input syntax for type ([^:]+)", "输入语法对类型 {} 无效", QUERY_ERROR_SQL),
+    (r"cannot apply operator: ([^\n]+)", "运算符类型不匹配: {}", QUERY_ERROR_SQL),
+    (r"permission denied for ([^:]+)", "没有 {} 的权限", QUERY_ERROR_PERMANENT),
+]
+# 重试 (包括让LLM修改SQL) 也不会成功的错误
+_PERMANENT_ERROR_PATTERN = re.compile(
+    r"permission denied|not authorized|unauthorized|forbidden|\b40[123] client error|invalid api key|payment required"
+    r"|quota|credits|billing|exceeded the maximum|查询执行超时|请求截止时间已到",
+    re.IGNORECASE,
+)
+
+
+def classify_query_error(error_msg: str) -> str:
+    """
+    查询错误分类
+
+    Returns:
+        str: QUERY_ERROR_PERMANENT, RATE_LIMIT, TRANSIENT 或 QUERY_ERROR_SQL
+             (无法识别的错误按SQL错误处理, 交给LLM尝试修复)
+    """
+    if _PERMANENT_ERROR_PATTERN.search(error_msg or ""):
+        return QUERY_ERROR_PERMANENT
+    error_class = classify_error(error_msg)
+    if error_class is not None:
+        return error_class
+    for pattern, _, pattern_class in SQL_ERROR_PATTERNS:
+        if re.search(pattern, error_msg, re.IGNORECASE):
+            return pattern_class
+    return QUERY_ERROR_SQL
+
+
+def _raise_for_retryable_status(response, *args, **kwargs):
+    # 429和5xx响应以HTTPError抛出, 保留状态码和Retry-After供退避使用
+    if response.status_code == 429 or response.status_code >= 500:
+        # 先读取响应体, 连接才会回到连接池
+        response.content
+        response.raise_for_status()
+    return response
+
 
 class DuneQueryClient:
     """Dune查询客户端，负责执行SQL查询并处理结果"""
 
-    def __init__(self, api_key: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        client: DuneClient = None,
+        history: QueryHistory = None,
+        store: ResultStore = None,
+        poll_seconds: float = DUNE_POLL_SECONDS,
+    ):
         self.api_key = api_key or os.getenv("DUNE_API_KEY")
         if not self.api_key:
             raise ValueError("必须提供Dune API密钥")
 
-        self.client = DuneClient(api_key=self.api_key)
+        # 允许注入客户端（例如基准测试中的模拟客户端）
+        self.client = client or DuneClient(api_key=self.api_key)
+        self._configure_http()
+        self.history = history or query_history
+        self.store = store or result_store
+        self.poll_seconds = poll_seconds
+        # 正在执行的execution_id -> 发起它的请求ID, 用于取消查询
+        self._executions: Dict[str, Optional[str]] = {}
+        self._executions_lock = threading.Lock()
+        # 合并并发的相同查询, 只执行一次
+        self._single_flight = SingleFlight("dune_query")
         logger.info("Dune客户端初始化成功")
 
+    def _configure_http(self):
+        """
+        使用进程共享的连接池 (keep-alive, 每个主机限制连接数), 并关闭dune-client
+        会话内各线程独立的429/5xx重试, 改为抛出HTTPError, 由共享的限流器统一
+        退避重试 (并遵守Retry-After)
+        """
+        http = getattr(self.client, "http", None)
+        if not isinstance(http, requests.Session):
+            return
+        mount_pooled_adapter(http)
+        http.hooks["response"].append(_raise_for_retryable_status)
+
+    def _call(self, fn, *args, retry_transient: bool = True, **kwargs):
+        """通过共享限流器调用Dune API, 限流和暂时性错误按指数退避重试"""
+        return call_with_backoff(dune_limiter, fn, *args, retry_transient=retry_transient, **kwargs)
+
     def execute_query(
-        self, sql: str, query_params: List[Dict[str, Any]] = None
+        self,
+        sql: str,
+        query_params: List[Dict[str, Any]] = None,
+        refresh: bool = False,
+        prewarm: bool = False,
     ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
         """
         执行SQL查询并返回结果
@@ -31,19 +150,42 @@ class DuneQueryClient:
         Args:
             sql: 要执行的SQL查询语句
             query_params: 查询参数列表，每个参数是一个字典，包含name、type和value
+            refresh: 为True时忽略结果存储中的结果并重新执行 (用于后台预热和数据集刷新)
+            prewarm: 为True时结果由预热写入, 在结果存储中保留RESULT_STORE_TTL_SECONDS,
+                     其他结果只保留RESULT_STORE_INTERACTIVE_TTL_SECONDS
 
         Returns:
-            tuple: (查询结果列表, 错误信息(如果有))
+            tuple: (查询结果列表, 错误信息(如果有)); 来自结果存储的结果在
+                   df.attrs["stored_at"]中带有存储时间
         """
         try:
             logger.info(f"开始执行SQL查询: {sql}")
 
-            # 使用create_and_execute_query方法创建并执行查询
-            results_df, error = self.create_and_execute_query(sql, query_params)
+            canonical_sql = canonicalize_sql(sql)
+            # 带参数的查询不进入结果存储
+            storable = not query_params
+            if storable and not refresh:
+                self._record_request(canonical_sql, sql)
+                stored_df = self._get_stored(canonical_sql)
+                if stored_df is not None:
+                    logger.info(f"从结果存储返回{len(stored_df)}行结果")
+                    return stored_df, None
+
+            # 相同的查询 (忽略注释、大小写和空白) 正在执行时, 等待并共享其结果
+            key = (canonical_sql, repr(query_params))
+            (results_df, error), shared = self._single_flight.do(
+                key, lambda: self.create_and_execute_query(sql, query_params)
+            )
+            if shared:
+                logger.info("相同的查询正在执行, 已共享其结果")
 
             if error:
                 return [], error
 
+            if storable and not shared:
+                source = SOURCE_PREWARM if prewarm else SOURCE_INTERACTIVE
+                self._put_stored(canonical_sql, sql, results_df, source)
+
             # 将DataFrame转换为字典列表
             results = results_df.to_dict(orient="records")
             logger.info(f"查询执行成功，返回{len(results)}条结果")
@@ -76,12 +218,42 @@ class DuneQueryClient:
             logger.info(f"正在创建新查询: {sql}")
             logger.debug(f"完整SQL查询: \n{sql}")
 
-            query = self._create_query(sql, parameters)
+            with span("dune_create", bytes=len(sql)) as s:
+                query = self._create_query(sql, parameters)
+                if isinstance(query, str):
+                    s.fail(query)
+                else:
+                    s.set(query_id=query.base.query_id)
             if isinstance(query, str):  # 如果返回的是错误信息
                 return pd.DataFrame(), query
 
+            # 根据SQL形态和历史记录选择执行层级
+            cost = estimate_query_cost(sql)
+            fingerprint = sql_fingerprint(sql)
+            performance, reason = self._choose_performance(cost, fingerprint)
+            logger.info(f"查询成本分数: {cost.score}, 使用{performance}层级 ({reason})")
+
             # 执行查询并获取结果
-            results_df = self._execute_query(query.base)
+            with span(
+                "dune_execute",
+                query_id=query.base.query_id,
+                performance=performance,
+                cost_score=cost.score,
+            ) as s:
+                results_df = self._execute_query(
+                    query.base,
+                    performance=performance,
+                    cost=cost,
+                    fingerprint=fingerprint,
+                    escalate=DUNE_PERFORMANCE == "adaptive",
+                )
+                if isinstance(results_df, tuple):
+                    s.fail(results_df[1])
+                else:
+                    s.set(
+                        rows=len(results_df),
+                        bytes=int(results_df.memory_usage(deep=True).sum()),
+                    )
             if isinstance(results_df, tuple):  # 如果返回的是(DataFrame, error)
                 return results_df
 
@@ -128,8 +300,12 @@ class DuneQueryClient:
     ) -> Union[QueryBase, str]:
         """创建新查询"""
         try:
-            query = self.client.create_query(
-                name="AI生成查询", query_sql=sql, params=parameters, is_private=False
+            query = self._call(
+                self.client.create_query,
+                name="AI生成查询",
+                query_sql=sql,
+                params=parameters,
+                is_private=False,
             )
 
             query_id = query.base.query_id
@@ -143,8 +319,10 @@ class DuneQueryClient:
             # 尝试提取更详细的错误信息
             detailed_error = self._extract_detailed_error(error_msg)
 
-            # 如果没有详细错误信息，提供一些常见错误的可能性
-            if detailed_error == error_msg or "Error data: None" in detailed_error:
+            # 如果没有详细错误信息，提供一些常见错误的可能性 (限流和暂时性错误与SQL无关)
+            if classify_error(detailed_error) is None and (
+                detailed_error == error_msg or "Error data: None" in detailed_error
+            ):
                 detailed_error = (
                     f"创建查询失败: {error_msg}。可能的原因：\n"
                     f"1. 表名错误 - Dune Analytics中的表名可能是 'opensea_v4.trades', 'opensea_v3.trades' 或其他格式\n"
@@ -157,40 +335,225 @@ class DuneQueryClient:
             logger.error(f"失败的SQL查询: {sql}")
             return detailed_error
 
+    def _choose_performance(self, cost: QueryCost, fingerprint: str) -> Tuple[str, str]:
+        """
+        选择执行层级
+
+        Returns:
+            tuple: (层级, 选择原因)
+        """
+        if DUNE_PERFORMANCE != "adaptive":
+            return DUNE_PERFORMANCE, "固定配置"
+
+        try:
+            history = self.history.summarize(fingerprint, cost.tables)
+        except Exception as e:
+            logger.warning(f"读取查询历史失败: {str(e)}")
+            history = {"match": None, "tiers": {}}
+
+        medium = history["tiers"].get("medium")
+        if medium:
+            # 相似查询在medium层级经常超时或接近超时, 直接使用large层级
+            if medium["timeout_rate"] >= 0.5:
+                return "large", f"历史超时率 {medium['timeout_rate']:.0%} ({history['match']})"
+            median_seconds = medium["median_seconds"]
+            if median_seconds is not None and median_seconds >= 0.8 * DUNE_MEDIUM_TIMEOUT:
+                return "large", f"历史中位耗时 {median_seconds:.1f}s ({history['match']})"
+            # 同一查询在medium层级能很快完成, 不必使用更贵的层级
+            if history["match"] == "fingerprint" and median_seconds is not None:
+                return "medium", f"历史中位耗时 {median_seconds:.1f}s"
+
+        if cost.score >= DUNE_LARGE_COST_SCORE:
+            return "large", f"成本分数 {cost.score} >= {DUNE_LARGE_COST_SCORE}"
+        return "medium", f"成本分数 {cost.score}"
+
     def _execute_query(
-        self, query: QueryBase
+        self,
+        query: QueryBase,
+        performance: str = "medium",
+        cost: Optional[QueryCost] = None,
+        fingerprint: Optional[str] = None,
+        escalate: bool = False,
     ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, str]]:
-        """执行查询并获取结果"""
+        """执行查询并获取结果, medium层级超时后可升级到large层级"""
+        # 请求的截止时间早于查询超时时, 以请求的截止时间为准
+        request_remaining = remaining()
+        request_bound = request_remaining is not None and request_remaining < DUNE_QUERY_TIMEOUT
+        if request_bound and request_remaining <= 0:
+            return pd.DataFrame(), f"请求截止时间已到, 未执行查询: query_id={query.query_id}"
+        deadline = time.monotonic() + (request_remaining if request_bound else DUNE_QUERY_TIMEOUT)
         try:
-            results_df = self.client.run_query_dataframe(query=query, performance='medium')
-            logger.info(f"查询执行成功，返回{len(results_df)}行结果")
-            logger.info(f"results_df: {type(results_df)}")
-            logger.info(results_df)
-            return results_df
-
-        except QueryFailed as e:
-            error_msg = str(e)
-            try:
-                # 从错误消息中提取执行ID
-                import re
-
-                execution_id_match = re.search(r"execution_id=([^,]+)", error_msg)
-                if execution_id_match:
-                    execution_id = execution_id_match.group(1)
-                    status = self.client.get_execution_status(execution_id)
+            while True:
+                timeout = deadline - time.monotonic()
+                # 只有剩余时间多于medium超时时, medium超时才意味着该层级太慢
+                tier_bound = escalate and performance == "medium" and timeout > DUNE_MEDIUM_TIMEOUT
+                if tier_bound:
+                    timeout = DUNE_MEDIUM_TIMEOUT
+
+                start = time.perf_counter()
+                # 结果未知时不重复发起执行, 只在被限流时重试
+                execution_id = self._call(
+                    self.client.execute_query, query, performance=performance, retry_transient=False
+                ).execution_id
+                logger.info(f"查询 {query.query_id} 在{performance}层级执行, 执行ID: {execution_id}")
+                self._track_execution(execution_id)
+                try:
+                    status = self._wait_for_execution(execution_id, timeout)
+                finally:
+                    self._untrack_execution(execution_id)
+                seconds = time.perf_counter() - start
+
+                if status is None:
+                    self._cancel_execution(execution_id)
+                    if tier_bound:
+                        self._record_run(cost, fingerprint, performance, "timeout", seconds)
+                        logger.warning(
+                            f"查询 {query.query_id} 在medium层级执行超过{timeout:.0f}秒, 升级到large层级"
+                        )
+                        DUNE_ESCALATIONS.inc()
+                        performance = "large"
+                        continue
+                    if request_bound:
+                        # 请求截止时间先到, 不代表查询在该层级超时, 不计入超时历史
+                        self._record_run(cost, fingerprint, performance, "cancelled", seconds)
+                        error_msg = f"请求截止时间已到, 查询已取消: execution_id={execution_id}, query_id={query.query_id}"
+                        logger.error(error_msg)
+                        return pd.DataFrame(), error_msg
+                    self._record_run(cost, fingerprint, performance, "timeout", seconds)
+                    error_msg = f"查询执行超时: execution_id={execution_id}, query_id={query.query_id}, 超过{DUNE_QUERY_TIMEOUT:.0f}秒"
+                    logger.error(error_msg)
+                    return pd.DataFrame(), error_msg
+
+                if status.state == ExecutionState.COMPLETED:
+                    results_df = self._fetch_results(execution_id)
+                    self._record_run(cost, fingerprint, performance, "completed", seconds, rows=len(results_df))
+                    logger.info(f"查询执行成功，返回{len(results_df)}行结果")
+                    return results_df
+
+                if status.state == ExecutionState.FAILED:
                     logger.info(f"查询状态: {status}")
                     error_msg = f"ExecutionState.FAILED: execution_id={execution_id}, query_id={query.query_id}, error={status.error}"
-            except Exception as status_error:
-                logger.warning(f"获取详细状态失败: {str(status_error)}")
+                    self._record_run(cost, fingerprint, performance, "failed", seconds, error=str(status.error))
+                else:
+                    error_msg = f"{status.state}: execution_id={execution_id}, query_id={query.query_id}"
+                    self._record_run(cost, fingerprint, performance, "cancelled", seconds)
 
-            logger.error(f"查询执行失败: {error_msg}")
-            return pd.DataFrame(), error_msg
+                logger.error(f"查询执行失败: {error_msg}")
+                return pd.DataFrame(), error_msg
 
         except Exception as e:
-            error_msg = str(e)
+            error_msg = self._extract_detailed_error(str(e))
             logger.error(f"查询执行失败: {error_msg}")
             return pd.DataFrame(), error_msg
 
+    def _wait_for_execution(self, execution_id: str, timeout: float):
+        """轮询执行状态直到结束, 超时返回None"""
+        deadline = time.monotonic() + timeout
+        interval = self.poll_seconds
+        while True:
+            status = self._call(self.client.get_execution_status, execution_id)
+            if status.state in ExecutionState.terminal_states():
+                return status
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 1.5, max(DUNE_MAX_POLL_SECONDS, self.poll_seconds))
+
+    def _fetch_results(self, execution_id: str) -> pd.DataFrame:
+        """以CSV格式下载执行结果"""
+        results = self._call(self.client.get_execution_results_csv, execution_id)
+        # 与run_query_dataframe相同, 按next_uri继续下载剩余分页
+        fetch_remaining = getattr(self.client, "_fetch_entire_result_csv", None)
+        if fetch_remaining is not None:
+            results = self._call(fetch_remaining, results)
+        return pd.read_csv(results.data)
+
+    def _record_run(
+        self,
+        cost: Optional[QueryCost],
+        fingerprint: Optional[str],
+        performance: str,
+        state: str,
+        seconds: float,
+        rows: Optional[int] = None,
+        error: Optional[str] = None,
+    ):
+        DUNE_EXECUTIONS.labels(performance=performance, state=state).inc()
+        if cost is None or fingerprint is None:
+            return
+        try:
+            self.history.record(
+                fingerprint=fingerprint,
+                tables=cost.tables,
+                performance=performance,
+                state=state,
+                seconds=seconds,
+                cost_score=cost.score,
+                rows=rows,
+                error=error,
+            )
+        except Exception as e:
+            logger.warning(f"记录查询历史失败: {str(e)}")
+
+    def _record_request(self, canonical_sql: str, sql: str):
+        try:
+            self.history.record_request(result_key(canonical_sql), sql)
+        except Exception as e:
+            logger.warning(f"记录查询请求失败: {str(e)}")
+
+    def _get_stored(self, canonical_sql: str) -> Optional[pd.DataFrame]:
+        try:
+            return self.store.get(canonical_sql)
+        except Exception as e:
+            logger.warning(f"读取结果存储失败: {str(e)}")
+            return None
+
+    def _put_stored(self, canonical_sql: str, sql: str, results_df: pd.DataFrame, source: str):
+        try:
+            self.store.put(canonical_sql, sql, results_df, source=source)
+        except Exception as e:
+            logger.warning(f"写入结果存储失败: {str(e)}")
+
+    def _track_execution(self, execution_id: str):
+        with self._executions_lock:
+            self._executions[execution_id] = request_id_var.get()
+
+    def _untrack_execution(self, execution_id: str):
+        with self._executions_lock:
+            self._executions.pop(execution_id, None)
+
+    def _cancel_execution(self, execution_id: str) -> bool:
+        try:
+            return self._call(self.client.cancel_execution, execution_id)
+        except Exception as e:
+            logger.warning(f"取消执行 {execution_id} 失败: {str(e)}")
+            return False
+
+    def terminate_queries(self, request_id: Optional[str] = None) -> int:
+        """
+        取消正在执行的查询
+
+        Args:
+            request_id: 只取消该请求发起的查询, 为None时取消全部
+
+        Returns:
+            int: 成功取消的查询数量
+        """
+        with self._executions_lock:
+            execution_ids = [
+                execution_id
+                for execution_id, owner in self._executions.items()
+                if request_id is None or owner == request_id
+            ]
+        cancelled = sum(self._cancel_execution(execution_id) for execution_id in execution_ids)
+        logger.info(f"已取消{cancelled}/{len(execution_ids)}个正在执行的查询")
+        return cancelled
+
+    def terminate_all_queries(self) -> int:
+        """取消所有正在执行的查询"""
+        return self.terminate_queries()
+
     def get_query_execution_status(self, execution_id: str) -> Dict[str, Any]:
         """
         获取查询执行状态
@@ -203,7 +566,7 @@ class DuneQueryClient:
         """
         try:
             # 获取查询状态
-            status = self.client.get_status(execution_id)
+            status = self._call(self.client.get_status, execution_id)
             return status
 
         except Exception as e:
@@ -221,12 +584,16 @@ class DuneQueryClient:
             str: 提取后的详细错误信息
         """
         try:
-            # 导入re模块
-            import re
-
             # 记录原始错误信息
             logger.debug(f"正在分析错误信息: {error_msg}")
 
+            # 限流和暂时性错误与SQL无关, 单独分类, 不应让LLM修改SQL
+            error_class = classify_error(error_msg)
+            if error_class == RATE_LIMIT:
+                return f"Dune API限流 (rate limit), 请稍后重试: {error_msg}"
+            if error_class == TRANSIENT:
+                return f"Dune API暂时不可用 (transient), 请稍后重试: {error_msg}"
+
             # 如果错误信息包含"ExecutionState.FAILED"，说明是执行失败
             if "ExecutionState.FAILED" in error_msg:
                 # 提取查询ID和执行ID
@@ -259,15 +626,7 @@ class DuneQueryClient:
                     logger.warning(f"获取详细错误信息失败: {str(e)}")
 
             # 检查是否包含SQL语法错误
-            sql_error_patterns = [
-                (r'syntax error at or near "([^"]+)"', "SQL语法错误，在 {} 附近"),
-                (r'column "([^"]+)" does not exist', "列 {} 不存在"),
-                (r'relation "([^"]+)" does not exist', "表 {} 不存在"),
-                (r"invalid input syntax for type ([^:]+)", "输入语法对类型 {} 无效"),
-                (r"permission denied for ([^:]+)", "没有 {} 的权限"),
-            ]
-
-            for pattern, template in sql_error_patterns:
+            for pattern, template, _ in SQL_ERROR_PATTERNS:
                 match = re.search(pattern, error_msg, re.IGNORECASE)
                 if match:
                     logger.info(f"匹配到SQL错误模式: {pattern}")
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class LockBusy(Exception):
+    """Another holder has the lock and the caller does not wait for it"""
+
+
+def _try_lock(fd: int) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = 30.0, blocking: bool = True):
+    """
+    Exclusive lock held across processes (and threads) on `path`.lock
+
+    Usage:
+        with file_lock("data/chat_history.json"):
+            ... read, modify and atomically write the file ...
+
+    With blocking=False the context yields False immediately if another
+    holder has the lock, instead of waiting up to `timeout` seconds.
+    """
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        acquired = _try_lock(fd)
+        while not acquired and blocking:
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Timed out waiting for the lock on {path}")
+            time.sleep(0.01)
+            acquired = _try_lock(fd)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path: str, data: Any, **kwargs):
+    """Write JSON to a temporary file and rename it over `path`, readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from prometheus_client import Counter
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from requests.adapters import HTTPAdapter
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Connections kept by the shared pools, in total and per host
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+# Idle keep-alive connections kept open, and for how long
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2 = os.getenv("HTTP2", "true").lower() == "true" and HTTP2_AVAILABLE
+
+HTTP_REQUESTS = Counter(
+    "visualyze_http_requests_total", "Outbound HTTP requests through the shared pools", ["pool", "host"]
+)
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+# httpx async clients are bound to the event loop that uses them
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+_adapter: Optional[HTTPAdapter] = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def _count_request(request: httpx.Request):
+    HTTP_REQUESTS.labels(pool="httpx", host=request.url.host).inc()
+
+
+async def _acount_request(request: httpx.Request):
+    HTTP_REQUESTS.labels(pool="httpx_async", host=request.url.host).inc()
+
+
+def http_client() -> httpx.Client:
+    """Process-wide httpx client (keep-alive, HTTP/2 if available) for the LLM and vision clients"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(
+                    http2=HTTP2,
+                    limits=_limits(),
+                    timeout=_timeout(),
+                    event_hooks={"request": [_count_request]},
+                )
+    return _client
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """Shared httpx async client of the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=HTTP2,
+                limits=_limits(),
+                timeout=_timeout(),
+                event_hooks={"request": [_acount_request]},
+            )
+            _async_clients[loop] = client
+    return client
+
+
+class _CountingAdapter(HTTPAdapter):
+    def send(self, request, *args, **kwargs):
+        HTTP_REQUESTS.labels(pool="requests", host=urlsplit(request.url).hostname or "").inc()
+        return super().send(request, *args, **kwargs)
+
+
+def pooled_adapter() -> HTTPAdapter:
+    """
+    Process-wide requests adapter (keep-alive, per-host limit) for requests-based clients
+
+    Retries are left to the shared rate limiter (agents.utils.rate_limit).
+    """
+    global _adapter
+    if _adapter is None:
+        with _lock:
+            if _adapter is None:
+                _adapter = _CountingAdapter(
+                    pool_connections=HTTP_MAX_CONNECTIONS // HTTP_MAX_CONNECTIONS_PER_HOST or 1,
+                    pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST,
+                    max_retries=0,
+                )
+    return _adapter
+
+
+def mount_pooled_adapter(session: requests.Session):
+    adapter = pooled_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def close_http_clients():
+    """Close the shared sync client and adapter, e.g. on shutdown"""
+    global _client, _adapter
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+        if _adapter is not None:
+            _adapter.close()
+            _adapter = None
+
+
+async def aclose_async_http_client():
+    """Close the async client of the running event loop"""
+    with _lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+class _PoolCollector:
+    """Open and idle connections of the shared pools, read at scrape time"""
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            "visualyze_http_pool_connections",
+            "Connections held by the shared HTTP pools",
+            labels=["pool", "state"],
+        )
+        pools = []
+        if _client is not None:
+            pools.append(("httpx", _client))
+        pools.extend(("httpx_async", client) for client in list(_async_clients.values()))
+        for name, client in pools:
+            # httpcore keeps no public statistics, count the connections of the pool
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            open_connections = list(getattr(pool, "connections", []))
+            idle = sum(1 for connection in open_connections if connection.is_idle())
+            connections.add_metric([name, "active"], len(open_connections) - idle)
+            connections.add_metric([name, "idle"], idle)
+        if _adapter is not None:
+            active = idle = 0
+            for key in list(_adapter.poolmanager.pools.keys()):
+                host_pool = _adapter.poolmanager.pools.get(key)
+                if host_pool is None:
+                    continue
+                # The queue holds idle connections and empty slots, checked out slots are in use
+                queue = host_pool.pool
+                idle += sum(1 for connection in list(queue.queue) if connection is not None)
+                active += queue.maxsize - queue.qsize()
+            connections.add_metric(["requests", "active"], active)
+            connections.add_metric(["requests", "idle"], idle)
+        yield connections
+
+
+REGISTRY.register(_PoolCollector())
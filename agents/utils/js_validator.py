@@ -0,0 +1,192 @@
+import re
+from typing import List, Optional
+
+try:
+    import esprima
+except ImportError:  # esprima (agents/requirements.txt) missing, fall back to a structural scan of the code
+    esprima = None
+
+# Characters after which a "/" starts a regular expression literal rather than a division
+_REGEX_PRECEDERS = "(,=:[!&|?{};+-*%<>~^"
+# Keywords after which a "/" starts a regular expression literal, e.g. `return /\d+/.test(s)`
+_REGEX_KEYWORDS = {
+    "return", "typeof", "case", "do", "else", "in", "of", "new", "delete", "void", "throw", "instanceof",
+    "yield", "await",
+}
+_CLOSING = {")": "(", "]": "[", "}": "{"}
+
+
+def _scan_structure(code: str) -> Optional[str]:
+    """
+    Check that strings, comments, template literals and brackets are closed
+
+    Catches the syntax errors of truncated or garbled LLM output without a
+    full JavaScript parser: this is a scan of the tokens that can hide
+    brackets, not a parse, so code that is balanced but invalid passes.
+    Returns the first problem found, None if there is none.
+    """
+    # Open brackets as (char, line); "`" is a template literal and "${" a substitution inside one
+    stack = []
+    line = 1
+    prev = ""
+    i, n = 0, len(code)
+    while i < n:
+        c = code[i]
+        if stack and stack[-1][0] == "`":
+            if c == "\\":
+                i += 2
+                continue
+            if c == "`":
+                stack.pop()
+                prev = "`"
+            elif code.startswith("${", i):
+                stack.append(("${", line))
+                prev = "("
+                i += 2
+                continue
+            elif c == "\n":
+                line += 1
+            i += 1
+            continue
+
+        if c == "\n":
+            line += 1
+        elif c.isspace():
+            pass
+        elif code.startswith("//", i):
+            end = code.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif code.startswith("/*", i):
+            end = code.find("*/", i + 2)
+            if end == -1:
+                return f"Unterminated comment (line {line})"
+            line += code.count("\n", i, end)
+            i = end + 2
+            continue
+        elif c in "'\"":
+            j = i + 1
+            while j < n and code[j] != c:
+                if code[j] == "\\":
+                    j += 1
+                elif code[j] == "\n":
+                    return f"Unterminated string literal (line {line})"
+                j += 1
+            if j >= n:
+                return f"Unterminated string literal (line {line})"
+            i = j + 1
+            prev = "a"
+            continue
+        elif c == "`":
+            stack.append(("`", line))
+        elif c == "/" and (prev == "" or prev in _REGEX_PRECEDERS):
+            j, in_class = i + 1, False
+            while j < n:
+                if code[j] == "\\":
+                    j += 2
+                    continue
+                if code[j] == "\n":
+                    return f"Unterminated regular expression (line {line})"
+                if code[j] == "[":
+                    in_class = True
+                elif code[j] == "]":
+                    in_class = False
+                elif code[j] == "/" and not in_class:
+                    break
+                j += 1
+            i = j + 1
+            prev = "a"
+            continue
+        elif c.isalnum() or c in "_$":
+            j = i + 1
+            while j < n and (code[j].isalnum() or code[j] in "_$"):
+                j += 1
+            # A "/" divides an identifier or a number, but starts a regular expression after a keyword
+            prev = "(" if code[i:j] in _REGEX_KEYWORDS else "a"
+            i = j
+            continue
+        elif code.startswith("++", i) or code.startswith("--", i):
+            # `i++ / 2` divides
+            prev = "a"
+            i += 2
+            continue
+        elif c in "([{":
+            stack.append((c, line))
+            prev = c
+        elif c in _CLOSING:
+            top = stack[-1][0] if stack else None
+            if c == "}" and top == "${":
+                # Back inside the template literal
+                stack.pop()
+                i += 1
+                continue
+            if top != _CLOSING[c]:
+                return f"Unexpected '{c}' (line {line})"
+            stack.pop()
+            prev = c
+        else:
+            prev = c
+        i += 1
+
+    if stack:
+        char, opened_at = stack[-1]
+        return f"'{char}' opened on line {opened_at} is never closed"
+    return None
+
+
+def syntax_error(code: str) -> Optional[str]:
+    """
+    The syntax error of the code, None if there is none
+
+    The code is parsed with esprima when it is installed, otherwise only
+    checked by the structural scan above.
+    """
+    if esprima is not None:
+        try:
+            esprima.parseScript(code)
+            return None
+        except Exception as e:
+            return str(e)
+    return _scan_structure(code)
+
+
+def validate_plot_code(code: str, file_name: str) -> List[str]:
+    """
+    Static checks of the d3.js code generated by PlotterAgent
+
+    Checks that the code has no syntax error (see syntax_error) and follows
+    the rules of the Plotter prompt that the frontend relies on.
+
+    Returns:
+        list: the problems found, empty if the code passed every check
+    """
+    failures = []
+    if code.lstrip().startswith("```"):
+        failures.append("The code is wrapped in a markdown code fence, return the plain code")
+        code = re.sub(r"^\s*```\w*\n?|\n?```\s*$", "", code)
+
+    error = syntax_error(code)
+    if error:
+        failures.append(f"Syntax error: {error}")
+
+    if not re.search(r"\b(?:const|let|var|function)\s+GeneratedViz\b", code):
+        failures.append("The component must be defined as `const GeneratedViz = () => { ... }`")
+    if not re.search(r"\bchartRef\s*=\s*React\.useRef\(", code):
+        failures.append("The container ref must be created with `const chartRef = React.useRef(null)`")
+    if not re.search(r"\bnew\s+ResizeObserver\s*\(", code) or not re.search(r"\.observe\(\s*chartRef\.current", code):
+        failures.append("renderChart must be called from a ResizeObserver observing chartRef.current")
+    if not re.search(r"\.disconnect\(\s*\)", code):
+        failures.append("The effect must return a cleanup that disconnects the ResizeObserver")
+    if not re.search(r"\.select\(\s*[\"']svg[\"']\s*\)\s*\.remove\(\s*\)", code):
+        failures.append('The previous svg must be removed before rendering: d3.select(container).select("svg").remove()')
+    if re.search(r"\breturn\s*\(?\s*<[A-Za-z]", code):
+        failures.append("The component returns JSX, it must return React.createElement")
+    if not re.search(r"return\s+React\.createElement\(\s*[\"']div[\"']\s*,\s*\{[^}]*\bref\s*:\s*chartRef\b", code):
+        failures.append('The component must return React.createElement("div", { ref: chartRef, className: "w-full h-full bg-[#22222E]" })')
+
+    if file_name not in code:
+        failures.append(f"The data must be read from {file_name}")
+    other_files = sorted(set(re.findall(r"/data/[\w.\-]+\.csv", code)) - {file_name})
+    if other_files:
+        failures.append(f"The code reads other data files ({', '.join(other_files)}), only {file_name} exists")
+    return failures
@@ -0,0 +1,103 @@
+import contextvars
+import re
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+# Receives the text of the current LLM completion as it arrives, set by stream_llm_output
+stream_sink_var: contextvars.ContextVar[Optional[Callable[[str], None]]] = contextvars.ContextVar(
+    "stream_sink", default=None
+)
+
+# Field headers of the dspy ChatAdapter format, e.g. "[[ ## plot_code ## ]]"
+_HEADER = re.compile(r"\[\[ ## (\w+) ## \]\]\n?")
+_HEADER_OPENING = "[[ ## "
+_HEADER_CLOSING = " ## ]]"
+# Longest text that can still turn out to be the start of a header
+_HEADER_MAX_CHARS = 64
+
+
+def _is_header_prefix(text: str) -> bool:
+    """Whether text is the beginning of a field header that was cut off"""
+    if len(text) <= len(_HEADER_OPENING):
+        return _HEADER_OPENING.startswith(text)
+    if not text.startswith(_HEADER_OPENING):
+        return False
+    rest = text[len(_HEADER_OPENING):]
+    name = re.match(r"\w*", rest).group()
+    return _HEADER_CLOSING.startswith(rest[len(name):])
+
+
+@contextmanager
+def stream_llm_output(on_text: Callable[[str], None]):
+    """
+    Stream the completions of the LLM calls made inside the block to on_text
+
+    Usage:
+        with stream_llm_output(lambda text: print(text or "", end="")):
+            response = predictor(...)
+
+    The calls still return the complete response, streaming only adds the
+    incremental text on the side. on_text(None) marks the start of each
+    completion, a call may be retried or re-asked in another format.
+    """
+    token = stream_sink_var.set(on_text)
+    try:
+        yield
+    finally:
+        stream_sink_var.reset(token)
+
+
+class FieldStreamParser:
+    """
+    Split the streamed text of a dspy completion into per-field deltas
+
+    Headers may be cut across chunks, so text that could be the start of a
+    header is held back until the next chunk tells.
+    """
+
+    def __init__(self) -> None:
+        self.field: Optional[str] = None
+        self._buffer = ""
+        # The newline after a header may arrive with the next chunk
+        self._strip_newline = False
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """Returns: list of (field name, new text of the field)"""
+        self._buffer += text
+        deltas = []
+        while True:
+            if self._strip_newline and self._buffer:
+                self._strip_newline = False
+                if self._buffer.startswith("\n"):
+                    self._buffer = self._buffer[1:]
+            match = _HEADER.search(self._buffer)
+            if match is None:
+                break
+            self._emit(deltas, self._buffer[: match.start()])
+            self.field = match.group(1)
+            self._buffer = self._buffer[match.end():]
+            self._strip_newline = not match.group(0).endswith("\n")
+
+        cut = len(self._buffer)
+        for i in range(max(len(self._buffer) - _HEADER_MAX_CHARS, 0), len(self._buffer)):
+            if self._buffer[i] == "[" and _is_header_prefix(self._buffer[i:]):
+                cut = i
+                break
+        self._emit(deltas, self._buffer[:cut])
+        self._buffer = self._buffer[cut:]
+        return deltas
+
+    def reset(self):
+        self.field = None
+        self._buffer = ""
+        self._strip_newline = False
+
+    def flush(self) -> List[Tuple[str, str]]:
+        deltas = []
+        self._emit(deltas, self._buffer)
+        self._buffer = ""
+        return deltas
+
+    def _emit(self, deltas: List[Tuple[str, str]], text: str):
+        if text and self.field is not None and self.field != "completed":
+            deltas.append((self.field, text))
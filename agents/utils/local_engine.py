@@ -0,0 +1,157 @@
+import re
+import sqlite3
+from typing import Dict, Optional
+
+import pandas as pd
+
+from agents.utils.sql_analysis import strip_statement_end
+
+try:
+    import duckdb
+except ImportError:  # DuckDB is optional, fall back to the stdlib SQLite
+    duckdb = None
+
+# SQL dialect understood by run_local_query, passed to the LLM when it writes local queries
+LOCAL_SQL_DIALECT = "DuckDB" if duckdb is not None else "SQLite"
+
+# The local queries are written by the LLM from user prompts: no files, network or extensions
+_DUCKDB_CONFIG = {"enable_external_access": False, "lock_configuration": True}
+# SQLite actions a local query may perform once the tables are loaded (ATTACH, PRAGMA, writes, ... are denied)
+_SQLITE_READ_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, "SQLITE_RECURSIVE", 33),
+}
+
+
+def _sqlite_read_only(action: int, *args) -> int:
+    return sqlite3.SQLITE_OK if action in _SQLITE_READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+# Statements and clauses that have no place in a read-only query
+_FORBIDDEN_KEYWORDS = {
+    "copy", "attach", "detach", "install", "load", "pragma", "export", "import", "insert", "update", "delete",
+    "create", "drop", "alter", "call", "set", "reset", "checkpoint", "vacuum",
+}
+# Functions reading files or the environment (read_csv, parquet_scan, glob, ...)
+_FORBIDDEN_FUNCTION_RE = re.compile(r"^(?:read_\w+|\w+_scan|glob|getenv|load_extension)$", re.IGNORECASE)
+# Keywords ending the FROM clause of a query
+_FROM_CLAUSE_END = {
+    "where", "group", "having", "order", "limit", "offset", "window", "qualify", "union", "except", "intersect",
+    "on", "using", "select",
+}
+_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\w+|\S")
+
+
+def local_query_problem(sql: str, table_names) -> Optional[str]:
+    """
+    Why a local query may not run, None if it is a single read-only SELECT over the given tables
+
+    Only the tables passed to run_local_query and the CTEs of the query may
+    be read; statements other than SELECT, table functions and functions
+    reaching the filesystem are rejected.
+    """
+    tokens = _TOKEN_RE.findall(strip_statement_end(sql))
+    words = [token.lower() for token in tokens]
+    if not words or words[0] not in ("select", "with"):
+        return "The local query must be a SELECT statement"
+    if ";" in words:
+        return "The local query must be a single statement"
+
+    readable = {name.lower() for name in table_names}
+    for i, word in enumerate(words):
+        if word in _FORBIDDEN_KEYWORDS:
+            return f"The local query may not use {word.upper()}"
+        following = words[i + 1] if i + 1 < len(words) else None
+        if following == "(" and _FORBIDDEN_FUNCTION_RE.match(word):
+            return f"The local query may not call {tokens[i]}"
+        if word == "as" and following == "(":
+            # CTE, possibly with a column list: name [(columns)] AS (
+            j = i - 1
+            if words[j] == ")":
+                while j > 0 and words[j] != "(":
+                    j -= 1
+                j -= 1
+            readable.add(words[j].strip('"'))
+
+    # Whether each open parenthesis holds a query, the statement itself does
+    levels = [True]
+    in_from = [False]
+    for i, word in enumerate(words):
+        following = words[i + 1] if i + 1 < len(words) else ""
+        if word == "(":
+            levels.append(following in ("select", "with"))
+            in_from.append(False)
+            continue
+        if word == ")":
+            if len(levels) > 1:
+                levels.pop()
+                in_from.pop()
+            continue
+        if not levels[-1]:
+            continue
+        if word in ("from", "join") or (word == "," and in_from[-1]):
+            in_from[-1] = True
+            # A subquery, or a table or CTE of the query; not a file name or a table function
+            if following != "(" and following.strip('"') not in readable:
+                return f"The local query may only read {', '.join(sorted(table_names))}, not {following or 'nothing'}"
+        elif word in _FROM_CLAUSE_END:
+            in_from[-1] = False
+    return None
+
+
+def run_local_query(sql: str, tables: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Run a SQL query over in-memory DataFrames
+
+    The engine can only read the given tables: DuckDB runs without external
+    access (no read_csv, COPY ... TO, ATTACH or extensions) and SQLite with
+    an authorizer that denies everything but reads.
+
+    Args:
+        sql: query in LOCAL_SQL_DIALECT referencing the keys of `tables`
+        tables: table name -> DataFrame
+
+    Returns:
+        pd.DataFrame: query result
+
+    Raises:
+        ValueError: the query is not a read-only SELECT over the tables (see local_query_problem)
+    """
+    problem = local_query_problem(sql, tables)
+    if problem:
+        raise ValueError(problem)
+    if duckdb is not None:
+        conn = duckdb.connect(":memory:", config=_DUCKDB_CONFIG)
+        try:
+            for name, df in tables.items():
+                conn.register(name, df)
+            return conn.execute(sql).df()
+        finally:
+            conn.close()
+
+    conn = sqlite3.connect(":memory:")
+    try:
+        for name, df in tables.items():
+            df.to_sql(name, conn, index=False)
+        conn.set_authorizer(_sqlite_read_only)
+        return pd.read_sql_query(sql, conn)
+    finally:
+        conn.close()
+
+
+def chain_local_queries(base_sql: str, sql: str) -> str:
+    """
+    Combine two local queries over `base` into one: `sql` reads the result of `base_sql`
+
+    Used for datasets derived from datasets that were themselves derived
+    locally, so that they can still be recomputed from the Dune query.
+    """
+    base_sql = base_sql.strip().rstrip(";")
+    sql = sql.strip().rstrip(";")
+    match = re.match(r"with\s+(?!recursive\b)", sql, re.IGNORECASE)
+    if match:
+        # Prepend base to the existing CTEs, a second WITH would not parse
+        return f"WITH base AS (\n{base_sql}\n),\n{sql[match.end():]}"
+    return f"WITH base AS (\n{base_sql}\n)\n{sql}"
@@ -0,0 +1,85 @@
+import time
+
+import dspy
+import litellm
+
+from agents.utils.deadline import check_deadline
+from agents.utils.llm_stream import stream_sink_var
+from agents.utils.rate_limit import call_with_backoff, llm_limiter
+from agents.utils.tracing import current_span_name
+from agents.utils.usage import usage_tracker
+
+
+class MeteredLM(dspy.BaseLM):
+    """
+    Wraps a dspy LM and records tokens, cost and wall time of every call
+
+    Calls go through the process-wide LLM rate limiter, which also retries
+    rate-limited and transient failures with backoff. Inside
+    stream_llm_output the completion is streamed and its text forwarded as
+    it arrives.
+    """
+
+    def __init__(self, lm: dspy.BaseLM):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=lm.cache)
+        self.lm = lm
+        # Predict and the adapters read the LM's default kwargs (temperature, max_tokens, ...)
+        self.kwargs = lm.kwargs
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        # Tasks still running after their request returned stop at the next LLM call
+        check_deadline(current_span_name() or "llm")
+        start = time.perf_counter()
+        on_text = stream_sink_var.get()
+        if on_text is not None:
+            response = call_with_backoff(
+                llm_limiter, self._forward_streaming, on_text, prompt=prompt, messages=messages, **kwargs
+            )
+        else:
+            response = call_with_backoff(
+                llm_limiter, self.lm.forward, prompt=prompt, messages=messages, **kwargs
+            )
+        seconds = time.perf_counter() - start
+
+        usage = getattr(response, "usage", None) or {}
+        usage = usage if isinstance(usage, dict) else dict(usage)
+        hidden_params = getattr(response, "_hidden_params", None) or {}
+        usage_tracker.record(
+            stage=current_span_name() or "llm",
+            prompt_tokens=usage.get("prompt_tokens") or 0,
+            completion_tokens=usage.get("completion_tokens") or 0,
+            seconds=seconds,
+            cost=hidden_params.get("response_cost"),
+            cached=bool(getattr(response, "cache_hit", False)),
+        )
+        return response
+
+    def _forward_streaming(self, on_text, prompt=None, messages=None, **kwargs):
+        # A new completion starts, e.g. a retry or the adapter's JSON fallback
+        on_text(None)
+        if hasattr(self.lm, "forward_stream"):
+            return self.lm.forward_stream(on_text, prompt=prompt, messages=messages, **kwargs)
+        if not isinstance(self.lm, dspy.LM) or self.lm.model_type != "chat":
+            # No streaming support, forward the whole completion at once
+            response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+            on_text(response.choices[0].message.content or "")
+            return response
+
+        # Same request as dspy.LM.forward; streamed responses are not cached
+        kwargs.pop("cache", None)
+        kwargs.pop("cache_in_memory", None)
+        messages = messages or [{"role": "user", "content": prompt}]
+        chunks = []
+        for chunk in litellm.completion(
+            model=self.lm.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            max_retries=0,
+            **{**self.lm.kwargs, **kwargs},
+        ):
+            chunks.append(chunk)
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                on_text(text)
+        return litellm.stream_chunk_builder(chunks, messages=messages)
@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+QUERY_HISTORY_DB = os.getenv("QUERY_HISTORY_DB", "agents/data/query_history.db")
+# Runs older than this are ignored when summarizing the history, and runs and requests older than this are pruned
+QUERY_HISTORY_MAX_AGE_DAYS = int(os.getenv("QUERY_HISTORY_MAX_AGE_DAYS", "30"))
+# Seconds between two prunes of the history
+_PRUNE_INTERVAL_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fingerprint TEXT NOT NULL,
+    tables TEXT NOT NULL,
+    cost_score REAL,
+    performance TEXT NOT NULL,
+    state TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    rows INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_query_runs_fingerprint ON query_runs (fingerprint, created_at);
+CREATE INDEX IF NOT EXISTS ix_query_runs_tables ON query_runs (tables, created_at);
+CREATE TABLE IF NOT EXISTS query_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sql_key TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_query_requests_created ON query_requests (created_at, sql_key);
+"""
+
+
+class QueryHistory:
+    """
+    Runtimes and outcomes of past Dune executions, stored in SQLite
+
+    Each run is keyed by the fingerprint of its normalized SQL and by the set of
+    tables it reads, so that history is available both for repeated queries
+    and for new queries over the same tables. The queries requested by users
+    are recorded separately to rank them by popularity. Runs and requests
+    older than `max_age_days` are pruned once per hour, on insert.
+    """
+
+    def __init__(self, path: str = QUERY_HISTORY_DB, max_age_days: int = QUERY_HISTORY_MAX_AGE_DAYS):
+        self.path = path
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pruned_at = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def record(
+        self,
+        fingerprint: str,
+        tables: List[str],
+        performance: str,
+        state: str,
+        seconds: float,
+        cost_score: Optional[float] = None,
+        rows: Optional[int] = None,
+        error: Optional[str] = None,
+    ):
+        """Record one execution; state is "completed", "failed", "cancelled" or "timeout" """
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO query_runs (fingerprint, tables, cost_score, performance, state, "
+                "seconds, rows, error, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    fingerprint,
+                    json.dumps(sorted(tables)),
+                    cost_score,
+                    performance,
+                    state,
+                    seconds,
+                    rows,
+                    error[:1000] if error else None,
+                    time.time(),
+                ),
+            )
+            self._prune_if_due(conn)
+            conn.commit()
+
+    def record_request(self, sql_key: str, sql: str):
+        """Record that an interactive request asked for a query, whether or not it was executed"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO query_requests (sql_key, sql, created_at) VALUES (?, ?, ?)",
+                (sql_key, sql, time.time()),
+            )
+            self._prune_if_due(conn)
+            conn.commit()
+
+    def _prune_if_due(self, conn: sqlite3.Connection):
+        now = time.time()
+        if self._pruned_at is not None and now - self._pruned_at < _PRUNE_INTERVAL_SECONDS:
+            return
+        since = now - self.max_age_days * 86400
+        conn.execute("DELETE FROM query_runs WHERE created_at < ?", (since,))
+        conn.execute("DELETE FROM query_requests WHERE created_at < ?", (since,))
+        self._pruned_at = now
+
+    def popular_queries(self, limit: int, days: int = 7) -> List[Dict[str, Any]]:
+        """
+        Most requested queries of the last `days` days
+
+        Returns:
+            list: [{"sql_key", "sql", "requests", "last_requested_at"}], most requested first
+        """
+        since = time.time() - days * 86400
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT sql_key, MAX(sql), COUNT(*) AS requests, MAX(created_at) FROM query_requests "
+                "WHERE created_at >= ? GROUP BY sql_key ORDER BY requests DESC, MAX(created_at) DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [
+            {"sql_key": r[0], "sql": r[1], "requests": r[2], "last_requested_at": r[3]}
+            for r in rows
+        ]
+
+    def summarize(self, fingerprint: str, tables: List[str]) -> Dict[str, Any]:
+        """
+        Summarize past runs of the same query, falling back to queries over the same tables
+
+        Returns:
+            dict: {"match": "fingerprint" | "tables" | None, "runs": n, "tiers": {
+                performance: {"runs", "median_seconds", "failure_rate", "timeout_rate"}}}
+        """
+        since = time.time() - self.max_age_days * 86400
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT performance, state, seconds FROM query_runs "
+                "WHERE fingerprint = ? AND created_at >= ?",
+                (fingerprint, since),
+            ).fetchall()
+            match = "fingerprint" if rows else None
+            if not rows and tables:
+                rows = conn.execute(
+                    "SELECT performance, state, seconds FROM query_runs "
+                    "WHERE tables = ? AND created_at >= ? ORDER BY created_at DESC LIMIT 200",
+                    (json.dumps(sorted(tables)), since),
+                ).fetchall()
+                match = "tables" if rows else None
+
+        tiers = {}
+        for performance in {r[0] for r in rows}:
+            runs = [r for r in rows if r[0] == performance]
+            completed = [r[2] for r in runs if r[1] == "completed"]
+            tiers[performance] = {
+                "runs": len(runs),
+                "median_seconds": statistics.median(completed) if completed else None,
+                "failure_rate": sum(r[1] == "failed" for r in runs) / len(runs),
+                "timeout_rate": sum(r[1] == "timeout" for r in runs) / len(runs),
+            }
+        return {"match": match, "runs": len(rows), "tiers": tiers}
+
+
+query_history = QueryHistory()
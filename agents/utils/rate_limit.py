@@ -0,0 +1,264 @@
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Mapping, Optional
+
+from prometheus_client import Counter
+
+from agents.utils.scheduler import INTERACTIVE, current_priority
+
+# Requests per minute allowed towards each provider, shared by all threads of the process
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+DUNE_REQUESTS_PER_MINUTE = float(os.getenv("DUNE_REQUESTS_PER_MINUTE", "300"))
+# Attempts of one call when the provider rate-limits it or fails transiently
+RATE_LIMIT_MAX_ATTEMPTS = int(os.getenv("RATE_LIMIT_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("BACKOFF_BASE_SECONDS", "1"))
+BACKOFF_MAX_SECONDS = float(os.getenv("BACKOFF_MAX_SECONDS", "60"))
+
+# Error classes besides errors of the request itself (e.g. SQL errors)
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+
+RATE_LIMITED = Counter(
+    "visualyze_rate_limited_total", "Calls rejected by a provider's rate limit", ["provider"]
+)
+BACKOFF_RETRIES = Counter(
+    "visualyze_backoff_retries_total", "Calls retried after backing off", ["provider", "error_class"]
+)
+
+_TRANSIENT_STATUS = {408, 500, 502, 503, 504, 529}
+_TRANSIENT_EXCEPTIONS = {
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+    "TimeoutError",
+    "TimeoutException",
+    "ConnectError",
+    "RemoteProtocolError",
+    "APIConnectionError",
+    "ServiceUnavailableError",
+    "InternalServerError",
+}
+_RATE_LIMIT_PATTERN = re.compile(
+    r"\b429 client error|rate.?limit|too many requests|too many 429|限流", re.IGNORECASE
+)
+# A used-up quota also answers 429, but waiting does not help
+_QUOTA_PATTERN = re.compile(r"quota|credits|billing|insufficient_quota", re.IGNORECASE)
+_TRANSIENT_PATTERN = re.compile(
+    r"\b50[234] server error|bad gateway|service unavailable|gateway time-?out|temporarily unavailable"
+    r"|connection (reset|refused|aborted)|read timed out|暂时不可用",
+    re.IGNORECASE,
+)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: Any) -> Optional[str]:
+    """
+    Classify an exception or an error message
+
+    Returns:
+        str: RATE_LIMIT, TRANSIENT, or None if retrying the same request would not help
+    """
+    if _QUOTA_PATTERN.search(str(error or "")):
+        return None
+    if isinstance(error, BaseException):
+        status = _status_code(error)
+        if status == 429:
+            return RATE_LIMIT
+        if status in _TRANSIENT_STATUS:
+            return TRANSIENT
+        if status is None and type(error).__name__ in _TRANSIENT_EXCEPTIONS:
+            return TRANSIENT
+    message = str(error or "")
+    if _RATE_LIMIT_PATTERN.search(message):
+        return RATE_LIMIT
+    if _TRANSIENT_PATTERN.search(message):
+        return TRANSIENT
+    return None
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds to wait from Retry-After (seconds or HTTP date) or retry-after-ms headers"""
+    if not headers:
+        return None
+    headers = {str(name).lower(): value for name, value in headers.items()}
+    try:
+        if headers.get("retry-after-ms"):
+            return max(float(headers["retry-after-ms"]) / 1000, 0.0)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        retry_at = parsedate_to_datetime(value)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Retry-After of the response attached to an exception (requests, httpx or litellm)"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        headers = getattr(error, "litellm_response_headers", None)
+    return parse_retry_after(headers)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_MAX_SECONDS) -> float:
+    """Exponential backoff with full jitter, so that threads failing together retry apart"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all threads calling one provider
+
+    The refill rate adapts to the provider: it is halved on every rate-limited
+    response and grows back by a small step per successful call, up to the
+    configured rate. A Retry-After pauses every caller, not only the one that
+    received it. Background callers leave the tokens to interactive callers
+    that are waiting for one.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, burst: Optional[float] = None):
+        self.name = name
+        self.max_rate = requests_per_minute / 60
+        self.rate = self.max_rate
+        self.burst = burst or max(1.0, self.max_rate * 5)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._interactive_waiting = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until the caller may send one request"""
+        if self.max_rate <= 0:
+            return
+        interactive = current_priority() == INTERACTIVE
+        waiting = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._blocked_until - now
+                    if wait <= 0:
+                        if interactive or not self._interactive_waiting:
+                            if self._tokens >= 1:
+                                self._tokens -= 1
+                                return
+                            wait = (1 - self._tokens) / self.rate
+                        else:
+                            wait = 1 / self.rate
+                    if interactive and not waiting:
+                        waiting = True
+                        self._interactive_waiting += 1
+                time.sleep(wait)
+        finally:
+            if waiting:
+                with self._lock:
+                    self._interactive_waiting -= 1
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        RATE_LIMITED.labels(provider=self.name).inc()
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+
+def _backoff_wait(
+    limiter: RateLimiter, error: Exception, attempt: int, retry_transient: bool, max_attempts: int
+) -> Optional[float]:
+    """Seconds to wait before retrying a failed call, None if it must not be retried"""
+    error_class = classify_error(error)
+    retryable = error_class == RATE_LIMIT or (error_class == TRANSIENT and retry_transient)
+    if not retryable or attempt >= max_attempts:
+        return None
+    wait = retry_after(error)
+    if error_class == RATE_LIMIT:
+        limiter.on_rate_limited(wait)
+    BACKOFF_RETRIES.labels(provider=limiter.name, error_class=error_class).inc()
+    return max(wait or 0.0, backoff_delay(attempt))
+
+
+def call_with_backoff(
+    limiter: RateLimiter,
+    fn: Callable[..., Any],
+    *args,
+    retry_transient: bool = True,
+    max_attempts: int = RATE_LIMIT_MAX_ATTEMPTS,
+    **kwargs,
+) -> Any:
+    """
+    Call fn through the limiter, retrying rate-limited (and transient) failures
+
+    Set retry_transient=False for calls that must not be repeated when their
+    outcome is unknown, e.g. starting an execution.
+    """
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            attempt += 1
+            wait = _backoff_wait(limiter, e, attempt, retry_transient, max_attempts)
+            if wait is None:
+                raise
+            time.sleep(wait)
+            continue
+        limiter.on_success()
+        return result
+
+
+async def acall_with_backoff(
+    limiter: RateLimiter,
+    fn: Callable[..., Awaitable[Any]],
+    *args,
+    retry_transient: bool = True,
+    max_attempts: int = RATE_LIMIT_MAX_ATTEMPTS,
+    **kwargs,
+) -> Any:
+    """Async version of call_with_backoff for coroutine functions, waits off the event loop"""
+    attempt = 0
+    while True:
+        # The limiter is shared with the worker threads and blocks, copy_context keeps the priority
+        await asyncio.to_thread(limiter.acquire)
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            attempt += 1
+            wait = _backoff_wait(limiter, e, attempt, retry_transient, max_attempts)
+            if wait is None:
+                raise
+            await asyncio.sleep(wait)
+            continue
+        limiter.on_success()
+        return result
+
+
+llm_limiter = RateLimiter("llm", LLM_REQUESTS_PER_MINUTE)
+dune_limiter = RateLimiter("dune", DUNE_REQUESTS_PER_MINUTE)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import pandas as pd
+from prometheus_client import Counter
+
+RESULT_STORE_DIR = os.getenv("RESULT_STORE_DIR", "agents/data/results")
+# Results of popular queries kept warm by the prewarmer older than this are not served to interactive requests
+RESULT_STORE_TTL_SECONDS = int(os.getenv("RESULT_STORE_TTL_SECONDS", str(12 * 3600)))
+# Same for the results of ordinary executions: relative time windows ("last 24h", now()) go stale quickly
+RESULT_STORE_INTERACTIVE_TTL_SECONDS = int(os.getenv("RESULT_STORE_INTERACTIVE_TTL_SECONDS", "600"))
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "500"))
+
+RESULT_STORE_LOOKUPS = Counter(
+    "visualyze_result_store_lookups_total", "Result store lookups", ["outcome"]
+)
+
+# Who stored a result, which decides how long it is served
+SOURCE_INTERACTIVE = "interactive"
+SOURCE_PREWARM = "prewarm"
+
+
+def result_key(canonical_sql: str) -> str:
+    return hashlib.sha256(canonical_sql.encode("utf-8")).hexdigest()[:24]
+
+
+class ResultStore:
+    """
+    Dune query results kept on disk, keyed by the canonical SQL
+
+    Each entry is a csv file plus a small json file with the SQL, the time
+    it was stored and who stored it. Results stored by the prewarmer expire
+    after `ttl` seconds, the others after `interactive_ttl` seconds, and the
+    oldest entries are dropped once there are more than `max_entries`.
+
+    A served result carries the time it was stored in
+    df.attrs["stored_at"], so that its age can be shown with it.
+    """
+
+    def __init__(
+        self,
+        directory: str = RESULT_STORE_DIR,
+        ttl: int = RESULT_STORE_TTL_SECONDS,
+        max_entries: int = RESULT_STORE_MAX_ENTRIES,
+        interactive_ttl: int = RESULT_STORE_INTERACTIVE_TTL_SECONDS,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.interactive_ttl = interactive_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return f"{base}.csv", f"{base}.json"
+
+    def _meta(self, canonical_sql: str) -> Optional[dict]:
+        _, meta_path = self._paths(result_key(canonical_sql))
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            float(meta["stored_at"])
+            return meta
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def age(self, canonical_sql: str) -> Optional[float]:
+        """Seconds since the result was stored, None if there is none"""
+        meta = self._meta(canonical_sql)
+        return None if meta is None else time.time() - meta["stored_at"]
+
+    def get(self, canonical_sql: str) -> Optional[pd.DataFrame]:
+        """Return the stored result if it is younger than the TTL of whoever stored it"""
+        meta = self._meta(canonical_sql)
+        if meta is None:
+            RESULT_STORE_LOOKUPS.labels(outcome="miss").inc()
+            return None
+        # Entries written before the source was recorded count as ordinary results
+        ttl = self.ttl if meta.get("source") == SOURCE_PREWARM else self.interactive_ttl
+        if time.time() - meta["stored_at"] > ttl:
+            RESULT_STORE_LOOKUPS.labels(outcome="expired").inc()
+            return None
+        csv_path, _ = self._paths(result_key(canonical_sql))
+        try:
+            df = pd.read_csv(csv_path)
+        except (OSError, ValueError):
+            RESULT_STORE_LOOKUPS.labels(outcome="miss").inc()
+            return None
+        RESULT_STORE_LOOKUPS.labels(outcome="hit").inc()
+        df.attrs["stored_at"] = meta["stored_at"]
+        return df
+
+    def put(self, canonical_sql: str, sql: str, df: pd.DataFrame, source: str = SOURCE_INTERACTIVE):
+        os.makedirs(self.directory, exist_ok=True)
+        csv_path, meta_path = self._paths(result_key(canonical_sql))
+        # Write to temporary files first so readers never see a partial result
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_csv(csv_path + suffix, index=False)
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(
+                {"sql": sql, "rows": len(df), "stored_at": time.time(), "source": source}, f, ensure_ascii=False
+            )
+        with self._lock:
+            os.replace(csv_path + suffix, csv_path)
+            os.replace(meta_path + suffix, meta_path)
+            self._prune()
+
+    def _prune(self):
+        entries = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".json")
+        ]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for meta_path in entries[: len(entries) - self.max_entries]:
+            for path in (meta_path, f"{meta_path[:-len('.json')]}.csv"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+result_store = ResultStore()
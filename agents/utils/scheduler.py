@@ -0,0 +1,151 @@
+import contextvars
+import heapq
+import itertools
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+# Priority classes of the work sharing the LLM and Dune capacity
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+# Share of the workers of a pool that background work may hold at once, the rest stays free for interactive work
+SCHEDULER_BACKGROUND_MAX_SHARE = float(os.getenv("SCHEDULER_BACKGROUND_MAX_SHARE", "0.5"))
+# Share of the dispatches that go to waiting background work even while interactive work is queued
+SCHEDULER_BACKGROUND_MIN_SHARE = float(os.getenv("SCHEDULER_BACKGROUND_MIN_SHARE", "0.05"))
+# Weights of the fair share of wallets, e.g. "0xabc:4,0xdef:2"; other wallets weigh 1
+SCHEDULER_WALLET_WEIGHTS = os.getenv("SCHEDULER_WALLET_WEIGHTS", "")
+
+# Priority of the work being processed, propagated to worker threads with copy_context()
+priority_var = contextvars.ContextVar("priority", default=INTERACTIVE)
+
+SCHEDULER_DISPATCHED = Counter(
+    "visualyze_scheduler_dispatched_total",
+    "Work items dispatched by a fair queue",
+    ["queue", "priority", "reason"],
+)
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        wallet, _, weight = entry.rpartition(":")
+        weights[wallet.lower()] = max(float(weight), 0.01)
+    return weights
+
+
+_wallet_weights = _parse_weights(SCHEDULER_WALLET_WEIGHTS)
+
+
+def wallet_weight(wallet_address: Optional[str]) -> float:
+    return _wallet_weights.get((wallet_address or "").lower(), 1.0)
+
+
+def parse_priority(value: Optional[str]) -> str:
+    """The priority class named by a request, interactive when it names none"""
+    priority = (value or INTERACTIVE).lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {value!r}, expected one of {', '.join(PRIORITIES)}")
+    return priority
+
+
+def current_priority() -> str:
+    return priority_var.get()
+
+
+@contextmanager
+def work_priority(priority: str):
+    """Run the enclosed work (and the threads started from a copy of its context) in a priority class"""
+    token = priority_var.set(parse_priority(priority))
+    try:
+        yield
+    finally:
+        priority_var.reset(token)
+
+
+class FairQueue:
+    """
+    Queue of work items with priority classes and a weighted fair share of wallets
+
+    Interactive items are dispatched before background ones; a background
+    item that is still queued is overtaken by every interactive item that
+    arrives after it, except for a small minimum share so that background
+    work does not starve. Within a class, wallets are served in proportion
+    to their weight (start-time fair queueing): a wallet submitting many
+    items does not delay the first item of another wallet.
+
+    Not thread-safe, callers hold their own lock (or run on one event loop).
+    """
+
+    def __init__(self, name: str, min_background_share: float = SCHEDULER_BACKGROUND_MIN_SHARE) -> None:
+        self.name = name
+        self._heaps: Dict[str, List[Tuple[float, int, Any]]] = {priority: [] for priority in PRIORITIES}
+        # Virtual time of each class and virtual finish time of the last item of each wallet
+        self._virtual_time: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self._finish: Dict[Tuple[str, str], float] = {}
+        self._sequence = itertools.count()
+        # Interactive dispatches after which a waiting background item goes first
+        self._background_every = int(1 / min_background_share) if min_background_share > 0 else None
+        self._interactive_streak = 0
+
+    def __len__(self) -> int:
+        return sum(len(heap) for heap in self._heaps.values())
+
+    def queued(self, priority: str) -> int:
+        return len(self._heaps[priority])
+
+    def push(self, item: Any, priority: str = INTERACTIVE, wallet_address: Optional[str] = None):
+        wallet = (wallet_address or "").lower()
+        start = max(self._virtual_time[priority], self._finish.get((priority, wallet), 0.0))
+        self._finish[(priority, wallet)] = start + 1 / wallet_weight(wallet)
+        heapq.heappush(self._heaps[priority], (start, next(self._sequence), item))
+
+    def pop(self, allow_background: bool = True) -> Optional[Tuple[str, Any]]:
+        """
+        The next item to run
+
+        Args:
+            allow_background: False when the caller has no room for background work
+
+        Returns:
+            tuple: (priority, item), None when nothing may run
+        """
+        background_waiting = allow_background and bool(self._heaps[BACKGROUND])
+        if self._heaps[INTERACTIVE]:
+            if not (
+                background_waiting
+                and self._background_every is not None
+                and self._interactive_streak >= self._background_every
+            ):
+                self._interactive_streak = self._interactive_streak + 1 if background_waiting else 0
+                return INTERACTIVE, self._take(INTERACTIVE, "priority")
+            self._interactive_streak = 0
+            return BACKGROUND, self._take(BACKGROUND, "min_share")
+        if background_waiting:
+            return BACKGROUND, self._take(BACKGROUND, "idle")
+        return None
+
+    def _take(self, priority: str, reason: str) -> Any:
+        start, _, item = heapq.heappop(self._heaps[priority])
+        self._virtual_time[priority] = start
+        if not self._heaps[priority]:
+            # Idle class: forget the finish times so that old backlog does not count against a wallet
+            self._finish = {key: finish for key, finish in self._finish.items() if key[0] != priority}
+            self._virtual_time[priority] = 0.0
+        SCHEDULER_DISPATCHED.labels(queue=self.name, priority=priority, reason=reason).inc()
+        return item
+
+    def drain(self) -> List[Any]:
+        """Remove and return every queued item"""
+        items = [item for heap in self._heaps.values() for _, _, item in heap]
+        for heap in self._heaps.values():
+            heap.clear()
+        return items
+
+
+def background_limit(workers: int, share: float = SCHEDULER_BACKGROUND_MAX_SHARE) -> int:
+    """Workers out of `workers` that background work may hold at once"""
+    return max(1, int(workers * share))
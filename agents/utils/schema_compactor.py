@@ -0,0 +1,114 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List
+
+from agents.utils.data_structures import FullTable
+
+# Tables with at most this many columns are passed to the LLM unchanged
+SCHEMA_COMPACT_MIN_COLUMNS = int(os.getenv("SCHEMA_COMPACT_MIN_COLUMNS", "12"))
+# Columns kept by relevance to the task, on top of the key columns
+SCHEMA_MAX_COLUMNS = int(os.getenv("SCHEMA_MAX_COLUMNS", "8"))
+
+# Keys and partition/time columns are always kept, queries filter and join on them
+_KEY_NAMES = {"unique_key", "blockchain", "block_date", "block_month", "block_time", "tx_hash"}
+_KEY_SUFFIXES = ("_key", "_id")
+_TIME_TYPES = ("date", "timestamp")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "is", "it", "of", "on", "or",
+    "over", "per", "the", "their", "this", "to", "what", "which", "with",
+}
+# Task wording that points at columns it does not name, e.g. a ticker needs the symbol column
+_TASK_HINTS = [
+    (re.compile(r"\b[A-Z][A-Z0-9]{1,9}\b"), ["symbol", "contract", "address"]),
+    (re.compile(r"\b0x[0-9a-fA-F]{40}\b"), ["address", "from", "to", "sender", "receiver"]),
+    (re.compile(r"volume|value|usd|\$", re.IGNORECASE), ["amount", "usd", "price"]),
+]
+
+
+def _tokens(text: str) -> List[str]:
+    # Plural and singular forms match, e.g. "transfers" and "transfer"
+    return [
+        token[:-1] if len(token) > 3 and token.endswith("s") else token
+        for token in _TOKEN.findall(text.lower())
+    ]
+
+
+def is_key_column(name: str, column: dict) -> bool:
+    column_type = str(column.get("type", "")).lower()
+    return (
+        name in _KEY_NAMES
+        or name.endswith(_KEY_SUFFIXES)
+        or column_type.startswith(_TIME_TYPES)
+    )
+
+
+def rank_columns(task: str, columns: Dict[str, dict]) -> List[tuple]:
+    """
+    Rank columns by lexical similarity to the task (BM25-like weighting over name and description)
+
+    Returns:
+        list: [(score, column name)], most relevant first
+    """
+    task_tokens = set(_tokens(task)) - _STOPWORDS
+    for pattern, hints in _TASK_HINTS:
+        if pattern.search(task):
+            task_tokens.update(hints)
+    documents = {
+        name: (_tokens(name.replace("_", " ")), _tokens(str(column.get("description", ""))))
+        for name, column in columns.items()
+    }
+    # Tokens shared by many columns say little about any single one
+    document_frequency = Counter(
+        token for name_tokens, description_tokens in documents.values()
+        for token in set(name_tokens) | set(description_tokens)
+    )
+    # Tokens shared by most columns match every one of them, ignore them
+    task_tokens = {token for token in task_tokens if document_frequency[token] <= len(columns) / 2}
+    ranked = []
+    for name, (name_tokens, description_tokens) in documents.items():
+        score = 0.0
+        for token in task_tokens:
+            idf = math.log(1 + len(columns) / (1 + document_frequency[token]))
+            # A match in the column name counts more than one in its description
+            score += idf * (2.0 * (token in name_tokens) + 1.0 * (token in description_tokens))
+        ranked.append((score, name))
+    ranked.sort(key=lambda item: -item[0])
+    return ranked
+
+
+def compact_table_schema(
+    task: str,
+    table: FullTable,
+    max_columns: int = SCHEMA_MAX_COLUMNS,
+    min_columns: int = SCHEMA_COMPACT_MIN_COLUMNS,
+) -> FullTable:
+    """
+    Keep the key columns and the columns most relevant to the task
+
+    Narrow tables, and tasks that match no column at all (e.g. prompts in
+    another language), keep the full schema.
+    """
+    if len(table.columns) <= min_columns:
+        return table
+
+    ranked = [(score, name) for score, name in rank_columns(task, table.columns) if score > 0]
+    if not ranked:
+        return table
+
+    relevant = {name for _, name in ranked[:max_columns]}
+    kept = {
+        name: column
+        for name, column in table.columns.items()
+        if name in relevant or is_key_column(name, column)
+    }
+    if len(kept) >= len(table.columns):
+        return table
+    return FullTable(
+        table_name=table.table_name,
+        description=f"{table.description} (only the columns relevant to the task are listed)",
+        columns=kept,
+    )
@@ -0,0 +1,225 @@
+import hashlib
+import re
+from datetime import date
+from typing import Callable, List, Optional
+
+from pydantic import BaseModel
+
+# Raw tables that are expensive to scan without a tight time filter
+HEAVY_TABLE_PATTERNS = [
+    r"^tokens\.transfers$",
+    r"^dex(_aggregator)?\.trades$",
+    r"^nft\.trades$",
+    r"\.transactions$",
+    r"\.traces$",
+    r"\.logs$",
+    r"\.blocks$",
+]
+# Days assumed to be scanned when a query has no recognizable time filter
+UNBOUNDED_DAYS = 3 * 365
+# Partition columns of heavy tables whose metadata does not list any
+DEFAULT_PARTITION_COLUMNS = ["block_date", "block_month"]
+
+_INTERVAL_UNITS = {"hour": 1 / 24, "day": 1, "week": 7, "month": 30, "year": 365}
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+([a-z_][\w]*\.[a-z_][\w]*)", re.IGNORECASE)
+_INTERVAL_RE = re.compile(r"interval\s+'(\d+)'\s+(hour|day|week|month|year)s?", re.IGNORECASE)
+_DATE_RE = re.compile(r"'(\d{4}-\d{2}-\d{2})")
+# Row limit at the end of the outermost query, as LIMIT n or FETCH FIRST n ROWS ONLY
+_LIMIT_RE = re.compile(
+    r"(?:\blimit\s+(\d+)|\bfetch\s+(?:first|next)\s+(\d+)?\s*rows?\s+only)$", re.IGNORECASE
+)
+# Literals, parentheses and ORDER BY, to find the ORDER BY of the outermost query
+_CLAUSE_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[()]|\border\s+by\b", re.IGNORECASE)
+_AGGREGATE_RE = re.compile(
+    r"\b(?:count|sum|avg|min|max|approx_distinct|approx_percentile|array_agg)\s*\(", re.IGNORECASE
+)
+
+
+class QueryCost(BaseModel):
+    tables: List[str]
+    heavy_tables: List[str]
+    days: float
+    joins: int
+    aggregations: int
+    window_functions: int
+    has_limit: bool
+    score: float
+    # Row limit of the outermost query, if any
+    limit: Optional[int] = None
+    # Heavy tables read without a filter on one of their partition columns
+    unpartitioned_tables: List[str] = []
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Strip comments, case and redundant whitespace outside string literals
+
+    Unlike normalize_sql the literals are kept, so two queries with the same
+    canonical form return the same result.
+    """
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"--[^\n]*", " ", parts[i])
+        part = re.sub(r"/\*.*?\*/", " ", part, flags=re.DOTALL)
+        parts[i] = re.sub(r"\s+", " ", part).lower()
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def strip_sql_comments(sql: str) -> str:
+    """Remove the comments outside string literals, keeping the rest of the query as is"""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"/\*.*?\*/", " ", parts[i], flags=re.DOTALL)
+        parts[i] = re.sub(r"--[^\n]*", "", part)
+    return "".join(parts)
+
+
+def strip_statement_end(sql: str) -> str:
+    """The query without comments, trailing whitespace and semicolons"""
+    return re.sub(r"[\s;]+$", "", strip_sql_comments(sql)).strip()
+
+
+def normalize_sql(sql: str) -> str:
+    """Strip comments, literals and whitespace so that similar queries compare equal"""
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\s+", " ", sql)
+    return sql.strip().rstrip(";").lower()
+
+
+def sql_fingerprint(sql: str) -> str:
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()[:16]
+
+
+def _scanned_days(sql: str, today: date) -> Optional[float]:
+    """Length of the time range the query filters on, or None if there is no filter"""
+    intervals = [int(n) * _INTERVAL_UNITS[unit.lower()] for n, unit in _INTERVAL_RE.findall(sql)]
+    if intervals:
+        return max(intervals)
+
+    dates = []
+    for literal in _DATE_RE.findall(sql):
+        try:
+            dates.append(date.fromisoformat(literal))
+        except ValueError:
+            continue
+    if len(dates) >= 2:
+        return max((max(dates) - min(dates)).days, 1)
+    if dates:
+        return max((today - dates[0]).days, 1)
+    return None
+
+
+def has_partition_filter(sql: str, partition_columns: List[str]) -> bool:
+    """Whether the query compares one of the partition columns, which lets Dune prune partitions"""
+    if not partition_columns:
+        return False
+    columns = "|".join(re.escape(column) for column in partition_columns)
+    pattern = rf"\b(?:{columns})\b\s*(?:>=|<=|>|<|=|\bbetween\b|\bin\b)"
+    return re.search(pattern, sql, re.IGNORECASE) is not None
+
+
+def limit_clause(sql: str) -> Optional[re.Match]:
+    """
+    Row limit clause of the outermost query (the one at the end of the statement)
+
+    Matches LIMIT n and FETCH FIRST n ROWS ONLY in strip_statement_end(sql);
+    group 1 or 2 holds n, FETCH FIRST ROW ONLY has none and returns 1 row.
+    """
+    return _LIMIT_RE.search(strip_statement_end(sql))
+
+
+def without_order_and_limit(sql: str) -> str:
+    """
+    The query without the ORDER BY and the row limit of its outermost query
+
+    For wrapping a query in a filter: a LIMIT inside the wrapper is applied
+    before the filter and may cut off exactly the rows the filter keeps.
+    ORDER BY clauses of subqueries and window functions are left alone.
+    """
+    sql = strip_statement_end(sql)
+    match = limit_clause(sql)
+    if match is not None:
+        sql = sql[:match.start()].rstrip()
+    depth, order_by = 0, None
+    for token in _CLAUSE_TOKEN_RE.finditer(sql):
+        text = token.group(0)
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif depth == 0 and text[0] not in "'\"":
+            order_by = token.start()
+    if order_by is not None:
+        sql = sql[:order_by].rstrip()
+    return sql
+
+
+def query_limit(sql: str) -> Optional[int]:
+    """Row limit of the outermost query, None without one"""
+    match = limit_clause(sql)
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2) or 1)
+
+
+def estimate_query_cost(
+    sql: str,
+    today: Optional[date] = None,
+    partition_columns: Optional[Callable[[str], Optional[List[str]]]] = None,
+) -> QueryCost:
+    """
+    Rough cost of a Dune query derived from the SQL shape
+
+    The score grows with the number of scanned days on heavy tables, the
+    number of joins and the use of window functions. A heavy table read
+    without a filter on its partition columns counts as a full scan.
+    partition_columns looks up the partition columns of a table from its
+    metadata (e.g. the table catalog), DEFAULT_PARTITION_COLUMNS otherwise.
+    The score is only meant to rank queries against each other, not to
+    predict credits or seconds.
+    """
+    today = today or date.today()
+    tables = sorted({t.lower() for t in _TABLE_RE.findall(sql)})
+    heavy_tables = [t for t in tables if any(re.search(p, t) for p in HEAVY_TABLE_PATTERNS)]
+    days = _scanned_days(sql, today)
+    days = UNBOUNDED_DAYS if days is None else days
+
+    unpartitioned_tables = []
+    for table in heavy_tables:
+        columns = (partition_columns(table) if partition_columns else None) or DEFAULT_PARTITION_COLUMNS
+        if not has_partition_filter(sql, columns):
+            unpartitioned_tables.append(table)
+
+    joins = len(re.findall(r"\bjoin\b", sql, re.IGNORECASE))
+    aggregations = len(_AGGREGATE_RE.findall(sql))
+    window_functions = len(re.findall(r"\bover\s*\(", sql, re.IGNORECASE))
+    has_limit = re.search(r"\blimit\s+\d+", sql, re.IGNORECASE) is not None
+
+    def scanned(table: str) -> float:
+        if table in unpartitioned_tables:
+            # A time filter on a non-partition column (e.g. block_time) still reads every partition
+            return UNBOUNDED_DAYS
+        # Heavy tables dominate the cost; light (curated/aggregated) tables count for a tenth
+        return days if table in heavy_tables else days / 10
+
+    scan = sum(scanned(t) for t in tables) or days / 10
+    score = scan * (1 + 0.5 * joins) * (1 + 0.25 * window_functions)
+    if aggregations == 0 and not has_limit:
+        # Returning raw rows also means downloading them
+        score *= 1.5
+
+    return QueryCost(
+        tables=tables,
+        heavy_tables=heavy_tables,
+        days=days,
+        joins=joins,
+        aggregations=aggregations,
+        window_functions=window_functions,
+        has_limit=has_limit,
+        score=round(score, 2),
+        limit=query_limit(sql),
+        unpartitioned_tables=unpartitioned_tables,
+    )
@@ -0,0 +1,76 @@
+import os
+from typing import List
+
+from prometheus_client import Counter
+
+from agents.utils.sql_analysis import (
+    DEFAULT_PARTITION_COLUMNS,
+    QueryCost,
+    limit_clause,
+    query_limit,
+    strip_statement_end,
+)
+
+# Generated queries scoring above this are sent back to the optimizer with hints (about a year of a heavy table)
+SQL_GUARD_MAX_COST_SCORE = float(os.getenv("SQL_GUARD_MAX_COST_SCORE", "365"))
+# Rows a generated query may return, larger or missing LIMITs are clamped to it
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "10000"))
+# Default look-back suggested when a heavy table has no partition filter
+SQL_GUARD_DEFAULT_DAYS = int(os.getenv("SQL_GUARD_DEFAULT_DAYS", "90"))
+
+SQL_GUARD_ACTIONS = Counter(
+    "visualyze_sql_guard_actions_total", "Actions of the pre-execution SQL guard", ["action"]
+)
+
+
+def is_too_costly(cost: QueryCost, max_score: float = SQL_GUARD_MAX_COST_SCORE) -> bool:
+    return cost.score > max_score
+
+
+def cost_hints(cost: QueryCost, partition_columns=None, max_rows: int = SQL_MAX_ROWS) -> List[str]:
+    """Concrete rewrite instructions for the cost problems found by the static analysis"""
+    hints = []
+    for table in cost.unpartitioned_tables:
+        columns = (partition_columns(table) if partition_columns else None) or DEFAULT_PARTITION_COLUMNS
+        column = "block_date" if "block_date" in columns else columns[0]
+        hints.append(
+            f"{table} is partitioned by {', '.join(columns)} but the query does not filter on it; "
+            f"add e.g. `{column} >= current_date - interval '{SQL_GUARD_DEFAULT_DAYS}' day` "
+            "so that only the needed partitions are scanned"
+        )
+    if cost.heavy_tables and cost.days > SQL_GUARD_DEFAULT_DAYS and not cost.unpartitioned_tables:
+        hints.append(
+            f"The query scans about {cost.days:.0f} days of {', '.join(cost.heavy_tables)}; "
+            "narrow the time range to what the prompt needs"
+        )
+    if cost.aggregations == 0:
+        hints.append(
+            "The query returns raw rows; aggregate them (e.g. per day or per week) instead of returning every event"
+        )
+    if cost.joins >= 2:
+        hints.append("Filter each side in a CTE before joining so that the joins read fewer rows")
+    if cost.window_functions:
+        hints.append("Aggregate before applying window functions so that they run over fewer rows")
+    if cost.limit is None or cost.limit > max_rows:
+        hints.append(f"Return at most {max_rows} rows (LIMIT {max_rows})")
+    return hints
+
+
+def clamp_limit(sql: str, max_rows: int = SQL_MAX_ROWS) -> str:
+    """
+    Add a LIMIT to the outermost query, or lower one that is larger than max_rows
+
+    Comments and trailing semicolons are dropped first, a comment after the
+    last clause would otherwise swallow the added LIMIT.
+    """
+    sql = strip_statement_end(sql)
+    limit = query_limit(sql)
+    if limit is not None and limit <= max_rows:
+        return sql
+    if limit is None:
+        SQL_GUARD_ACTIONS.labels(action="limit_added").inc()
+        return f"{sql}\nLIMIT {max_rows}"
+    SQL_GUARD_ACTIONS.labels(action="limit_lowered").inc()
+    match = limit_clause(sql)
+    group = 1 if match.group(1) else 2
+    return f"{sql[:match.start(group)]}{max_rows}{sql[match.end(group):]}"
@@ -0,0 +1,85 @@
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+from prometheus_client import Counter
+
+from agents.utils.deadline import has_time_for, remaining
+from agents.utils.dune_client import QUERY_ERROR_PERMANENT, QUERY_ERROR_SQL, classify_query_error
+from agents.utils.rate_limit import RATE_LIMIT, TRANSIENT, backoff_delay
+from agents.utils.sql_analysis import canonicalize_sql
+from agents.utils.tracing import span
+
+# Dune executions of one task, including the first one
+SQL_MAX_ATTEMPTS = int(os.getenv("SQL_MAX_ATTEMPTS", "3"))
+
+SQL_RETRY_DECISIONS = Counter(
+    "visualyze_sql_retry_decisions_total",
+    "Decisions of the SQL retry loop after a failed execution, by error class",
+    ["error_class", "action"],
+)
+
+
+def execute_with_retries(
+    sql: str,
+    execute: Callable[[str], Tuple[object, Optional[str]]],
+    fix: Callable[[str, str], str],
+    max_attempts: int = SQL_MAX_ATTEMPTS,
+):
+    """
+    Execute a query, retrying according to the class of each error
+
+    - SQL errors (syntax, unknown column or table, ...) are fixed by the LLM
+      through `fix(sql, error)` and the fixed query is executed
+    - rate limits and transient failures re-execute the same query after a
+      jittered backoff, without the LLM
+    - permanent errors (permissions, quota, timeouts) fail right away
+
+    The loop also stops when the LLM returns a query that was already tried
+    or when the request deadline leaves no time for another attempt.
+
+    Returns:
+        tuple: (result, error, sql of the last attempt, attempts)
+    """
+    tried = {canonicalize_sql(sql)}
+    attempts = 1
+    result, error = execute(sql)
+    while error:
+        error_class = classify_query_error(error)
+        if attempts >= max_attempts:
+            SQL_RETRY_DECISIONS.labels(error_class=error_class, action="exhausted").inc()
+            break
+
+        if error_class in (RATE_LIMIT, TRANSIENT):
+            delay = backoff_delay(attempts)
+            left = remaining()
+            if left is not None and left <= delay:
+                SQL_RETRY_DECISIONS.labels(error_class=error_class, action="deadline").inc()
+                break
+            SQL_RETRY_DECISIONS.labels(error_class=error_class, action="retry").inc()
+            print(f"❌Error ({error_class}), executing the same SQL again in {delay:.1f}s: {error}")
+            time.sleep(delay)
+        elif error_class == QUERY_ERROR_SQL:
+            if not has_time_for("sql_retry"):
+                SQL_RETRY_DECISIONS.labels(error_class=error_class, action="deadline").inc()
+                print(f"❌Error (deadline is near, skipping the SQL fix): {error}")
+                break
+            SQL_RETRY_DECISIONS.labels(error_class=error_class, action="fix").inc()
+            print(f"❌Error: {error}")
+            with span("retry", attempt=attempts):
+                fixed_sql = fix(sql, error)
+            print(f"✅Refined SQL: {fixed_sql}")
+            key = canonicalize_sql(fixed_sql)
+            if key in tried:
+                print("❌The refined SQL was already tried, giving up")
+                break
+            tried.add(key)
+            sql = fixed_sql
+        else:
+            SQL_RETRY_DECISIONS.labels(error_class=QUERY_ERROR_PERMANENT, action="fail").inc()
+            print(f"❌Error (permanent, not retrying): {error}")
+            break
+
+        attempts += 1
+        result, error = execute(sql)
+    return result, error, sql, attempts
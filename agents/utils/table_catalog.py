@@ -0,0 +1,164 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from agents.utils.data_structures import FullTable
+
+TABLE_LIST_PATH = os.getenv("TABLE_LIST_PATH", "agents/utils/table_list.json")
+# How often (seconds) the catalog file is checked for changes
+CATALOG_RELOAD_CHECK_SECONDS = float(os.getenv("CATALOG_RELOAD_CHECK_SECONDS", "5"))
+# Tables offered to the LLM for table selection, after the lexical prefilter
+CATALOG_MAX_CANDIDATES = int(os.getenv("CATALOG_MAX_CANDIDATES", "20"))
+
+# Date columns Dune tables are commonly partitioned by, used when the metadata lists no partition_columns
+PARTITION_COLUMN_NAMES = ("block_month", "block_date", "evt_block_date", "call_block_date", "day", "month")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class _Snapshot:
+    """One loaded version of the catalog file, replaced as a whole on reload"""
+
+    def __init__(self, tables: List[dict], mtime: float):
+        self.mtime = mtime
+        # Raw metadata by name, FullTable objects are built on first lookup
+        self.raw: Dict[str, dict] = {table["table_name"]: table for table in tables}
+        self.names: List[str] = list(self.raw)
+        self.models: Dict[str, FullTable] = {}
+        # Inverted index token -> {table name: term weight} over names, descriptions and column names
+        self.index: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for name, table in self.raw.items():
+            weights = Counter()
+            for token in _tokens(name.replace(".", " ").replace("_", " ")):
+                weights[token] += 3.0
+            for token in _tokens(table.get("description", "")):
+                weights[token] += 1.0
+            for column in table.get("columns", {}):
+                for token in _tokens(column.replace("_", " ")):
+                    weights[token] += 0.5
+            for token, weight in weights.items():
+                self.index[token][name] = weight
+
+
+class TableCatalog:
+    """
+    Process-wide catalog of the Dune tables agents can query
+
+    The table list is parsed once and reloaded when the file changes. Table
+    and column metadata is kept as parsed JSON and validated into FullTable
+    objects only for the tables that are actually looked up. A token index
+    prefilters the tables offered to the LLM, so that the catalog can grow
+    to thousands of tables without growing the prompts.
+    """
+
+    def __init__(self, path: str = TABLE_LIST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._checked_at = 0.0
+
+    def _load(self) -> _Snapshot:
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, "r") as f:
+            return _Snapshot(json.load(f), mtime)
+
+    def _current(self) -> _Snapshot:
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._checked_at < CATALOG_RELOAD_CHECK_SECONDS:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or now - self._checked_at >= CATALOG_RELOAD_CHECK_SECONDS:
+                self._checked_at = now
+                try:
+                    changed = self._snapshot is None or os.path.getmtime(self.path) != self._snapshot.mtime
+                    if changed:
+                        self._snapshot = self._load()
+                        print(f"✅Loaded table catalog {self.path}: {len(self._snapshot.names)} tables")
+                except (OSError, ValueError) as e:
+                    # Keep serving the previous version if the file is missing or half written
+                    if self._snapshot is None:
+                        raise
+                    print(f"⚠️ Could not reload table catalog {self.path}: {str(e)}")
+            return self._snapshot
+
+    def __len__(self) -> int:
+        return len(self._current().names)
+
+    def __contains__(self, table_name: str) -> bool:
+        return table_name in self._current().raw
+
+    def names(self) -> List[str]:
+        return list(self._current().names)
+
+    def get(self, table_name: str) -> FullTable:
+        """Metadata of one table, raises KeyError for unknown tables"""
+        snapshot = self._current()
+        table = snapshot.models.get(table_name)
+        if table is None:
+            table = FullTable(**snapshot.raw[table_name])
+            snapshot.models[table_name] = table
+        return table
+
+    def partition_columns(self, table_name: str) -> Optional[List[str]]:
+        """Partition columns of a table, None for tables not in the catalog"""
+        table = self._current().raw.get(table_name)
+        if table is None:
+            return None
+        if table.get("partition_columns"):
+            return list(table["partition_columns"])
+        return [name for name in PARTITION_COLUMN_NAMES if name in table.get("columns", {})]
+
+    def tables(self) -> List[FullTable]:
+        return [self.get(name) for name in self._current().names]
+
+    def search(self, text: str, limit: int = CATALOG_MAX_CANDIDATES) -> List[FullTable]:
+        """
+        Tables most related to the text by token overlap, catalog order for ties
+
+        Small catalogs are returned whole; if nothing matches, the first
+        `limit` tables are returned so that the LLM still has a choice.
+        """
+        snapshot = self._current()
+        if len(snapshot.names) <= limit:
+            return [self.get(name) for name in snapshot.names]
+
+        scores: Dict[str, float] = defaultdict(float)
+        for token in set(_tokens(text)):
+            postings = snapshot.index.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + len(snapshot.names) / len(postings))
+            for name, weight in postings.items():
+                scores[name] += idf * weight
+        order = {name: position for position, name in enumerate(snapshot.names)}
+        ranked: List[Tuple[float, str]] = sorted(
+            ((score, name) for name, score in scores.items()), key=lambda item: (-item[0], order[item[1]])
+        )
+        names = [name for _, name in ranked[:limit]]
+        if not names:
+            names = snapshot.names[:limit]
+        return [self.get(name) for name in names]
+
+
+_catalogs: Dict[str, TableCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_table_catalog(path: str = TABLE_LIST_PATH) -> TableCatalog:
+    """The shared catalog of a table list file"""
+    path = os.path.abspath(path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(path)
+        if catalog is None:
+            catalog = _catalogs[path] = TableCatalog(path)
+        return catalog
@@ -0,0 +1,124 @@
+import contextvars
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# ID of the request being processed, propagated to worker threads with copy_context()
+request_id_var = contextvars.ContextVar("request_id", default=None)
+# Wallet that issued the request, used for per-wallet accounting
+wallet_address_var = contextvars.ContextVar("wallet_address", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+STAGE_DURATION = Histogram(
+    "visualyze_stage_duration_seconds",
+    "Duration of a pipeline stage",
+    ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+STAGE_IN_FLIGHT = Gauge(
+    "visualyze_stage_in_flight", "Pipeline stages currently running", ["stage"]
+)
+STAGE_ERRORS = Counter(
+    "visualyze_stage_errors_total", "Pipeline stages that raised or reported an error", ["stage"]
+)
+STAGE_ROWS = Counter(
+    "visualyze_stage_rows_total", "Rows produced by a pipeline stage", ["stage"]
+)
+STAGE_BYTES = Counter(
+    "visualyze_stage_bytes_total", "Bytes produced by a pipeline stage", ["stage"]
+)
+
+
+class Span:
+    """A timed pipeline stage, logged as one JSON line when it ends"""
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.request_id = request_id_var.get()
+        self.attributes = attributes
+        self.error = None
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        """Attach attributes (e.g. rows, bytes) to the span"""
+        self.attributes.update(attributes)
+
+    def fail(self, error: str):
+        """Mark the span as failed without raising"""
+        self.error = error
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span": self.name,
+            "request_id": self.request_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_span_name() -> Optional[str]:
+    current = _current_span.get()
+    return current.name if current else None
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None, wallet_address: Optional[str] = None):
+    """Bind a request ID (and wallet) to the current context and threads started from a copy of it"""
+    request_id = request_id or request_id_var.get() or new_request_id()
+    token = request_id_var.set(request_id)
+    wallet_token = wallet_address_var.set(wallet_address or wallet_address_var.get())
+    try:
+        yield request_id
+    finally:
+        wallet_address_var.reset(wallet_token)
+        request_id_var.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Trace a pipeline stage
+
+    Usage:
+        with span("dune_execute", query_id=query_id) as s:
+            df = ...
+            s.set(rows=len(df))
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    STAGE_IN_FLIGHT.labels(stage=name).inc()
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+        STAGE_IN_FLIGHT.labels(stage=name).dec()
+        STAGE_DURATION.labels(stage=name).observe(current.duration)
+        if current.error:
+            STAGE_ERRORS.labels(stage=name).inc()
+        if isinstance(current.attributes.get("rows"), int):
+            STAGE_ROWS.labels(stage=name).inc(current.attributes["rows"])
+        if isinstance(current.attributes.get("bytes"), int):
+            STAGE_BYTES.labels(stage=name).inc(current.attributes["bytes"])
+        logger.info(json.dumps(current.to_dict(), ensure_ascii=False, default=str))
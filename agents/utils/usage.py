@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+from prometheus_client import Counter
+
+from agents.utils.tracing import request_id_var, wallet_address_var
+
+# Token budget of one request (prompt + completion), 0 disables it
+REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", "0"))
+# Daily token budget of one wallet, 0 disables it
+WALLET_DAILY_TOKEN_BUDGET = int(os.getenv("WALLET_DAILY_TOKEN_BUDGET", "0"))
+# Maximum number of tasks the planner may split a prompt into, 0 disables it
+MAX_PLANNER_TASKS = int(os.getenv("MAX_PLANNER_TASKS", "0"))
+# Number of requests whose usage is kept in memory
+MAX_TRACKED_REQUESTS = int(os.getenv("MAX_TRACKED_REQUESTS", "1000"))
+# Daily usage of the wallets, shared by the worker processes of the API
+USAGE_DB = os.getenv("USAGE_DB", "agents/data/usage.db")
+# Days of wallet usage kept, older days are pruned
+USAGE_RETENTION_DAYS = int(os.getenv("USAGE_RETENTION_DAYS", "30"))
+
+_USAGE_FIELDS = ("calls", "prompt_tokens", "completion_tokens", "total_tokens", "cost", "seconds")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS wallet_usage (
+    wallet_address TEXT NOT NULL,
+    day TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (wallet_address, day)
+);
+CREATE INDEX IF NOT EXISTS ix_wallet_usage_day ON wallet_usage (day);
+"""
+
+LLM_TOKENS = Counter(
+    "visualyze_llm_tokens_total", "Tokens used by LLM calls", ["stage", "kind"]
+)
+LLM_CALLS = Counter(
+    "visualyze_llm_calls_total", "LLM calls", ["stage", "cached"]
+)
+LLM_COST = Counter(
+    "visualyze_llm_cost_usd_total", "Cost of LLM calls reported by the provider", ["stage"]
+)
+
+
+def _empty_usage() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cost": 0.0,
+        "seconds": 0.0,
+    }
+
+
+def _add_usage(totals: Dict[str, Any], usage: Dict[str, Any]):
+    for key, value in usage.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class WalletUsageStore:
+    """
+    Daily LLM usage per wallet, stored in SQLite
+
+    The worker processes of the API add to the same totals, so the wallet
+    budget and /api/usage see the usage of every process. Days older than
+    `retention_days` are pruned once per day.
+    """
+
+    def __init__(self, path: str = USAGE_DB, retention_days: int = USAGE_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pruned_day = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def add(self, wallet_address: str, usage: Dict[str, Any], day: Optional[date] = None):
+        day = day or date.today()
+        values = [usage.get(field, 0) for field in _USAGE_FIELDS]
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT INTO wallet_usage (wallet_address, day, {', '.join(_USAGE_FIELDS)}) "
+                f"VALUES (?, ?, {', '.join('?' for _ in _USAGE_FIELDS)}) "
+                "ON CONFLICT (wallet_address, day) DO UPDATE SET "
+                + ", ".join(f"{field} = {field} + excluded.{field}" for field in _USAGE_FIELDS),
+                (wallet_address, day.isoformat(), *values),
+            )
+            if self._pruned_day != day:
+                conn.execute(
+                    "DELETE FROM wallet_usage WHERE day < ?",
+                    ((day - timedelta(days=self.retention_days)).isoformat(),),
+                )
+                self._pruned_day = day
+            conn.commit()
+
+    def get(self, wallet_address: str, day: str) -> Dict[str, Any]:
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {', '.join(_USAGE_FIELDS)} FROM wallet_usage WHERE wallet_address = ? AND day = ?",
+                (wallet_address, day),
+            ).fetchone()
+        return dict(zip(_USAGE_FIELDS, row)) if row else _empty_usage()
+
+
+class UsageTracker:
+    """
+    Aggregates LLM usage per request (with a per-stage breakdown) and per wallet per day
+
+    Requests are tracked in the memory of the process that serves them, the
+    wallet totals in a WalletUsageStore shared by all processes.
+    """
+
+    def __init__(self, max_requests: int = MAX_TRACKED_REQUESTS, wallet_store: WalletUsageStore = None):
+        self.max_requests = max_requests
+        self._lock = threading.Lock()
+        self._requests = OrderedDict()
+        self._wallets = wallet_store or WalletUsageStore()
+
+    def record(
+        self,
+        stage: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        seconds: float,
+        cost: Optional[float] = None,
+        cached: bool = False,
+    ):
+        usage = {
+            "calls": 1,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "cost": cost or 0.0,
+            "seconds": seconds,
+        }
+        LLM_CALLS.labels(stage=stage, cached=str(cached).lower()).inc()
+        LLM_TOKENS.labels(stage=stage, kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(stage=stage, kind="completion").inc(completion_tokens)
+        if cost:
+            LLM_COST.labels(stage=stage).inc(cost)
+
+        request_id = request_id_var.get()
+        wallet_address = wallet_address_var.get()
+        with self._lock:
+            if request_id:
+                request = self._requests.get(request_id)
+                if request is None:
+                    request = {**_empty_usage(), "wallet_address": wallet_address, "stages": {}}
+                    self._requests[request_id] = request
+                    while len(self._requests) > self.max_requests:
+                        self._requests.popitem(last=False)
+                _add_usage(request, usage)
+                _add_usage(request["stages"].setdefault(stage, _empty_usage()), usage)
+        if wallet_address:
+            self._wallets.add(wallet_address, usage)
+
+    def get_request_usage(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            request = self._requests.get(request_id)
+            if request is None:
+                return None
+            return {**request, "stages": {k: dict(v) for k, v in request["stages"].items()}}
+
+    def get_wallet_usage(self, wallet_address: str, day: Optional[str] = None) -> Dict[str, Any]:
+        return self._wallets.get(wallet_address, day or date.today().isoformat())
+
+    def budget_exceeded(self) -> bool:
+        """Whether the current request or its wallet has used up its token budget"""
+        request_id = request_id_var.get()
+        wallet_address = wallet_address_var.get()
+        if REQUEST_TOKEN_BUDGET and request_id:
+            request = self.get_request_usage(request_id)
+            if request and request["total_tokens"] >= REQUEST_TOKEN_BUDGET:
+                return True
+        if WALLET_DAILY_TOKEN_BUDGET and wallet_address:
+            if self.get_wallet_usage(wallet_address)["total_tokens"] >= WALLET_DAILY_TOKEN_BUDGET:
+                return True
+        return False
+
+    def check_budget(self):
+        """Raise BudgetExceeded before paid work starts if the budget is already used up"""
+        if self.budget_exceeded():
+            raise BudgetExceeded("The token budget of this wallet is used up for today")
+
+    def max_planner_tasks(self) -> Optional[int]:
+        """Number of tasks the planner may produce for the current request"""
+        if self.budget_exceeded():
+            return 1
+        return MAX_PLANNER_TASKS or None
+
+
+usage_tracker = UsageTracker()
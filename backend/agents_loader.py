@@ -0,0 +1,86 @@
+import os
+import asyncio
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Warm the agent stack up in the background at startup instead of on the first request
+WARM_UP_AGENTS = os.getenv("WARM_UP_AGENTS", "false").lower() in ("1", "true", "yes")
+
+_agents = None
+_load_lock = threading.Lock()
+
+# Timings of the agent stack startup, exposed by the health endpoint
+load_stats = {
+    "imported": False,
+    "initialized": False,
+    "import_seconds": None,
+    "init_seconds": None,
+    "error": None,
+}
+
+
+def get_agents():
+    """Import agents.main (dspy, litellm, pandas, openai, ...) on first use"""
+    global _agents
+    if _agents is not None:
+        return _agents
+
+    with _load_lock:
+        if _agents is None:
+            start = time.perf_counter()
+            module = importlib.import_module("agents.main")
+            load_stats["import_seconds"] = round(time.perf_counter() - start, 3)
+            load_stats["imported"] = True
+            logger.info(f"Imported agent stack in {load_stats['import_seconds']}s")
+            _agents = module
+    return _agents
+
+
+def warm_up_agents():
+    """Import the agent stack and create its clients"""
+    try:
+        agents = get_agents()
+        start = time.perf_counter()
+        agents.warm_up()
+        load_stats["init_seconds"] = round(time.perf_counter() - start, 3)
+        load_stats["initialized"] = True
+        logger.info(f"Initialized agent stack in {load_stats['init_seconds']}s")
+    except Exception as e:
+        load_stats["error"] = str(e)
+        logger.error(f"Error warming up agent stack: {str(e)}")
+
+
+def start_warm_up():
+    """Warm the agent stack up in a background thread so startup is not delayed"""
+    thread = threading.Thread(target=warm_up_agents, name="agents-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def prompt_agent(
+    prompt: str,
+    csv_dir: str,
+    viz_dir: str,
+    attachments: list[str] = None,
+    conversation_id: str = None,
+    on_partial=None,
+):
+    return get_agents().main(prompt, csv_dir, viz_dir, attachments, conversation_id, on_partial)
+
+
+def refresh_dataset(csv_path: str, full: bool = False):
+    return get_agents().refresh_dataset(csv_path, full=full)
+
+
+def prewarm_popular_queries(top_n: int, max_age: float) -> dict:
+    return get_agents().prewarm_popular_queries(top_n, max_age)
+
+
+async def aanalyze_figure(prompt: str, attachments: list[str]):
+    # The first import is slow, keep it off the event loop
+    agents = await asyncio.to_thread(get_agents)
+    return await agents.aanalyze_figure(prompt, attachments)
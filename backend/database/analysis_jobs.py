@@ -0,0 +1,65 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+from sqlalchemy import Column, String, DateTime, Text
+from . import Base, engine
+
+
+class AnalysisJobDB(Base):
+    __tablename__ = "analysis_jobs"
+
+    job_id = Column(String, primary_key=True)
+    status = Column(String, nullable=False)  # pending, running, completed or failed
+    filepath = Column(Text)  # Uploaded image being analyzed
+    analysis = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+
+
+def _to_dict(job: AnalysisJobDB) -> Dict[str, Any]:
+    result = {
+        "job_id": job.job_id,
+        "status": job.status,
+        "filepath": job.filepath,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+    }
+    if job.analysis is not None:
+        result["analysis"] = job.analysis
+    if job.error is not None:
+        result["error"] = job.error
+    if job.finished_at is not None:
+        result["finished_at"] = job.finished_at.isoformat()
+    return result
+
+
+# Database operations for figure analysis jobs
+def create_job(db, job_id: str, filepath: str) -> Dict[str, Any]:
+    try:
+        job = AnalysisJobDB(job_id=job_id, status="pending", filepath=filepath, created_at=datetime.now())
+        db.add(job)
+        db.commit()
+        return _to_dict(job)
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"Error creating analysis job: {str(e)}")
+
+def update_job(db, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+    """Set fields (status, analysis, error, finished_at) of a job."""
+    try:
+        job = db.query(AnalysisJobDB).filter(AnalysisJobDB.job_id == job_id).first()
+        if job is None:
+            return None
+        for name, value in fields.items():
+            setattr(job, name, value)
+        db.commit()
+        return _to_dict(job)
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"Error updating analysis job: {str(e)}")
+
+def get_job(db, job_id: str) -> Optional[Dict[str, Any]]:
+    job = db.query(AnalysisJobDB).filter(AnalysisJobDB.job_id == job_id).first()
+    return _to_dict(job) if job else None
+
+# Create tables if they don't exist
+Base.metadata.create_all(bind=engine)
@@ -3,7 +3,9 @@ import os
 import uuid
 from datetime import datetime
 import logging
+from contextlib import contextmanager
 from typing import Dict, List, Any, Optional
+from agents.utils.file_lock import atomic_write_json, file_lock
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -22,25 +24,35 @@ def _load_history() -> Dict[str, Any]:
             with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
                 return json.load(f)
         else:
-            # Create default structure
-            default_history = {"conversations": []}
-            _save_history(default_history)
-            return default_history
+            # Default structure, the file is created by the first write
+            return {"conversations": []}
     except Exception as e:
         logger.error(f"Error loading chat history: {str(e)}")
         # Return empty structure if loading fails
         return {"conversations": []}
 
 def _save_history(history: Dict[str, Any]) -> bool:
-    """Save chat history to JSON file."""
+    """Save chat history to JSON file (atomically, readers see the old or the new file)."""
     try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=2)
+        atomic_write_json(HISTORY_FILE, history, indent=2)
         return True
     except Exception as e:
         logger.error(f"Error saving chat history: {str(e)}")
         return False
 
+@contextmanager
+def _locked_history():
+    """
+    Load the chat history for a read-modify-write and save it afterwards.
+
+    The file lock serializes writers across threads and worker processes, so
+    concurrent updates are not lost.
+    """
+    with file_lock(HISTORY_FILE):
+        history = _load_history()
+        yield history
+        _save_history(history)
+
 def get_all_conversations() -> List[Dict[str, Any]]:
     """Get all conversations."""
     history = _load_history()
@@ -56,8 +68,6 @@ def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
 
 def create_conversation(title: str) -> Dict[str, Any]:
     """Create a new conversation."""
-    history = _load_history()
-    
     # Generate a unique ID
     conversation_id = str(uuid.uuid4())
     
@@ -77,8 +87,8 @@ def create_conversation(title: str) -> Dict[str, Any]:
         ]
     }
     
-    history["conversations"].append(new_conversation)
-    _save_history(history)
+    with _locked_history() as history:
+        history["conversations"].append(new_conversation)
     
     return new_conversation
 
@@ -100,48 +110,46 @@ def add_conversation_node(
     Returns:
         The created node or None if failed
     """
-    history = _load_history()
+    with _locked_history() as history:
+        # Find the conversation
+        conversation = None
+        for conv in history["conversations"]:
+            if conv["id"] == conversation_id:
+                conversation = conv
+                break
     
-    # Find the conversation
-    conversation = None
-    for conv in history["conversations"]:
-        if conv["id"] == conversation_id:
-            conversation = conv
-            break
+        if not conversation:
+            return None
     
-    if not conversation:
-        return None
+        # If no parent_id is provided and this is not the first node,
+        # set parent to the last node
+        if parent_id is None and len(conversation["nodes"]) > 0:
+            parent_id = conversation["nodes"][-1]["id"]
     
-    # If no parent_id is provided and this is not the first node,
-    # set parent to the last node
-    if parent_id is None and len(conversation["nodes"]) > 0:
-        parent_id = conversation["nodes"][-1]["id"]
+        # Create new node containing both messages
+        timestamp = datetime.now().isoformat()
+        new_node = {
+            "id": str(uuid.uuid4()),
+            "timestamp": timestamp,
+            "parentId": parent_id,
+            "messages": [
+                {
+                    "type": "user",
+                    "timestamp": timestamp,
+                    "content": user_content
+                }
+            ]
+        }
     
-    # Create new node containing both messages
-    timestamp = datetime.now().isoformat()
-    new_node = {
-        "id": str(uuid.uuid4()),
-        "timestamp": timestamp,
-        "parentId": parent_id,
-        "messages": [
-            {
-                "type": "user",
-                "timestamp": timestamp,
-                "content": user_content
-            }
-        ]
-    }
-    
-    # Add AI response if provided
-    if ai_content:
-        new_node["messages"].append({
-            "type": "ai",
-            "timestamp": datetime.now().isoformat(),
-            "content": ai_content
-        })
+        # Add AI response if provided
+        if ai_content:
+            new_node["messages"].append({
+                "type": "ai",
+                "timestamp": datetime.now().isoformat(),
+                "content": ai_content
+            })
     
-    conversation["nodes"].append(new_node)
-    _save_history(history)
+        conversation["nodes"].append(new_node)
     
     return new_node
 
@@ -161,50 +169,83 @@ def update_node_with_ai_response(
     Returns:
         The updated node or None if failed
     """
-    history = _load_history()
+    with _locked_history() as history:
+        # Find the conversation
+        conversation = None
+        for conv in history["conversations"]:
+            if conv["id"] == conversation_id:
+                conversation = conv
+                break
     
-    # Find the conversation
-    conversation = None
-    for conv in history["conversations"]:
-        if conv["id"] == conversation_id:
-            conversation = conv
-            break
+        if not conversation:
+            return None
     
-    if not conversation:
-        return None
+        # Find the node
+        node = None
+        for n in conversation["nodes"]:
+            if n["id"] == node_id:
+                node = n
+                break
     
-    # Find the node
-    node = None
-    for n in conversation["nodes"]:
-        if n["id"] == node_id:
-            node = n
-            break
+        if not node:
+            return None
     
-    if not node:
-        return None
+        # Check if AI message already exists
+        ai_message_exists = False
+        for message in node.get("messages", []):
+            if message["type"] == "ai":
+                # Update existing AI message
+                message["content"] = ai_content
+                message["timestamp"] = datetime.now().isoformat()
+                ai_message_exists = True
+                break
     
-    # Check if AI message already exists
-    ai_message_exists = False
-    for message in node.get("messages", []):
-        if message["type"] == "ai":
-            # Update existing AI message
-            message["content"] = ai_content
-            message["timestamp"] = datetime.now().isoformat()
-            ai_message_exists = True
-            break
+        # Add new AI message if it doesn't exist
+        if not ai_message_exists:
+            if "messages" not in node:
+                node["messages"] = []
+        
+            node["messages"].append({
+                "type": "ai",
+                "timestamp": datetime.now().isoformat(),
+                "content": ai_content
+            })
+    return node
+
+def add_analysis_to_node(
+    conversation_id: str,
+    node_id: str,
+    analysis_content: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Append a figure analysis to a node as its own "analysis" message.
+    
+    The AI reply of the node is left untouched.
     
-    # Add new AI message if it doesn't exist
-    if not ai_message_exists:
-        if "messages" not in node:
-            node["messages"] = []
+    Args:
+        conversation_id: ID of the conversation
+        node_id: ID of the node the analyzed figure belongs to
+        analysis_content: Figure analysis content
         
-        node["messages"].append({
-            "type": "ai",
+    Returns:
+        The updated node or None if failed
+    """
+    with _locked_history() as history:
+        conversation = next(
+            (conv for conv in history["conversations"] if conv["id"] == conversation_id), None
+        )
+        if not conversation:
+            return None
+    
+        node = next((n for n in conversation["nodes"] if n["id"] == node_id), None)
+        if not node:
+            return None
+    
+        node.setdefault("messages", []).append({
+            "type": "analysis",
             "timestamp": datetime.now().isoformat(),
-            "content": ai_content
+            "content": analysis_content
         })
-    
-    _save_history(history)
     return node
 
 def get_branch(conversation_id: str, node_id: str) -> List[Dict[str, Any]]:
@@ -305,7 +346,12 @@ def add_message_node(
         "parentId": parent_id
     }
     
-    conversation["nodes"].append(new_node)
-    _save_history(history)
+    with _locked_history() as history:
+        conversation = next(
+            (conv for conv in history["conversations"] if conv["id"] == conversation_id), None
+        )
+        if not conversation:
+            return None
+        conversation["nodes"].append(new_node)
     
     return new_node 
\ No newline at end of file
@@ -0,0 +1,78 @@
+import os
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from . import Base, engine
+
+# Number of prompts kept per wallet, older ones are rotated out on insert
+MAX_PROMPTS_PER_WALLET = int(os.getenv("MAX_PROMPTS_PER_WALLET", "1000"))
+
+
+class PromptDB(Base):
+    __tablename__ = "prompts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_address = Column(String, nullable=False)  # Normalized (lowercase) wallet address
+    conversation_id = Column(String, nullable=True)  # Conversation the prompt was sent in
+    prompt = Column(Text)  # The user's prompt
+    created_at = Column(DateTime, default=datetime.now)
+
+    # Latest-prompt lookups are a backwards index seek instead of a scan
+    __table_args__ = (
+        Index("ix_prompts_wallet_id", "wallet_address", "id"),
+        Index("ix_prompts_wallet_conversation_id", "wallet_address", "conversation_id", "id"),
+    )
+
+
+def normalize_wallet_address(wallet_address: str) -> str:
+    return wallet_address.strip().lower()
+
+
+# Database operations for prompts
+def record_prompt(db, wallet_address: str, prompt: str, conversation_id: Optional[str] = None):
+    try:
+        wallet_address = normalize_wallet_address(wallet_address)
+        new_prompt = PromptDB(
+            wallet_address=wallet_address,
+            conversation_id=conversation_id,
+            prompt=prompt,
+            created_at=datetime.now()
+        )
+        db.add(new_prompt)
+        db.flush()
+        rotate_prompts(db, wallet_address)
+        db.commit()
+        return new_prompt
+    except Exception as e:
+        db.rollback()
+        raise Exception(f"Error recording prompt: {str(e)}")
+
+def get_latest_prompt(db, wallet_address: str, conversation_id: Optional[str] = None) -> Optional[str]:
+    """Get the latest prompt of a wallet, optionally narrowed down to one conversation."""
+    # Never fall back to the prompts of all wallets, they belong to other users
+    if not wallet_address:
+        raise ValueError("A wallet address is required to look up prompts")
+    query = db.query(PromptDB).filter(PromptDB.wallet_address == normalize_wallet_address(wallet_address))
+    if conversation_id:
+        query = query.filter(PromptDB.conversation_id == conversation_id)
+    latest = query.order_by(PromptDB.id.desc()).first()
+    return latest.prompt if latest else None
+
+def rotate_prompts(db, wallet_address: str, keep: int = MAX_PROMPTS_PER_WALLET):
+    """Delete the prompts of a wallet beyond the newest `keep` ones."""
+    oldest_kept = (
+        db.query(PromptDB.id)
+        .filter(PromptDB.wallet_address == wallet_address)
+        .order_by(PromptDB.id.desc())
+        .offset(keep - 1)
+        .limit(1)
+        .scalar()
+    )
+    if oldest_kept is not None:
+        db.query(PromptDB).filter(
+            PromptDB.wallet_address == wallet_address,
+            PromptDB.id < oldest_kept
+        ).delete(synchronize_session=False)
+
+# Create tables if they don't exist
+Base.metadata.create_all(bind=engine)
@@ -1,50 +1,167 @@
 import os
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import asyncio
+import uuid
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
-import shutil
-from agents.main import analyze_figure
+from backend.agents_loader import aanalyze_figure
+from backend.database import SessionLocal
+from backend.database.chat_history import add_analysis_to_node
+from backend.database.prompts import get_latest_prompt, normalize_wallet_address
+from backend.database.analysis_jobs import create_job, get_job, update_job
+from backend.scheduler import job_scheduler
+from agents.utils.tracing import request_context
 
 router = APIRouter()
 
 # Directory to save visualization images
 VIZ_IMG_DIR = os.path.join("backend", "viz_img")
 
+# Maximum accepted upload size and the chunk size used to stream it to disk
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_IMAGE_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 # Create directory if it doesn't exist
 os.makedirs(VIZ_IMG_DIR, exist_ok=True)
 
+# Keep references to running tasks so they are not garbage collected
+_background_tasks = set()
+
+
+def _read_latest_prompt(wallet_address: str, conversation_id: Optional[str]) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        return get_latest_prompt(db, wallet_address, conversation_id)
+    finally:
+        db.close()
+
+
+def _with_db(operation, *args, **kwargs):
+    # Jobs live in the database so that any worker process can report them
+    db = SessionLocal()
+    try:
+        return operation(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def _stream_upload_to_disk(file: UploadFile, file_path: str) -> int:
+    """Write the upload to disk chunk by chunk, enforcing MAX_UPLOAD_BYTES"""
+    size = 0
+    buffer = await asyncio.to_thread(open, file_path, "wb")
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Image exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes",
+                )
+            await asyncio.to_thread(buffer.write, chunk)
+    except Exception:
+        await asyncio.to_thread(buffer.close)
+        await asyncio.to_thread(os.remove, file_path)
+        raise
+    await asyncio.to_thread(buffer.close)
+    return size
+
+
+async def _run_analysis_job(
+    job_id: str,
+    prompt: str,
+    file_path: str,
+    conversation_id: Optional[str],
+    node_id: Optional[str],
+):
+    await asyncio.to_thread(_with_db, update_job, job_id, status="running")
+    try:
+        analysis = await job_scheduler.run(aanalyze_figure, prompt, [file_path])
+        await asyncio.to_thread(
+            _with_db, update_job, job_id,
+            status="completed", analysis=analysis, finished_at=datetime.now()
+        )
+
+        # Add the analysis to the conversation if the upload was tied to one, next to the AI reply
+        if conversation_id and node_id:
+            await asyncio.to_thread(
+                add_analysis_to_node, conversation_id, node_id, analysis
+            )
+    except Exception as e:
+        print(f"Error analyzing image: {str(e)}")
+        await asyncio.to_thread(
+            _with_db, update_job, job_id,
+            status="failed", error=str(e), finished_at=datetime.now()
+        )
+
+
 @router.post("/save-visualization-image")
-async def save_visualization_image(file: UploadFile = File(...)):
+async def save_visualization_image(
+    file: UploadFile = File(...),
+    walletAddress: Optional[str] = Form(None),
+    conversationId: Optional[str] = Form(None),
+    nodeId: Optional[str] = Form(None),
+):
     """
-    Save a visualization image to the server
+    Save a visualization image to the server and start analyzing it in the background
     """
     print(f"Received image file: {file.filename}")
-    
+
+    # The analysis reads the latest prompt of this wallet
+    if not walletAddress:
+        raise HTTPException(status_code=400, detail="Missing wallet address")
+
     try:
-        # Create a file path to save the image
-        file_path = os.path.join(VIZ_IMG_DIR, file.filename)
-        
+        # Create a unique file path to save the image, uploads of other users or workers may share the name
+        file_name = f"{uuid.uuid4().hex[:12]}_{os.path.basename(file.filename)}"
+        file_path = os.path.join(VIZ_IMG_DIR, file_name)
+
         # Save the uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        print(f"Image saved to: {file_path}")
-        
+        size = await _stream_upload_to_disk(file, file_path)
+
+        print(f"Image saved to: {file_path} ({size} bytes)")
+
         # turn the file path into a full path
         file_path = os.path.abspath(file_path)
-        
-        # Load the latest prompt from backend/data/prompts.txt
-        with open("backend/data/prompts.txt", "r", encoding="utf-8") as f:
-            prompt = f.readlines()[-1].strip()
-        
-        # Call the figure analyzer agent
-        analyze_figure(prompt, [file_path])
-        
+
+        # Load the latest prompt of this wallet from the prompt store
+        prompt = await asyncio.to_thread(_read_latest_prompt, walletAddress, conversationId)
+        if not prompt:
+            # Nothing will analyze the image, do not keep it
+            await asyncio.to_thread(os.remove, file_path)
+            raise HTTPException(status_code=400, detail="No prompt found for this wallet")
+
+        # Run the figure analyzer agent as a background job
+        job_id = str(uuid.uuid4())
+        await asyncio.to_thread(_with_db, create_job, job_id, file_path)
+        # The task copies the context, so the job gets the fair share of the wallet
+        with request_context(wallet_address=normalize_wallet_address(walletAddress)):
+            task = asyncio.create_task(
+                _run_analysis_job(job_id, prompt, file_path, conversationId, nodeId)
+            )
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
         return JSONResponse(content={
             "status": "success",
             "message": "Image saved successfully",
-            "filepath": file_path
+            "filepath": file_path,
+            "job_id": job_id
         })
-    
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error saving image: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error saving image: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error saving image: {str(e)}")
+
+
+@router.get("/figure-analysis/{job_id}")
+async def get_figure_analysis(job_id: str):
+    """
+    Get the status and result of a figure analysis job
+    """
+    job = await asyncio.to_thread(_with_db, get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    return job
@@ -0,0 +1,58 @@
+import os
+import time
+from fastapi import APIRouter, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from agents.utils.tracing import request_context
+
+router = APIRouter()
+
+HTTP_REQUEST_DURATION = Histogram(
+    "visualyze_http_request_duration_seconds",
+    "Duration of HTTP requests",
+    ["method", "route"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+HTTP_IN_FLIGHT = Gauge(
+    "visualyze_http_requests_in_flight", "HTTP requests currently being handled"
+)
+HTTP_ERRORS = Counter(
+    "visualyze_http_errors_total", "HTTP requests answered with a 5xx status", ["method", "route", "status"]
+)
+
+
+def _route_of(request: Request) -> str:
+    # Use the route template so that path parameters do not explode the label set
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+async def metrics_middleware(request: Request, call_next):
+    """Bind a request ID to the request and record HTTP latency metrics"""
+    with request_context(request.headers.get("X-Request-ID")) as request_id:
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["X-Request-ID"] = request_id
+            return response
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = _route_of(request)
+            HTTP_REQUEST_DURATION.labels(method=request.method, route=route).observe(
+                time.perf_counter() - start
+            )
+            if status >= 500:
+                HTTP_ERRORS.labels(method=request.method, route=route, status=str(status)).inc()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics of the backend and the agent pipeline"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # With several workers, aggregate the metrics every process writes to this directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,6 +1,13 @@
+import time
+import asyncio
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
 import os
+import json
 import logging
 from typing import Dict, Any
 from backend.database.chat_history import (
@@ -12,7 +19,10 @@ from backend.database.chat_history import (
     update_node_with_ai_response,
     get_branch
 )
-from agents.main import main as prompt_agent
+from backend.database import SessionLocal
+from backend.database.prompts import record_prompt, get_latest_prompt, normalize_wallet_address
+# The agent stack is imported lazily on first use, see backend/agents_loader.py
+from backend.agents_loader import prompt_agent, refresh_dataset, start_warm_up, load_stats, WARM_UP_AGENTS
 # temp TODO:
 from agents.temp.temp_agent import temp_mock_agent
 import uuid
@@ -20,6 +30,17 @@ from datetime import datetime
 import shutil
 from dotenv import load_dotenv
 from backend.endpoints.image_handler import router as image_router
+from backend.endpoints.metrics import router as metrics_router, metrics_middleware
+from backend.prewarm import PREWARM_QUERIES, start_prewarm_scheduler
+from agents.utils.tracing import request_context, request_id_var
+from agents.utils.usage import BudgetExceeded, usage_tracker
+from agents.utils.single_flight import AsyncSingleFlight
+from agents.utils.http_pool import aclose_async_http_client, close_http_clients
+from agents.utils.conversation_index import add_conversation_dataset, has_conversation_datasets
+from agents.utils.file_lock import LockBusy
+from agents.pipeline import shutdown_pools
+from agents.utils.scheduler import BACKGROUND, INTERACTIVE, parse_priority
+from backend.scheduler import job_scheduler
 
 load_dotenv()
 
@@ -27,7 +48,22 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+IMPORT_SECONDS = round(time.perf_counter() - _import_started, 3)
+logger.info(f"Imported backend in {IMPORT_SECONDS}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARM_UP_AGENTS:
+        start_warm_up()
+    stop_prewarm = start_prewarm_scheduler() if PREWARM_QUERIES else None
+    yield
+    if stop_prewarm is not None:
+        stop_prewarm.set()
+    shutdown_pools(wait=False)
+    await aclose_async_http_client()
+    close_http_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -37,6 +73,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(metrics_middleware)
 
 # TODO: define this in config/.env
 # Define base visualization directory and user-specific paths
@@ -63,6 +100,26 @@ def get_user_visualization_dir(wallet_address):
     logger.info(f"Using user directory: {user_dir}")
     return user_dir
 
+## ====== HEALTH ======
+
+@app.get("/api/health")
+async def health():
+    """Liveness check, does not load the agent stack."""
+    return {
+        "status": "ok",
+        "backend_import_seconds": IMPORT_SECONDS,
+        "agents": load_stats
+    }
+
+@app.get("/api/usage/{wallet_address}")
+async def get_wallet_usage(wallet_address: str, day: str = None):
+    """LLM token usage and cost of a wallet on a given day (defaults to today, kept USAGE_RETENTION_DAYS)."""
+    wallet_address = normalize_wallet_address(wallet_address)
+    return {
+        "walletAddress": wallet_address,
+        "usage": await asyncio.to_thread(usage_tracker.get_wallet_usage, wallet_address, day)
+    }
+
 ## ====== VISUALIZATION RELATED ======
 
 @app.get("/api/visualizations")
@@ -135,6 +192,40 @@ async def get_visualization(file_path: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+## ====== DATASET RELATED ======
+
+@app.post("/api/datasets/{file_name}/refresh")
+async def refresh_dataset_endpoint(file_name: str, full: bool = False):
+    """
+    Bring a generated dataset up to date.
+
+    Time-series datasets only fetch the rows after their high-water mark,
+    pass full=true to re-run the whole query. Answers 409 while another
+    refresh of the same dataset is running.
+    """
+    file_name = os.path.basename(file_name)
+    if not file_name.endswith(".csv"):
+        file_name = f"{file_name}.csv"
+    csv_path = os.path.join(DATA_DIR, file_name)
+    if not os.path.exists(csv_path):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    try:
+        # Refreshes give way to the interactive prompts of the users
+        result = await job_scheduler.run(refresh_dataset, csv_path, full, priority=BACKGROUND)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except LockBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error refreshing dataset {file_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # The frontend reads the datasets from its public data directory
+    shutil.copy2(csv_path, os.path.join(TARGET_DATA_DIR, file_name))
+    logger.info(f"Refreshed dataset {file_name}: {result}")
+    return {"success": True, "fileName": file_name, **result}
+
 ## ====== CONVERSATION RELATED ======
 
 @app.get("/api/conversations")
@@ -368,15 +459,21 @@ async def analyze_data(data):
     print("analysis-data:", data)
     try:
         wallet_address = data.get("walletAddress")
+        conversation_id = data.get("conversationId")
         file_paths = data.get("filePaths", [])
         
         if not wallet_address:
             raise HTTPException(status_code=400, detail="Missing wallet address")
             
         
-        # Get the prompt from the backend/data/prompts.txt
-        with open("backend/data/prompts.txt", "r", encoding="utf-8") as f:
-            prompt = f.readlines()[-1].split(": ")[1].strip()
+        # Get the latest prompt of this wallet from the prompt store
+        db = SessionLocal()
+        try:
+            prompt = get_latest_prompt(db, wallet_address, conversation_id)
+        finally:
+            db.close()
+        if not prompt:
+            raise HTTPException(status_code=400, detail="No prompt found for this wallet")
         
         print("prompt:", prompt)
         print("file_paths:", file_paths)
@@ -386,7 +483,10 @@ async def analyze_data(data):
         # Analyze data
         if file_paths:
             # Use provided files for analysis
-            results = prompt_agent(prompt, csv_dir="", viz_dir="", attachments=file_paths)
+            with request_context(wallet_address=normalize_wallet_address(wallet_address)):
+                results = await job_scheduler.run(
+                    prompt_agent, prompt, csv_dir="", viz_dir="", attachments=file_paths
+                )
         else:
             results = {"success": False, "message": "No files provided for analysis", "analysis": "No analysis performed"}
         
@@ -403,6 +503,8 @@ async def analyze_data(data):
             # Unexpected result format
             raise HTTPException(status_code=500, detail="Expected string result from data analysis")
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -424,6 +526,115 @@ async def process_prompt_endpoint(request: Request):
     data = await request.json()
     return await process_prompt(data)
 
+@app.post("/api/process-prompt/stream")
+async def process_prompt_stream_endpoint(request: Request):
+    data = await request.json()
+    return await process_prompt_stream(data)
+
+# Identical prompts submitted concurrently share one agent run
+prompt_flight = AsyncSingleFlight("prompt")
+
+
+def _prompt_key(prompt: str, conversation_id: str = None, priority: str = None) -> str:
+    key = " ".join(prompt.split()).lower()
+    # Follow-ups ("now show it weekly") depend on the datasets of their conversation
+    if has_conversation_datasets(DATA_DIR, conversation_id):
+        key = f"{conversation_id}:{key}"
+    # An interactive prompt must not wait behind an identical background one
+    if priority == BACKGROUND:
+        key = f"{BACKGROUND}:{key}"
+    return key
+
+
+def _request_priority(data) -> str:
+    """Priority class of a request; batch clients send {"priority": "background"}"""
+    try:
+        return parse_priority(data.get("priority"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _run_prompt_agent(prompt: str, viz_dir: str, conversation_id: str = None, priority: str = INTERACTIVE):
+    # Run the blocking pipeline in a worker thread so the event loop keeps serving requests
+    results = await job_scheduler.run(
+        prompt_agent, prompt, csv_dir=DATA_DIR, viz_dir=viz_dir, conversation_id=conversation_id,
+        priority=priority
+    )
+    # The usage of the run is metered under the request ID of the caller that started it
+    return results, viz_dir, request_id_var.get()
+
+
+def _share_datasets(results, conversation_id: str = None):
+    """Record the datasets of a shared run in the conversation of a caller that joined it"""
+    if not conversation_id or not isinstance(results, list):
+        return
+    for r in results:
+        if r['result'] == "success":
+            add_conversation_dataset(os.path.join(DATA_DIR, f"{r['file_name']}.csv"), conversation_id)
+
+def _prompt_response(results, source_viz_dir: str, user_viz_dir: str, wallet_address: str, usage):
+    """Response of a processed prompt; copies the generated files to the directories the frontend reads"""
+    print("results", results)
+    
+    if type(results) == list:
+        # Get the sanitized wallet address for the response
+        sanitized_address = wallet_address.replace('0x', '').lower()
+        
+        filenames = []
+        # Visualizations drawn from a stored Dune result instead of a new execution, with the age of the data
+        stored_results = []
+        
+        for r in results:
+            if r['result'] == "success":
+                # The visualization was generated into the directory of the wallet that ran the prompt
+                if source_viz_dir != user_viz_dir:
+                    shutil.copy2(
+                        os.path.join(source_viz_dir, f"{r['file_name']}.js"),
+                        os.path.join(user_viz_dir, f"{r['file_name']}.js")
+                    )
+                filenames.append(f"{sanitized_address}/{r['file_name']}.js")
+                logger.info(f"Created new visualization file for user {wallet_address}: {r['file_name']}")
+                if r.get('data_as_of'):
+                    stored_results.append({
+                        "fileName": f"{sanitized_address}/{r['file_name']}.js",
+                        "dataAsOf": r['data_as_of'],
+                    })
+                
+                # copy the newly generated csv files from DATA_DIR to TARGET_DATA_DIR
+                # Copy the corresponding CSV file to the target directory
+                base_name = r['file_name']
+                csv_filename = f"{base_name}.csv"
+                csv_source_path = os.path.join(DATA_DIR, csv_filename)
+                csv_dest_path = os.path.join(TARGET_DATA_DIR, csv_filename)
+                shutil.copy2(csv_source_path, csv_dest_path)
+            
+        # Tasks still running at the request deadline are reported, not waited for
+        timed_out_tasks = [r['task'] for r in results if r['result'] == "timeout"]
+        return {
+            "success": True,
+            "message": (
+                "Visualization generated partially before the deadline"
+                if timed_out_tasks
+                else "Visualization generated successfully"
+            ),
+            "filenames": filenames,  # Return paths with wallet address
+            "storedResults": stored_results,
+            "timedOutTasks": timed_out_tasks,
+            "usage": usage
+        }
+    
+    elif type(results) == str:
+        return {
+            "success": True,
+            "message": "Analysis generated successfully",
+            "analysis": results,
+            "usage": usage
+        }
+    
+    else:
+        raise HTTPException(status_code=500, detail="Error processing prompt")
+
+
 # Original function (you can eventually deprecate this)
 async def process_prompt(data):
     """
@@ -433,6 +644,8 @@ async def process_prompt(data):
     Consider using the dedicated endpoints instead.
     """
     print("data-first", data)
+    # An unknown priority is the client's error (400)
+    priority = _request_priority(data)
     try:
         prompt = data.get("prompt")
         conversation_id = data.get("conversationId")
@@ -442,12 +655,15 @@ async def process_prompt(data):
         if not prompt:
             raise HTTPException(status_code=400, detail="Missing prompt")
         
-        # Save the prompt to the backend/data/prompts.txt
-        with open("backend/data/prompts.txt", "a", encoding="utf-8") as f:
-            f.write(f"{datetime.now()}: {prompt}\n")
-        
         if not wallet_address:
             raise HTTPException(status_code=400, detail="Missing wallet address")
+        
+        # Save the prompt to the prompt store
+        db = SessionLocal()
+        try:
+            record_prompt(db, wallet_address, prompt, conversation_id)
+        finally:
+            db.close()
             
         logger.info(f"Processing prompt for wallet {wallet_address}: {prompt[:50]}...")
         
@@ -458,51 +674,110 @@ async def process_prompt(data):
         print("data", data)
     
         # results = temp_mock_agent(prompt, csv_dir=DATA_DIR, viz_dir=user_viz_dir)
-        results = prompt_agent(prompt, csv_dir=DATA_DIR, viz_dir=user_viz_dir)
-        
-        print("results", results)
-        
-        if type(results) == list:
-            # Get the sanitized wallet address for the response
-            sanitized_address = wallet_address.replace('0x', '').lower()
-            
-            filenames = []
-            
-            for r in results:
-                if r['result'] == "success":
-                    filenames.append(f"{sanitized_address}/{r['file_name']}.js")
-                    logger.info(f"Created new visualization file for user {wallet_address}: {r['file_name']}")
-                    
-                    # copy the newly generated csv files from DATA_DIR to TARGET_DATA_DIR
-                    # Copy the corresponding CSV file to the target directory
-                    base_name = r['file_name']
-                    csv_filename = f"{base_name}.csv"
-                    csv_source_path = os.path.join(DATA_DIR, csv_filename)
-                    csv_dest_path = os.path.join(TARGET_DATA_DIR, csv_filename)
-                    shutil.copy2(csv_source_path, csv_dest_path)
-                
-            return {
-                "success": True,
-                "message": "Visualization generated successfully",
-                "filenames": filenames  # Return paths with wallet address
-            }
-        
-        elif type(results) == str:
-            return {
-                "success": True,
-                "message": "Analysis generated successfully",
-                "analysis": results
-            }
-        
-        else:
-            raise HTTPException(status_code=500, detail="Error processing prompt")
+        with request_context(wallet_address=normalize_wallet_address(wallet_address)):
+            (results, source_viz_dir, run_request_id), shared = await prompt_flight.do(
+                _prompt_key(prompt, conversation_id, priority),
+                lambda: _run_prompt_agent(prompt, user_viz_dir, conversation_id, priority)
+            )
+        # A caller that joined an identical in-flight prompt gets the usage of the shared run
+        usage = usage_tracker.get_request_usage(run_request_id)
+        if shared:
+            # Follow-ups in this conversation can then be answered from the datasets too
+            _share_datasets(results, conversation_id)
+            logger.info(f"Shared the result of an identical in-flight prompt with wallet {wallet_address}")
+        
+        return _prompt_response(results, source_viz_dir, user_viz_dir, wallet_address, usage)
+    except HTTPException:
+        raise
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing prompt: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def process_prompt_stream(data):
+    """
+    Process a user prompt and stream the generation as server-sent events.
+    
+    "partial" events carry the reasoning and d3.js code of each task as the
+    LLM writes them ({task, fileName, stage, field, delta}), "done" carries
+    the same response as /api/process-prompt and "error" a failure.
+    Streamed prompts are not shared with identical in-flight prompts.
+    """
+    prompt = data.get("prompt")
+    conversation_id = data.get("conversationId")
+    wallet_address = data.get("walletAddress")
+    priority = _request_priority(data)
+    
+    if not prompt:
+        raise HTTPException(status_code=400, detail="Missing prompt")
+    
+    if not wallet_address:
+        raise HTTPException(status_code=400, detail="Missing wallet address")
+    
+    db = SessionLocal()
+    try:
+        record_prompt(db, wallet_address, prompt, conversation_id)
+    finally:
+        db.close()
+    
+    logger.info(f"Streaming prompt for wallet {wallet_address}: {prompt[:50]}...")
+    user_viz_dir = get_user_visualization_dir(wallet_address)
+    
+    loop = asyncio.get_running_loop()
+    partials: asyncio.Queue = asyncio.Queue()
+    
+    def on_partial(event):
+        # Called from the pipeline's worker threads
+        loop.call_soon_threadsafe(partials.put_nowait, event)
+    
+    # The task copies the request context, the generator below runs outside of it
+    with request_context(wallet_address=normalize_wallet_address(wallet_address)) as request_id:
+        job = asyncio.ensure_future(job_scheduler.run(
+            prompt_agent, prompt, csv_dir=DATA_DIR, viz_dir=user_viz_dir,
+            conversation_id=conversation_id, on_partial=on_partial, priority=priority
+        ))
+    
+    async def events():
+        while not job.done():
+            next_partial = asyncio.ensure_future(partials.get())
+            await asyncio.wait({next_partial, job}, return_when=asyncio.FIRST_COMPLETED)
+            if next_partial.done():
+                yield _sse("partial", next_partial.result())
+            else:
+                next_partial.cancel()
+        while not partials.empty():
+            yield _sse("partial", partials.get_nowait())
+        
+        try:
+            usage = usage_tracker.get_request_usage(request_id)
+            response = _prompt_response(job.result(), user_viz_dir, user_viz_dir, wallet_address, usage)
+            yield _sse("done", response)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Error streaming prompt: {detail}")
+            yield _sse("error", {"detail": detail})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Then in your app definition, include the router
 app.include_router(image_router, prefix="/api", tags=["images"])
+app.include_router(metrics_router, tags=["metrics"])
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # Shared state lives in SQLite (WAL) and locked, atomically replaced files,
+    # so the API can run one worker process per core (WEB_CONCURRENCY)
+    uvicorn.run(
+        "backend.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
\ No newline at end of file
@@ -0,0 +1,66 @@
+import os
+import logging
+import threading
+from datetime import datetime, timezone
+from backend.agents_loader import prewarm_popular_queries
+from agents.utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Keep the results of the most requested Dune queries warm in the result store
+PREWARM_QUERIES = os.getenv("PREWARM_QUERIES", "false").lower() in ("1", "true", "yes")
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "20"))
+PREWARM_INTERVAL_SECONDS = int(os.getenv("PREWARM_INTERVAL_SECONDS", "3600"))
+# Hours (UTC) in which prewarming may run, e.g. "0-6" or "22-4"
+PREWARM_OFF_PEAK_HOURS = os.getenv("PREWARM_OFF_PEAK_HOURS", "0-6")
+# Delay of the first cycle after startup
+PREWARM_START_DELAY_SECONDS = int(os.getenv("PREWARM_START_DELAY_SECONDS", "60"))
+# Held during a cycle so that only one worker process prewarms at a time
+PREWARM_LOCK_PATH = os.path.join("agents", "data", "prewarm")
+
+
+def in_off_peak_window(now: datetime = None, window: str = PREWARM_OFF_PEAK_HOURS) -> bool:
+    now = now or datetime.now(timezone.utc)
+    start, end = (int(hour) for hour in window.split("-"))
+    if start <= end:
+        return start <= now.hour < end
+    # The window wraps around midnight
+    return now.hour >= start or now.hour < end
+
+
+def run_prewarm_cycle():
+    """Refresh the popular queries whose stored results are older than one interval"""
+    if not in_off_peak_window():
+        logger.debug("Outside the off-peak window, skipping prewarm cycle")
+        return None
+    try:
+        with file_lock(PREWARM_LOCK_PATH, blocking=False) as acquired:
+            if not acquired:
+                logger.debug("Another worker is prewarming, skipping prewarm cycle")
+                return None
+            stats = prewarm_popular_queries(PREWARM_TOP_N, max_age=PREWARM_INTERVAL_SECONDS)
+        logger.info(f"Prewarmed popular queries: {stats}")
+        return stats
+    except Exception as e:
+        logger.error(f"Error prewarming popular queries: {str(e)}")
+        return None
+
+
+def start_prewarm_scheduler() -> threading.Event:
+    """Run prewarm cycles in a background thread until the returned event is set"""
+    stop = threading.Event()
+
+    def run():
+        if stop.wait(PREWARM_START_DELAY_SECONDS):
+            return
+        while True:
+            run_prewarm_cycle()
+            if stop.wait(PREWARM_INTERVAL_SECONDS):
+                return
+
+    threading.Thread(target=run, name="prewarm-scheduler", daemon=True).start()
+    logger.info(
+        f"Started prewarm scheduler: top {PREWARM_TOP_N} queries every {PREWARM_INTERVAL_SECONDS}s "
+        f"during {PREWARM_OFF_PEAK_HOURS} UTC"
+    )
+    return stop
@@ -0,0 +1,102 @@
+import os
+import asyncio
+import logging
+import time
+
+from prometheus_client import Gauge, Histogram
+
+from agents.utils.scheduler import BACKGROUND, INTERACTIVE, FairQueue, background_limit, work_priority
+from agents.utils.tracing import wallet_address_var
+
+logger = logging.getLogger(__name__)
+
+# Agent jobs (prompts, analyses, refreshes, ...) running at once in this worker process
+SCHEDULER_MAX_JOBS = int(os.getenv("SCHEDULER_MAX_JOBS", "32"))
+# Background jobs running at once; more queue up and give way to interactive jobs
+SCHEDULER_MAX_BACKGROUND_JOBS = int(
+    os.getenv("SCHEDULER_MAX_BACKGROUND_JOBS", str(background_limit(SCHEDULER_MAX_JOBS, 0.25)))
+)
+
+JOBS_QUEUED = Gauge("visualyze_jobs_queued", "Agent jobs waiting to start", ["priority"])
+JOBS_RUNNING = Gauge("visualyze_jobs_running", "Agent jobs running", ["priority"])
+JOB_QUEUE_SECONDS = Histogram(
+    "visualyze_job_queue_seconds",
+    "Time an agent job waited to start",
+    ["priority"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+
+class JobScheduler:
+    """
+    Admission of the agent jobs of the API on the event loop
+
+    Interactive jobs (chat prompts, image analyses) start before queued
+    background jobs (refreshes, batch runs), which are also capped so that
+    they never take all the slots. Within a class, wallets get a weighted
+    fair share of the slots. The priority follows the job into the worker
+    threads of the agents, where the stage pools and rate limiters apply it
+    as well.
+    """
+
+    def __init__(self, max_jobs: int = SCHEDULER_MAX_JOBS, max_background_jobs: int = SCHEDULER_MAX_BACKGROUND_JOBS):
+        self.max_jobs = max_jobs
+        self.max_background_jobs = min(max_background_jobs, max_jobs)
+        self._queue = FairQueue("jobs")
+        self._running = {INTERACTIVE: 0, BACKGROUND: 0}
+
+    def _has_room(self, priority: str) -> bool:
+        if sum(self._running.values()) >= self.max_jobs:
+            return False
+        return priority == INTERACTIVE or self._running[BACKGROUND] < self.max_background_jobs
+
+    async def _admit(self, priority: str, wallet_address: str):
+        if not self._queue.queued(priority) and self._has_room(priority):
+            self._running[priority] += 1
+            return
+        admitted = asyncio.get_running_loop().create_future()
+        self._queue.push(admitted, priority, wallet_address)
+        JOBS_QUEUED.labels(priority=priority).inc()
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            # The client went away; a slot handed over in the meantime goes to the next job
+            if admitted.done() and not admitted.cancelled():
+                self._release(priority)
+            raise
+
+    def _release(self, priority: str):
+        self._running[priority] -= 1
+        while sum(self._running.values()) < self.max_jobs:
+            entry = self._queue.pop(allow_background=self._running[BACKGROUND] < self.max_background_jobs)
+            if entry is None:
+                return
+            next_priority, admitted = entry
+            JOBS_QUEUED.labels(priority=next_priority).dec()
+            if admitted.cancelled():
+                continue
+            self._running[next_priority] += 1
+            admitted.set_result(None)
+
+    async def run(self, fn, *args, priority: str = INTERACTIVE, **kwargs):
+        """
+        Run an agent job once it is admitted, a blocking one in a worker thread
+
+        The wallet of the current request context gets the fair share, and the
+        job runs in the given priority class.
+        """
+        queued_at = time.monotonic()
+        await self._admit(priority, wallet_address_var.get())
+        JOB_QUEUE_SECONDS.labels(priority=priority).observe(time.monotonic() - queued_at)
+        JOBS_RUNNING.labels(priority=priority).inc()
+        try:
+            with work_priority(priority):
+                if asyncio.iscoroutinefunction(fn):
+                    return await fn(*args, **kwargs)
+                return await asyncio.to_thread(fn, *args, **kwargs)
+        finally:
+            JOBS_RUNNING.labels(priority=priority).dec()
+            self._release(priority)
+
+
+job_scheduler = JobScheduler()
@@ -269,7 +269,7 @@ function App() {
                 console.log("hello")
                 console.log("vizSelector", vizSelector);
                 console.log("displayName", displayName);
-                const filePath = await downloadVisualizationImage(vizSelector, displayName);
+                const filePath = await downloadVisualizationImage(vizSelector, displayName, true, user?.wallet?.address);
                 console.log("filePath returned by downloadVisualizationImage", filePath);
                 filePathList.push(filePath);
               } catch (err) {
@@ -600,6 +600,18 @@ function App() {
               timestamp: aiMessage.timestamp || node.timestamp
             });
           }
+
+          // Figure analyses are stored next to the AI reply and shown as AI messages
+          node.messages
+            .filter(m => m.type === "analysis")
+            .forEach((analysisMessage, index) => {
+              processedNodes.push({
+                id: `${node.id}_analysis_${index}`,
+                type: "ai",
+                content: analysisMessage.content,
+                timestamp: analysisMessage.timestamp || node.timestamp
+              });
+            });
         } else {
           // Legacy node format
           processedNodes.push(node);
@@ -125,11 +125,15 @@ const Chat = forwardRef(({
             ? `I've created a visualization based on your prompt. The visualization '${data.filenames[0].split('/').pop()}' has been added to the canvas. You can interact with it alongside any existing visualizations.`
             : `I've created ${data.filenames.length} visualizations based on your prompt: ${data.filenames.map(f => `'${f.split('/').pop()}'`).join(', ')}. They have been added to the canvas. You can interact with them alongside any existing visualizations.`)
           : `I've created a visualization based on your prompt. The visualization has been added to the canvas. You can interact with it alongside any existing visualizations.`;
+        // Results served from the result store instead of a new Dune execution
+        const storedNote = Array.isArray(data.storedResults) && data.storedResults.length > 0
+          ? ` Some data comes from a stored query result: ${data.storedResults.map(r => `'${r.fileName.split('/').pop()}' as of ${new Date(r.dataAsOf).toLocaleString()}`).join(', ')}.`
+          : '';
         
         // Simulate typing delay for better UX
         setTimeout(() => {
           const aiMessage = {
-            text: aiResponseText,
+            text: aiResponseText + storedNote,
             sender: 'ai',
             timestamp: new Date().toISOString(),
           };
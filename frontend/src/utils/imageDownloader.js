@@ -5,9 +5,10 @@ import { saveAs } from 'file-saver';
  * @param {string} svgContainerSelector - CSS selector to find the SVG container
  * @param {string} displayName - Display name for the visualization (used for filename)
  * @param {boolean} saveToServer - Whether to also save the image to the server
+ * @param {string} walletAddress - Wallet address used to look up the prompt to analyze the image with
  * @returns {Promise<string|null>} - URL of the saved image or null if failed
  */
-export const downloadVisualizationImage = async (svgContainerSelector, displayName, saveToServer = true) => {
+export const downloadVisualizationImage = async (svgContainerSelector, displayName, saveToServer = true, walletAddress = null) => {
   try {
     console.log("Attempting to download visualization:", displayName);
     
@@ -72,6 +73,9 @@ export const downloadVisualizationImage = async (svgContainerSelector, displayNa
             if (saveToServer) {
               const formData = new FormData();
               formData.append('file', blob, filename);
+              if (walletAddress) {
+                formData.append('walletAddress', walletAddress);
+              }
               
               // Send the image to the server
               const response = await fetch('http://localhost:8000/api/save-visualization-image', {
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix="visualyze-tests-")
+# The backend and the usage tracker read their database locations at import time, keep the tests off ./
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_data_dir, 'test.db')}")
+os.environ.setdefault("USAGE_DB", os.path.join(_data_dir, "usage.db"))
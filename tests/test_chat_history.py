@@ -0,0 +1,28 @@
+import pytest
+
+from backend.database import chat_history
+
+
+@pytest.fixture(autouse=True)
+def history_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_history, "HISTORY_FILE", str(tmp_path / "chat_history.json"))
+
+
+def test_add_analysis_to_node_keeps_ai_reply():
+    conversation = chat_history.create_conversation("Figures")
+    node = chat_history.add_conversation_node(conversation["id"], "Plot the volume", ai_content="Here it is")
+
+    chat_history.add_analysis_to_node(conversation["id"], node["id"], "The volume doubled in May")
+
+    messages = chat_history.get_conversation(conversation["id"])["nodes"][-1]["messages"]
+    assert [(m["type"], m["content"]) for m in messages] == [
+        ("user", "Plot the volume"),
+        ("ai", "Here it is"),
+        ("analysis", "The volume doubled in May"),
+    ]
+
+
+def test_add_analysis_to_unknown_node():
+    conversation = chat_history.create_conversation("Figures")
+    assert chat_history.add_analysis_to_node(conversation["id"], "missing", "analysis") is None
+    assert chat_history.add_analysis_to_node("missing", "missing", "analysis") is None
@@ -0,0 +1,78 @@
+import pandas as pd
+
+from agents.utils.dataset_store import (
+    boundary_literal,
+    detect_time_column,
+    is_incremental_sql,
+    merge_delta,
+    wrap_delta_sql,
+)
+
+
+def _frame(days, volumes):
+    return pd.DataFrame({"day": [f"2024-01-{d:02d} 00:00:00.000 UTC" for d in days], "volume": volumes})
+
+
+def test_merge_delta_replaces_the_last_bucket_and_appends():
+    existing = _frame([1, 2, 3], [10, 20, 5])
+    delta = _frame([3, 4], [30, 40])
+    merged = merge_delta(existing, delta, "day", "2024-01-03T00:00:00+00:00")
+    assert merged["volume"].tolist() == [10, 20, 30, 40]
+
+
+def test_merge_delta_ignores_rows_before_the_boundary():
+    existing = _frame([1, 2], [10, 20])
+    delta = _frame([1, 2, 3], [99, 21, 30])
+    merged = merge_delta(existing, delta, "day", "2024-01-02T00:00:00+00:00")
+    assert merged["volume"].tolist() == [10, 21, 30]
+
+
+def test_merge_delta_keeps_the_dataset_when_the_delta_is_empty():
+    existing = _frame([1, 2], [10, 20])
+    merged = merge_delta(existing, _frame([], []), "day", "2024-01-02T00:00:00+00:00")
+    assert merged is existing
+
+
+def test_merge_delta_keeps_descending_order_and_columns():
+    existing = _frame([3, 2, 1], [5, 20, 10])
+    delta = _frame([3, 4], [30, 40]).assign(extra="dropped")
+    merged = merge_delta(existing, delta, "day", "2024-01-03T00:00:00+00:00")
+    assert merged["volume"].tolist() == [40, 30, 20, 10]
+    assert merged.columns.tolist() == ["day", "volume"]
+
+
+def test_detect_time_column():
+    assert detect_time_column(_frame([1, 2], [1, 2])) == "day"
+    assert detect_time_column(pd.DataFrame({"token": ["a", "b"], "volume": [1, 2]})) is None
+
+
+def test_window_functions_are_not_incremental():
+    assert is_incremental_sql("SELECT day, SUM(amount) FROM t GROUP BY 1")
+    assert not is_incremental_sql("SELECT day, SUM(amount) OVER (ORDER BY day) FROM t")
+
+
+def test_wrap_delta_sql_filters_the_output():
+    sql = wrap_delta_sql("SELECT day, volume FROM t;", "day", "2024-01-03T00:00:00+00:00")
+    assert boundary_literal("2024-01-03T00:00:00+00:00") == "TIMESTAMP '2024-01-03 00:00:00'"
+    assert sql.endswith("""WHERE "day" >= TIMESTAMP '2024-01-03 00:00:00'""")
+    assert "SELECT day, volume FROM t\n)" in sql
+
+
+def test_wrap_delta_sql_drops_the_outer_order_and_limit():
+    sql = wrap_delta_sql(
+        "SELECT day, SUM(volume) AS volume FROM t GROUP BY 1 ORDER BY 1\nLIMIT 10000",
+        "day",
+        "2024-01-03T00:00:00+00:00",
+    )
+    assert "LIMIT" not in sql
+    assert "ORDER BY" not in sql
+    assert "SELECT day, SUM(volume) AS volume FROM t GROUP BY 1\n)" in sql
+
+
+def test_wrap_delta_sql_keeps_inner_limits():
+    sql = wrap_delta_sql(
+        "SELECT day, volume FROM (SELECT * FROM t ORDER BY volume DESC LIMIT 5) top ORDER BY day LIMIT 100",
+        "day",
+        "2024-01-03T00:00:00+00:00",
+    )
+    assert "(SELECT * FROM t ORDER BY volume DESC LIMIT 5) top\n)" in sql
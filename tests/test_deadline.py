@@ -0,0 +1,65 @@
+import contextvars
+import time
+
+import pytest
+
+from agents.utils import deadline
+from agents.utils.deadline import (
+    DeadlineExceeded,
+    check_deadline,
+    deadline_scope,
+    deadline_var,
+    expired,
+    has_time_for,
+    remaining,
+)
+
+
+def test_no_deadline_by_default():
+    assert remaining() is None
+    assert not expired()
+    assert has_time_for("plot_refine")
+    with deadline_scope(None) as current:
+        assert current is None
+
+
+def test_inner_scope_cannot_extend_the_outer_deadline():
+    with deadline_scope(1.0) as outer:
+        with deadline_scope(60.0) as inner:
+            assert inner == outer
+        with deadline_scope(0.5) as inner:
+            assert inner < outer
+            assert remaining() <= 0.5
+        assert deadline_var.get() == outer
+    assert deadline_var.get() is None
+
+
+def test_scope_without_seconds_keeps_the_outer_deadline():
+    with deadline_scope(1.0) as outer:
+        with deadline_scope(None) as inner:
+            assert inner == outer
+
+
+def test_expired_deadline_stops_work():
+    with deadline_scope(0.0):
+        time.sleep(0.001)
+        assert expired()
+        assert remaining() == 0.0
+        with pytest.raises(DeadlineExceeded):
+            check_deadline("plot")
+
+
+def test_optional_stage_is_skipped_when_time_is_short(monkeypatch):
+    monkeypatch.setitem(deadline.STAGE_MIN_SECONDS, "plot_refine", 30.0)
+    with deadline_scope(60.0):
+        assert has_time_for("plot_refine")
+    with deadline_scope(5.0):
+        assert not has_time_for("plot_refine")
+        assert has_time_for("unknown_stage")
+
+
+def test_deadline_follows_a_copied_context():
+    with deadline_scope(1.0) as current:
+        context = contextvars.copy_context()
+    assert deadline_var.get() is None
+    assert context.run(deadline_var.get) == current
@@ -0,0 +1,113 @@
+import pytest
+
+from agents.utils import js_validator
+from agents.utils.js_validator import _scan_structure, syntax_error, validate_plot_code
+
+FILE_NAME = "/data/volume.csv"
+
+VALID_PLOT = """const GeneratedViz = () => {
+  const chartRef = React.useRef(null);
+
+  React.useEffect(() => {
+    const renderChart = async () => {
+      const container = chartRef.current;
+      d3.select(container).select("svg").remove();
+      const data = await d3.csv("/data/volume.csv");
+      const width = container.clientWidth / 2;
+      const label = `${data.length} rows`;
+      const isDate = /^\\d{4}-\\d{2}/.test(data[0].day);
+      d3.select(container).append("svg").attr("width", width).append("text").text(label + isDate);
+    };
+    const observer = new ResizeObserver(() => renderChart());
+    observer.observe(chartRef.current);
+    return () => observer.disconnect();
+  }, []);
+
+  return React.createElement("div", { ref: chartRef, className: "w-full h-full bg-[#22222E]" });
+};
+"""
+
+
+@pytest.fixture(params=["esprima", "scan"])
+def parser(request, monkeypatch):
+    """Run a test with esprima and with the structural scan it falls back to"""
+    if request.param == "esprima":
+        if js_validator.esprima is None:
+            pytest.skip("esprima is not installed")
+    else:
+        monkeypatch.setattr(js_validator, "esprima", None)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "const a = b / c / d;",
+        "const half = (a + b) / 2, i = j++ / 2;",
+        "const ok = /[/]\\d+/.test(s);",
+        "function f(s) { return /a\\/b/.test(s); }",
+        "function f(s) { return /)/.test(s) && /[(]/.test(s); }",
+        "if (typeof /x/ === 'object') { throw /y/; }",
+        "const s = `total ${items.map((d) => `${d.name}`).join(', ')} }`;",
+        "const url = 'http://x'; // a ( comment\n/* another { one */ f(url);",
+        "const s = \"a ) b\"; const t = 'c ] d';",
+    ],
+)
+def test_scan_accepts_valid_code(code):
+    assert _scan_structure(code) is None
+
+
+@pytest.mark.parametrize(
+    "code, problem",
+    [
+        ("const s = 'abc;\nf(s);", "Unterminated string literal (line 1)"),
+        ("const s = `abc ${x}", "'`' opened on line 1 is never closed"),
+        ("f(a);\n/* never closed", "Unterminated comment (line 2)"),
+        ("const r = /abc\n;", "Unterminated regular expression (line 1)"),
+        ("function f() {\n  return [1, 2);\n}", "Unexpected ')' (line 2)"),
+        ("data.forEach((d) => {\n  draw(d);\n", "'{' opened on line 1 is never closed"),
+        ("if (/)/.test(s)) { f(a)) }", "Unexpected ')' (line 1)"),
+    ],
+)
+def test_scan_reports_the_first_problem(code, problem):
+    assert _scan_structure(code) == problem
+
+
+def test_syntax_error(parser):
+    assert syntax_error(VALID_PLOT) is None
+    assert syntax_error(VALID_PLOT[:-40]) is not None
+
+
+def test_valid_plot_passes(parser):
+    assert validate_plot_code(VALID_PLOT, FILE_NAME) == []
+
+
+def test_code_fence_is_reported_and_stripped(parser):
+    failures = validate_plot_code(f"```javascript\n{VALID_PLOT}```", FILE_NAME)
+    assert failures == ["The code is wrapped in a markdown code fence, return the plain code"]
+
+
+def test_truncated_plot_fails_the_syntax_check(parser):
+    failures = validate_plot_code(VALID_PLOT[: len(VALID_PLOT) // 2], FILE_NAME)
+    assert any(failure.startswith("Syntax error:") for failure in failures)
+
+
+def test_plot_rule_violations():
+    code = VALID_PLOT.replace("observer.disconnect()", "null").replace(
+        '"/data/volume.csv"', '"/data/other.csv"'
+    )
+    failures = validate_plot_code(code, FILE_NAME)
+    assert failures == [
+        "The effect must return a cleanup that disconnects the ResizeObserver",
+        f"The data must be read from {FILE_NAME}",
+        f"The code reads other data files (/data/other.csv), only {FILE_NAME} exists",
+    ]
+
+
+def test_jsx_is_rejected():
+    code = VALID_PLOT.replace(
+        'return React.createElement("div", { ref: chartRef, className: "w-full h-full bg-[#22222E]" });',
+        "return <div ref={chartRef} />;",
+    )
+    failures = validate_plot_code(code, FILE_NAME)
+    assert "The component returns JSX, it must return React.createElement" in failures
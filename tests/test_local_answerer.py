@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from agents import local_answerer
+from agents.local_answerer import LoadedDataset, LocalAnswerAgent
+from agents.utils.dataset_store import DatasetMetadata
+from agents.utils.local_engine import local_query_problem
+
+
+@pytest.fixture
+def dataset():
+    metadata = DatasetMetadata(
+        task="Daily DEX volume",
+        sql="SELECT day, volume FROM dex.trades",
+        time_column="day",
+        rows=3,
+        created_at="2024-01-03T00:00:00",
+    )
+    df = pd.DataFrame({"day": ["2024-01-01", "2024-01-02", "2024-01-03"], "volume": [1.0, 2.0, 3.0]})
+    return LoadedDataset("/data/daily_volume.csv", metadata, df)
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    """Local queries that reached the engine"""
+    queries = []
+    run = local_answerer.run_local_query
+
+    def spy(sql, tables):
+        queries.append(sql)
+        return run(sql, tables)
+
+    monkeypatch.setattr(local_answerer, "run_local_query", spy)
+    return queries
+
+
+def agent_answering(local_sql):
+    agent = LocalAnswerAgent()
+    agent.check_answerability = lambda **kwargs: SimpleNamespace(
+        reasoning="The dataset has every day",
+        answerable=True,
+        dataset_name="daily_volume",
+        local_sql=local_sql,
+        output_filename="answer.csv",
+    )
+    return agent
+
+
+def test_answers_from_the_dataset(dataset, executed):
+    answer = agent_answering("SELECT SUM(volume) AS volume FROM base WHERE day >= '2024-01-02'").answer(
+        "Volume since January 2nd", [dataset]
+    )
+    assert answer.df["volume"].tolist() == [5.0]
+    assert answer.sql == dataset.metadata.sql
+    assert len(executed) == 1
+
+
+@pytest.mark.parametrize(
+    "local_sql",
+    [
+        "SELECT * FROM read_csv('.env')",
+        "SELECT * FROM '/etc/hostname'",
+        "COPY (SELECT * FROM base) TO '/tmp/out.csv'",
+        "SELECT * FROM base; ATTACH '/tmp/other.db'",
+        "INSTALL httpfs",
+    ],
+)
+def test_filesystem_queries_go_to_dune_unexecuted(dataset, executed, local_sql):
+    # None sends the task to Dune
+    assert agent_answering(local_sql).answer("Volume per day", [dataset]) is None
+    assert executed == []
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT extract(year FROM day) AS year, SUM(volume) FROM base GROUP BY 1",
+        "WITH w(d, v) AS (SELECT day, volume FROM base) SELECT * FROM w JOIN base ON w.d = base.day",
+        "SELECT 'copy' AS note FROM base -- attach\n;",
+    ],
+)
+def test_read_only_selects_are_allowed(sql):
+    assert local_query_problem(sql, ["base"]) is None
+
+
+@pytest.mark.parametrize(
+    "sql, problem",
+    [
+        ("SELECT * FROM other", "The local query may only read base, not other"),
+        ("SELECT * FROM base, parquet_scan('x')", "The local query may not call parquet_scan"),
+        ("SELECT 1; SELECT 2", "The local query must be a single statement"),
+        ("WITH x AS (SELECT 1) DELETE FROM base", "The local query may not use DELETE"),
+    ],
+)
+def test_other_queries_are_rejected(sql, problem):
+    assert local_query_problem(sql, ["base"]) == problem
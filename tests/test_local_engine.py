@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+from agents.utils import local_engine
+from agents.utils.local_engine import chain_local_queries, run_local_query
+
+BASE = pd.DataFrame({"day": ["2024-01-01", "2024-01-02", "2024-01-02"], "volume": [1.0, 2.0, 3.0]})
+
+
+@pytest.fixture(params=["duckdb", "sqlite"])
+def engine(request, monkeypatch):
+    """Run a test with DuckDB and with the SQLite it falls back to"""
+    if request.param == "duckdb":
+        if local_engine.duckdb is None:
+            pytest.skip("duckdb is not installed")
+    else:
+        monkeypatch.setattr(local_engine, "duckdb", None)
+    return request.param
+
+
+def test_queries_the_registered_tables(engine):
+    df = run_local_query("SELECT day, SUM(volume) AS volume FROM base GROUP BY day ORDER BY day", {"base": BASE})
+    assert df.to_dict(orient="list") == {"day": ["2024-01-01", "2024-01-02"], "volume": [1.0, 5.0]}
+
+
+def test_chained_queries():
+    # SQLite rejects a CTE named like the table it reads ("circular reference: base")
+    if local_engine.duckdb is None:
+        pytest.skip("duckdb is not installed")
+    sql = chain_local_queries("SELECT * FROM base WHERE volume > 1", "SELECT COUNT(*) AS n FROM base")
+    assert run_local_query(sql, {"base": BASE})["n"].tolist() == [2]
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT * FROM read_csv('{secret}')",
+        "SELECT * FROM '{secret}'",
+        "COPY (SELECT * FROM base) TO '{written}'",
+        "ATTACH '{written}' AS stolen",
+    ],
+)
+def test_duckdb_cannot_touch_the_filesystem(tmp_path, sql):
+    if local_engine.duckdb is None:
+        pytest.skip("duckdb is not installed")
+    secret = tmp_path / ".env"
+    secret.write_text("OPENAI_API_KEY=sk-secret\n")
+    written = tmp_path / "written"
+
+    with pytest.raises(Exception):
+        run_local_query(sql.format(secret=secret, written=written), {"base": BASE})
+    assert not written.exists()
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "ATTACH DATABASE '{written}' AS stolen",
+        "CREATE TABLE copy AS SELECT * FROM base",
+        "PRAGMA table_info(base)",
+    ],
+)
+def test_sqlite_only_reads(tmp_path, monkeypatch, sql):
+    monkeypatch.setattr(local_engine, "duckdb", None)
+    written = tmp_path / "written.db"
+
+    with pytest.raises(Exception):
+        run_local_query(sql.format(written=written), {"base": BASE})
+    assert not written.exists()
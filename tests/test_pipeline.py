@@ -0,0 +1,173 @@
+import concurrent.futures
+import contextvars
+import threading
+
+import pytest
+
+from agents.pipeline import Completed, StagePool, run_stages
+from agents.utils.scheduler import BACKGROUND, INTERACTIVE, work_priority
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def pools():
+    created = []
+
+    def make(name, max_workers=2):
+        pool = StagePool(name, max_workers)
+        created.append(pool)
+        return pool
+
+    yield make
+    for pool in created:
+        pool.shutdown()
+
+
+def context_with(priority):
+    with work_priority(priority):
+        return contextvars.copy_context()
+
+
+def blocker():
+    """A stage function holding its worker until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def fn(value=None):
+        started.set()
+        release.wait(TIMEOUT)
+        return value
+
+    return fn, started, release
+
+
+def test_run_stages_chains_the_results(pools):
+    sql, dune = pools("sql"), pools("dune")
+    future = run_stages([(sql, lambda x: x + 1), (dune, lambda x: x * 10)], 1)
+    assert future.result(TIMEOUT) == 20
+
+
+def test_run_stages_finishes_early_on_completed(pools):
+    sql, dune = pools("sql"), pools("dune")
+    later = []
+    future = run_stages([(sql, lambda x: Completed("cached")), (dune, later.append)], 1)
+    assert future.result(TIMEOUT) == "cached"
+    assert later == []
+
+
+def test_run_stages_propagates_exceptions(pools):
+    sql, dune = pools("sql"), pools("dune")
+    later = []
+
+    def fail(value):
+        raise ValueError("bad SQL")
+
+    future = run_stages([(sql, fail), (dune, later.append)], 1)
+    with pytest.raises(ValueError, match="bad SQL"):
+        future.result(TIMEOUT)
+    assert later == []
+
+
+def test_run_stages_runs_in_the_caller_context(pools):
+    var = contextvars.ContextVar("var", default="unset")
+    token = var.set("request")
+    try:
+        future = run_stages([(pools("sql"), lambda _: var.get())])
+    finally:
+        var.reset(token)
+    assert future.result(TIMEOUT) == "request"
+
+
+class RecordingPool(StagePool):
+    def __init__(self, name, max_workers):
+        super().__init__(name, max_workers)
+        self.submitted = []
+
+    def submit(self, context, fn, *args):
+        self.submitted.append(args)
+        return super().submit(context, fn, *args)
+
+
+def test_cancelling_skips_the_stages_not_started(pools):
+    sql, dune = pools("sql"), RecordingPool("dune", 2)
+    fn, started, release = blocker()
+
+    future = run_stages([(sql, fn), (dune, lambda value: value)], 1)
+    assert started.wait(TIMEOUT)
+    assert future.cancel()
+    release.set()
+
+    # Joining the workers waits for the callback of the first stage
+    sql.shutdown()
+    dune.shutdown()
+    assert dune.submitted == []
+
+
+def test_cancelled_queued_stage_does_not_run(pools):
+    pool = pools("sql", max_workers=1)
+    fn, started, release = blocker()
+    ran = []
+
+    pool.submit(contextvars.copy_context(), fn)
+    assert started.wait(TIMEOUT)
+    queued = pool.submit(contextvars.copy_context(), ran.append, "queued")
+    assert queued.cancel()
+    release.set()
+
+    pool.submit(contextvars.copy_context(), lambda: None).result(TIMEOUT)
+    assert ran == []
+
+
+def test_interactive_stages_overtake_queued_background_ones(pools):
+    pool = pools("sql", max_workers=1)
+    fn, started, release = blocker()
+    order = []
+
+    pool.submit(contextvars.copy_context(), fn)
+    assert started.wait(TIMEOUT)
+    futures = [
+        pool.submit(context_with(BACKGROUND), order.append, "background"),
+        pool.submit(context_with(INTERACTIVE), order.append, "interactive"),
+    ]
+    release.set()
+
+    concurrent.futures.wait(futures, timeout=TIMEOUT)
+    assert order == ["interactive", "background"]
+
+
+def test_background_stages_leave_workers_to_interactive_ones(pools):
+    # Two workers, background stages may hold one of them
+    pool = pools("dune", max_workers=2)
+    fn, started, release = blocker()
+    ran = []
+
+    first = pool.submit(context_with(BACKGROUND), fn)
+    assert started.wait(TIMEOUT)
+    second = pool.submit(context_with(BACKGROUND), ran.append, "background")
+    pool.submit(context_with(INTERACTIVE), ran.append, "interactive").result(TIMEOUT)
+    assert ran == ["interactive"]
+    assert not second.done()
+
+    release.set()
+    first.result(TIMEOUT)
+    second.result(TIMEOUT)
+    assert ran == ["interactive", "background"]
+
+
+def test_shutdown_cancels_queued_stages_and_rejects_new_ones(pools):
+    pool = pools("plot", max_workers=1)
+    fn, started, release = blocker()
+
+    running = pool.submit(contextvars.copy_context(), fn, "done")
+    assert started.wait(TIMEOUT)
+    queued = pool.submit(contextvars.copy_context(), lambda: None)
+    pool.shutdown(wait=False)
+    release.set()
+    pool.shutdown()
+
+    assert running.result(TIMEOUT) == "done"
+    assert queued.cancelled()
+    with pytest.raises(RuntimeError):
+        pool.submit(contextvars.copy_context(), lambda: None)
+    with pytest.raises(RuntimeError):
+        run_stages([(pool, lambda _: None)]).result(TIMEOUT)
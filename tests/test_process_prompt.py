@@ -0,0 +1,93 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from agents.utils.conversation_index import conversation_dataset_paths
+from agents.utils.tracing import request_id_var
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    import backend.main as backend
+
+    monkeypatch.setattr(backend, "VISUALIZATIONS_DIR", str(tmp_path / "viz"))
+    monkeypatch.setattr(backend, "DATA_DIR", str(tmp_path / "csv"))
+    monkeypatch.setattr(backend, "TARGET_DATA_DIR", str(tmp_path / "public"))
+    for directory in ("csv", "public"):
+        os.makedirs(tmp_path / directory)
+    return backend
+
+
+def test_identical_prompts_of_two_wallets_share_usage_and_datasets(backend, monkeypatch):
+    runs = []
+    release = threading.Event()
+
+    def prompt_agent(prompt, csv_dir, viz_dir, conversation_id=None, **kwargs):
+        runs.append(request_id_var.get())
+        release.wait(5)
+        for path in (os.path.join(csv_dir, "volume.csv"), os.path.join(viz_dir, "volume.js")):
+            with open(path, "w") as f:
+                f.write("x")
+        return [{"task": "volume", "result": "success", "file_name": "volume"}]
+
+    monkeypatch.setattr(backend, "prompt_agent", prompt_agent)
+    monkeypatch.setattr(
+        backend.usage_tracker, "get_request_usage", lambda request_id: {"request_id": request_id}
+    )
+
+    async def run_both():
+        first = asyncio.ensure_future(backend.process_prompt(
+            {"prompt": "Daily volume", "walletAddress": "0xaaa", "conversationId": "conversation-a"}
+        ))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(backend.process_prompt(
+            {"prompt": "daily  volume", "walletAddress": "0xbbb", "conversationId": "conversation-b"}
+        ))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await first, await second
+
+    first, second = asyncio.run(run_both())
+
+    assert len(runs) == 1
+    assert first["usage"] == second["usage"] == {"request_id": runs[0]}
+    assert first["filenames"] == ["aaa/volume.js"]
+    assert second["filenames"] == ["bbb/volume.js"]
+    assert conversation_dataset_paths(backend.DATA_DIR, "conversation-b") == [
+        os.path.join(backend.DATA_DIR, "volume.csv")
+    ]
+
+
+@pytest.mark.parametrize("data", [
+    {"prompt": "Daily volume", "walletAddress": "0xaaa", "priority": "urgent"},
+    {"walletAddress": "0xaaa"},
+    {"prompt": "Daily volume"},
+])
+def test_invalid_prompt_requests_are_bad_requests(backend, data):
+    with pytest.raises(backend.HTTPException) as error:
+        asyncio.run(backend.process_prompt(data))
+    assert error.value.status_code == 400
+
+
+def test_stored_results_are_reported_with_their_age(backend, monkeypatch):
+    def prompt_agent(prompt, csv_dir, viz_dir, conversation_id=None, **kwargs):
+        for name in ("fresh", "stored"):
+            for path in (os.path.join(csv_dir, f"{name}.csv"), os.path.join(viz_dir, f"{name}.js")):
+                with open(path, "w") as f:
+                    f.write("x")
+        return [
+            {"task": "fresh", "result": "success", "file_name": "fresh"},
+            {"task": "stored", "result": "success", "file_name": "stored", "data_as_of": "2024-01-01T00:00:00+00:00"},
+        ]
+
+    monkeypatch.setattr(backend, "prompt_agent", prompt_agent)
+    monkeypatch.setattr(backend.usage_tracker, "get_request_usage", lambda request_id: {})
+
+    response = asyncio.run(backend.process_prompt({"prompt": "Weekly volume", "walletAddress": "0xccc"}))
+
+    assert response["filenames"] == ["ccc/fresh.js", "ccc/stored.js"]
+    assert response["storedResults"] == [
+        {"fileName": "ccc/stored.js", "dataAsOf": "2024-01-01T00:00:00+00:00"}
+    ]
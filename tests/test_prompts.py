@@ -0,0 +1,51 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from backend.database import SessionLocal
+from backend.database.prompts import get_latest_prompt, record_prompt
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _wallet() -> str:
+    return f"0x{uuid.uuid4().hex}"
+
+
+def test_latest_prompt_is_scoped_to_wallet_and_conversation(db):
+    wallet, other = _wallet(), _wallet()
+    record_prompt(db, wallet, "volume per day", "c1")
+    record_prompt(db, wallet, "fees per week", "c2")
+    record_prompt(db, other, "someone else's prompt", "c1")
+
+    assert get_latest_prompt(db, wallet.upper()) == "fees per week"
+    assert get_latest_prompt(db, wallet, "c1") == "volume per day"
+    assert get_latest_prompt(db, _wallet()) is None
+
+
+@pytest.mark.parametrize("wallet_address", [None, ""])
+def test_latest_prompt_requires_wallet(db, wallet_address):
+    record_prompt(db, _wallet(), "someone else's prompt")
+    with pytest.raises(ValueError):
+        get_latest_prompt(db, wallet_address)
+
+
+def test_analyze_data_reports_missing_prompt_as_bad_request():
+    from backend.main import analyze_data
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(analyze_data({"walletAddress": _wallet(), "filePaths": ["figure.csv"]}))
+    assert error.value.status_code == 400
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(analyze_data({"filePaths": ["figure.csv"]}))
+    assert error.value.status_code == 400
@@ -0,0 +1,51 @@
+import time
+
+from agents.utils import query_history
+from agents.utils.query_history import QueryHistory
+
+
+def insert_old_rows(history, days):
+    created_at = time.time() - days * 86400
+    conn = history._connection()
+    conn.execute(
+        "INSERT INTO query_runs (fingerprint, tables, performance, state, seconds, created_at) "
+        "VALUES ('old', '[]', 'medium', 'completed', 1.0, ?)",
+        (created_at,),
+    )
+    conn.execute(
+        "INSERT INTO query_requests (sql_key, sql, created_at) VALUES ('old', 'SELECT 1', ?)", (created_at,)
+    )
+    conn.commit()
+
+
+def counts(history):
+    conn = history._connection()
+    return (
+        conn.execute("SELECT COUNT(*) FROM query_runs").fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM query_requests").fetchone()[0],
+    )
+
+
+def test_old_runs_and_requests_are_pruned_on_insert():
+    history = QueryHistory(":memory:", max_age_days=30)
+    insert_old_rows(history, days=31)
+    insert_old_rows(history, days=29)
+
+    history.record_request("new", "SELECT 2")
+
+    # The 31 day old run and request are gone, the 29 day old ones and the new request stay
+    assert counts(history) == (1, 2)
+    assert [q["sql_key"] for q in history.popular_queries(limit=10, days=30)] == ["new", "old"]
+
+
+def test_history_is_pruned_at_most_once_per_interval(monkeypatch):
+    history = QueryHistory(":memory:", max_age_days=30)
+    history.record("fingerprint", ["dex.trades"], "medium", "completed", 2.0)
+    insert_old_rows(history, days=31)
+
+    history.record("fingerprint", ["dex.trades"], "medium", "completed", 3.0)
+    assert counts(history) == (3, 1)
+
+    monkeypatch.setattr(query_history, "_PRUNE_INTERVAL_SECONDS", 0)
+    history.record("fingerprint", ["dex.trades"], "medium", "completed", 4.0)
+    assert counts(history) == (3, 0)
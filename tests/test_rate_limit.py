@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from agents.utils import rate_limit
+from agents.utils.rate_limit import RateLimiter, acall_with_backoff, call_with_backoff, classify_error
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff_delay(monkeypatch):
+    monkeypatch.setattr(rate_limit, "backoff_delay", lambda attempt: 0.0)
+
+
+def flaky(errors, result="ok"):
+    """A function raising the given errors one per call, then returning result"""
+    calls = []
+
+    def fn():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return fn, calls
+
+
+def test_classify_error():
+    assert classify_error(StatusError(429)) == rate_limit.RATE_LIMIT
+    assert classify_error(StatusError(503)) == rate_limit.TRANSIENT
+    assert classify_error(StatusError(400)) is None
+    assert classify_error("429 Client Error: Too Many Requests") == rate_limit.RATE_LIMIT
+    assert classify_error("Error code: 429 - insufficient_quota") is None
+
+
+def test_call_with_backoff_retries_rate_limits_and_slows_down():
+    limiter = RateLimiter("test", 6000)
+    fn, calls = flaky([StatusError(429), StatusError(429, {"retry-after-ms": "1"})])
+    assert call_with_backoff(limiter, fn) == "ok"
+    assert len(calls) == 3
+    assert limiter.rate < limiter.max_rate
+
+
+def test_call_with_backoff_does_not_retry_other_errors():
+    fn, calls = flaky([StatusError(400)])
+    with pytest.raises(StatusError):
+        call_with_backoff(RateLimiter("test", 0), fn)
+    assert len(calls) == 1
+
+
+def test_call_with_backoff_leaves_transient_failures_to_the_caller():
+    fn, calls = flaky([StatusError(502)])
+    with pytest.raises(StatusError):
+        call_with_backoff(RateLimiter("test", 0), fn, retry_transient=False)
+    assert len(calls) == 1
+
+
+def test_call_with_backoff_gives_up_after_max_attempts():
+    fn, calls = flaky([StatusError(429)] * 5)
+    with pytest.raises(StatusError):
+        call_with_backoff(RateLimiter("test", 0), fn, max_attempts=3)
+    assert len(calls) == 3
+
+
+def test_acall_with_backoff_retries_like_the_sync_version():
+    limiter = RateLimiter("test", 6000)
+    fn, calls = flaky([StatusError(429), StatusError(503)])
+
+    async def afn():
+        return fn()
+
+    assert asyncio.run(acall_with_backoff(limiter, afn)) == "ok"
+    assert len(calls) == 3
+    assert limiter.rate < limiter.max_rate
+
+    fn, calls = flaky([StatusError(401)])
+    with pytest.raises(StatusError):
+        asyncio.run(acall_with_backoff(limiter, afn))
+    assert len(calls) == 1
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+from agents.refresher import DatasetRefresher
+from agents.utils.dataset_store import record_dataset
+from agents.utils.file_lock import LockBusy, file_lock
+
+
+class FailingDuneClient:
+    def execute_query(self, sql, refresh=False):
+        raise AssertionError("A busy dataset must not be executed")
+
+
+def test_refresh_of_a_dataset_being_refreshed_fails_fast(tmp_path):
+    csv_path = str(tmp_path / "volume.csv")
+    with file_lock(csv_path):
+        with pytest.raises(LockBusy):
+            DatasetRefresher(FailingDuneClient()).refresh(csv_path)
+
+
+def test_refresh_releases_the_lock(tmp_path):
+    csv_path = str(tmp_path / "missing.csv")
+    with pytest.raises(FileNotFoundError):
+        DatasetRefresher(FailingDuneClient()).refresh(csv_path)
+    with file_lock(csv_path, blocking=False) as acquired:
+        assert acquired
+
+
+class DuckDbDuneClient:
+    """Runs the queries over a `t` table with DuckDB, which also understands the TIMESTAMP literals"""
+
+    def __init__(self, source):
+        self.source = source
+        self.executed = []
+
+    def execute_query(self, sql, refresh=False):
+        duckdb = pytest.importorskip("duckdb")
+        self.executed.append(sql)
+        conn = duckdb.connect(":memory:")
+        try:
+            conn.register("t", self.source)
+            return conn.execute(sql).df(), None
+        finally:
+            conn.close()
+
+
+def test_incremental_refresh_of_a_clamped_query_fetches_the_newest_rows(tmp_path):
+    days = pd.date_range("2024-01-01", periods=5, freq="D")
+    source = pd.DataFrame({"day": days, "volume": [1.0, 2.0, 3.0, 4.0, 5.0]})
+    csv_path = str(tmp_path / "volume.csv")
+    existing = source.head(3)
+    existing.to_csv(csv_path, index=False)
+    # The stored SQL ends in the row cap of the SQL guard, which matched the 3 rows fetched back then
+    record_dataset(csv_path, existing, "Daily volume", "SELECT day, volume FROM t ORDER BY day\nLIMIT 3")
+
+    dune = DuckDbDuneClient(source)
+    refresher = DatasetRefresher(dune)
+
+    def rewrite_sql(**kwargs):
+        raise RuntimeError("No LLM in the tests, the original query gets wrapped")
+
+    refresher.rewrite_sql = rewrite_sql
+
+    result = refresher.refresh(csv_path)
+
+    assert result["mode"] == "incremental"
+    assert result["rows"] == 5
+    assert pd.read_csv(csv_path)["volume"].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert "LIMIT" not in dune.executed[0]
@@ -0,0 +1,86 @@
+import json
+import time
+
+import pandas as pd
+import pytest
+
+from agents.utils.dune_client import DuneQueryClient
+from agents.utils.query_history import QueryHistory
+from agents.utils.result_store import SOURCE_PREWARM, ResultStore, result_key
+from agents.utils.sql_analysis import canonicalize_sql
+
+SQL = "SELECT day, volume FROM dex.trades WHERE block_time > now() - interval '1' day"
+DF = pd.DataFrame({"day": ["2024-01-01"], "volume": [1.0]})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path / "results"), ttl=12 * 3600, interactive_ttl=600)
+
+
+def age_entry(store, seconds):
+    """Pretend the stored entry of SQL was written `seconds` ago"""
+    meta_path = store._paths(result_key(canonicalize_sql(SQL)))[1]
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta["stored_at"] -= seconds
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+
+def test_ordinary_results_expire_after_minutes(store):
+    store.put(canonicalize_sql(SQL), SQL, DF)
+    assert store.get(canonicalize_sql(SQL)) is not None
+    age_entry(store, 601)
+    assert store.get(canonicalize_sql(SQL)) is None
+
+
+def test_prewarmed_results_are_served_longer(store):
+    store.put(canonicalize_sql(SQL), SQL, DF, source=SOURCE_PREWARM)
+    age_entry(store, 3 * 3600)
+    assert store.get(canonicalize_sql(SQL)) is not None
+    age_entry(store, 10 * 3600)
+    assert store.get(canonicalize_sql(SQL)) is None
+
+
+def test_served_results_carry_their_storage_time(store):
+    before = time.time()
+    store.put(canonicalize_sql(SQL), SQL, DF)
+    df = store.get(canonicalize_sql(SQL))
+    assert df.to_dict(orient="list") == DF.to_dict(orient="list")
+    assert before <= df.attrs["stored_at"] <= time.time()
+
+
+@pytest.fixture
+def dune(store, monkeypatch):
+    client = DuneQueryClient(api_key="test", client=object(), history=QueryHistory(":memory:"), store=store)
+    executions = []
+
+    def create_and_execute_query(sql, query_params=None):
+        executions.append(sql)
+        return DF.copy(), None
+
+    monkeypatch.setattr(client, "create_and_execute_query", create_and_execute_query)
+    client.executions = executions
+    return client
+
+
+def test_interactive_results_are_reused_only_briefly(dune, store):
+    df, _ = dune.execute_query(SQL)
+    assert "stored_at" not in df.attrs
+    df, _ = dune.execute_query(SQL)
+    assert "stored_at" in df.attrs
+    assert len(dune.executions) == 1
+
+    age_entry(store, 601)
+    dune.execute_query(SQL)
+    assert len(dune.executions) == 2
+
+
+def test_prewarmed_results_are_served_to_interactive_requests(dune, store):
+    dune.execute_query(SQL, refresh=True, prewarm=True)
+    age_entry(store, 3600)
+    df, error = dune.execute_query(SQL)
+    assert error is None
+    assert len(dune.executions) == 1
+    assert time.time() - df.attrs["stored_at"] == pytest.approx(3600, abs=60)
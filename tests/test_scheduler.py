@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+
+from agents.utils import scheduler
+from agents.utils.scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    FairQueue,
+    background_limit,
+    current_priority,
+    parse_priority,
+    work_priority,
+)
+from agents.utils.tracing import wallet_address_var
+from backend.scheduler import JobScheduler
+
+
+def pop_all(queue, allow_background=True):
+    items = []
+    while (entry := queue.pop(allow_background=allow_background)) is not None:
+        items.append(entry[1])
+    return items
+
+
+def test_interactive_items_go_first():
+    queue = FairQueue("test", min_background_share=0)
+    queue.push("refresh", BACKGROUND)
+    queue.push("prompt", INTERACTIVE)
+    assert queue.pop() == (INTERACTIVE, "prompt")
+    assert queue.pop() == (BACKGROUND, "refresh")
+    assert queue.pop() is None
+
+
+def test_wallets_share_the_queue():
+    queue = FairQueue("test")
+    for i in range(3):
+        queue.push(f"a{i}", INTERACTIVE, "0xA")
+    queue.push("b0", INTERACTIVE, "0xB")
+    # The first item of wallet B does not wait for the backlog of wallet A
+    assert pop_all(queue) == ["a0", "b0", "a1", "a2"]
+
+
+def test_wallet_weights(monkeypatch):
+    monkeypatch.setattr(scheduler, "_wallet_weights", {"0xa": 2.0})
+    queue = FairQueue("test")
+    for i in range(4):
+        queue.push(f"a{i}", INTERACTIVE, "0xA")
+        queue.push(f"b{i}", INTERACTIVE, "0xB")
+    first = pop_all(queue)[:6]
+    # Twice the weight, twice the dispatches while both wallets have a backlog
+    assert [item[0] for item in first].count("a") == 4
+    assert first == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_background_gets_its_minimum_share():
+    queue = FairQueue("test", min_background_share=0.25)
+    queue.push("refresh", BACKGROUND)
+    for i in range(6):
+        queue.push(f"prompt{i}", INTERACTIVE)
+    assert pop_all(queue) == ["prompt0", "prompt1", "prompt2", "prompt3", "refresh", "prompt4", "prompt5"]
+
+
+def test_interactive_streak_only_counts_while_background_waits():
+    queue = FairQueue("test", min_background_share=0.5)
+    for i in range(3):
+        queue.push(f"prompt{i}", INTERACTIVE)
+    assert pop_all(queue) == ["prompt0", "prompt1", "prompt2"]
+    queue.push("refresh", BACKGROUND)
+    queue.push("prompt3", INTERACTIVE)
+    assert queue.pop() == (INTERACTIVE, "prompt3")
+
+
+def test_background_held_back_without_room():
+    queue = FairQueue("test")
+    queue.push("refresh", BACKGROUND)
+    queue.push("prompt", INTERACTIVE)
+    assert pop_all(queue, allow_background=False) == ["prompt"]
+    assert queue.queued(BACKGROUND) == 1
+    assert queue.pop(allow_background=True) == (BACKGROUND, "refresh")
+
+
+def test_drain():
+    queue = FairQueue("test")
+    queue.push("refresh", BACKGROUND)
+    queue.push("prompt", INTERACTIVE)
+    assert sorted(queue.drain()) == ["prompt", "refresh"]
+    assert len(queue) == 0
+
+
+def test_parse_priority():
+    assert parse_priority(None) == INTERACTIVE
+    assert parse_priority("Background") == BACKGROUND
+    with pytest.raises(ValueError):
+        parse_priority("urgent")
+
+
+def test_work_priority_is_scoped():
+    with work_priority(BACKGROUND):
+        assert current_priority() == BACKGROUND
+    assert current_priority() == INTERACTIVE
+
+
+def test_background_limit_keeps_one_worker():
+    assert background_limit(8, 0.5) == 4
+    assert background_limit(1, 0.25) == 1
+
+
+def test_job_scheduler_admits_interactive_jobs_first():
+    async def main():
+        jobs = JobScheduler(max_jobs=1, max_background_jobs=1)
+        release = asyncio.Event()
+        order = []
+
+        async def job(name):
+            order.append(name)
+            if name == "first":
+                await release.wait()
+            return current_priority()
+
+        first = asyncio.create_task(jobs.run(job, "first"))
+        await asyncio.sleep(0)
+        background = asyncio.create_task(jobs.run(job, "refresh", priority=BACKGROUND))
+        interactive = asyncio.create_task(jobs.run(job, "prompt"))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, background, interactive)
+        return order, results
+
+    order, results = asyncio.run(main())
+    assert order == ["first", "prompt", "refresh"]
+    assert results == [INTERACTIVE, BACKGROUND, INTERACTIVE]
+
+
+def test_job_scheduler_caps_background_jobs():
+    async def main():
+        jobs = JobScheduler(max_jobs=2, max_background_jobs=1)
+        release = asyncio.Event()
+        started = []
+
+        async def job(name):
+            started.append(name)
+            await release.wait()
+
+        token = wallet_address_var.set("0xabc")
+        try:
+            tasks = [
+                asyncio.create_task(jobs.run(job, "refresh1", priority=BACKGROUND)),
+                asyncio.create_task(jobs.run(job, "refresh2", priority=BACKGROUND)),
+            ]
+            await asyncio.sleep(0)
+            # The second slot stays free for interactive work
+            assert started == ["refresh1"]
+            tasks.append(asyncio.create_task(jobs.run(job, "prompt")))
+            await asyncio.sleep(0)
+            assert started == ["refresh1", "prompt"]
+        finally:
+            wallet_address_var.reset(token)
+        release.set()
+        await asyncio.gather(*tasks)
+        return started
+
+    assert asyncio.run(main()) == ["refresh1", "prompt", "refresh2"]
+
+
+def test_job_scheduler_runs_blocking_jobs_in_threads():
+    async def main():
+        return await JobScheduler(max_jobs=1).run(current_priority, priority=BACKGROUND)
+
+    assert asyncio.run(main()) == BACKGROUND
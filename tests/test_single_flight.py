@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+import pytest
+
+from agents.utils.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def _run_concurrently(flight, key, fn, callers):
+    """Call flight.do from `callers` threads once the first one is inside fn"""
+    outcomes = [None] * callers
+    entered = threading.Event()
+    release = threading.Event()
+
+    def work():
+        entered.set()
+        release.wait(5)
+        return fn()
+
+    def call(i):
+        try:
+            outcomes[i] = flight.do(key, work)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    entered.wait(5)
+    threads += [threading.Thread(target=call, args=(i,)) for i in range(1, callers)]
+    for thread in threads[1:]:
+        thread.start()
+    # Give the followers time to join the in-flight call
+    threading.Event().wait(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_single_flight_shares_one_result():
+    calls = []
+    outcomes = _run_concurrently(SingleFlight("test"), "q", lambda: calls.append(1) or "rows", 4)
+    assert len(calls) == 1
+    assert outcomes[0] == ("rows", False)
+    assert outcomes[1:] == [("rows", True)] * 3
+
+
+def test_single_flight_propagates_the_error_to_every_caller():
+    def fail():
+        raise RuntimeError("Dune failed")
+
+    outcomes = _run_concurrently(SingleFlight("test"), "q", fail, 3)
+    assert all(isinstance(outcome, RuntimeError) and str(outcome) == "Dune failed" for outcome in outcomes)
+
+
+def test_single_flight_runs_again_after_a_failure():
+    flight = SingleFlight("test")
+    with pytest.raises(RuntimeError):
+        flight.do("q", lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+    assert flight.do("q", lambda: "ok") == ("ok", False)
+
+
+def test_async_single_flight_shares_results_and_errors():
+    async def scenario():
+        flight = AsyncSingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(3)))
+        assert len(calls) == 1
+        assert sorted(shared for _, shared in results) == [False, True, True]
+
+        async def fail():
+            await asyncio.sleep(0.05)
+            raise ValueError("bad prompt")
+
+        errors = await asyncio.gather(*(flight.do("k", fail) for _ in range(2)), return_exceptions=True)
+        assert [str(e) for e in errors] == ["bad prompt", "bad prompt"]
+
+    asyncio.run(scenario())
+
+
+def test_async_single_flight_survives_a_cancelled_caller():
+    async def scenario():
+        flight = AsyncSingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        leader = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == ("result", True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import pytest
+
+from agents.sql_generator import SqlGenerateAgent
+from agents.utils.sql_analysis import query_limit
+from agents.utils.sql_guard import SQL_MAX_ROWS
+from agents.utils.sql_retry import execute_with_retries
+
+CHEAP_SQL = (
+    "SELECT block_date, SUM(amount_usd) AS volume FROM tokens.transfers "
+    "WHERE block_date >= current_date - interval '7' day GROUP BY 1"
+)
+# Every partition of a heavy table, raw rows
+COSTLY_SQL = "SELECT * FROM tokens.transfers WHERE amount_usd > 1000"
+
+
+@pytest.fixture
+def agent():
+    agent = SqlGenerateAgent(table_list_file_path="agents/utils/table_list.json")
+    agent.optimizations = []
+
+    def optimize_sql(**kwargs):
+        agent.optimizations.append(kwargs)
+        return SimpleNamespace(optimized_trino_sql_query=CHEAP_SQL)
+
+    agent.optimize_sql = optimize_sql
+    return agent
+
+
+def fixing_to(agent, fixed_sql):
+    agent.retry_generate_sql = lambda **kwargs: SimpleNamespace(refined_trino_sql_query=fixed_sql)
+    return agent
+
+
+def test_fixed_sql_without_limit_is_clamped(agent):
+    fixing_to(agent, CHEAP_SQL)
+    table = agent.catalog.get("tokens.transfers")
+
+    sql = agent.retry_generate_sql_by_prompt("Weekly volume", "SELECT broken", "syntax error", table)
+
+    assert sql == f"{CHEAP_SQL}\nLIMIT {SQL_MAX_ROWS}"
+    assert agent.optimizations == []
+
+
+def test_fixed_sql_with_large_limit_is_lowered(agent):
+    fixing_to(agent, f"{CHEAP_SQL} LIMIT 1000000;")
+    table = agent.catalog.get("tokens.transfers")
+
+    sql = agent.retry_generate_sql_by_prompt("Weekly volume", "SELECT broken", "syntax error", table)
+
+    assert query_limit(sql) == SQL_MAX_ROWS
+
+
+def test_costly_fixed_sql_is_rewritten(agent):
+    fixing_to(agent, COSTLY_SQL)
+    table = agent.catalog.get("tokens.transfers")
+
+    sql = agent.retry_generate_sql_by_prompt("Large transfers", "SELECT broken", "syntax error", table)
+
+    assert sql == f"{CHEAP_SQL}\nLIMIT {SQL_MAX_ROWS}"
+    assert len(agent.optimizations) == 1
+    assert "partitioned by" in agent.optimizations[0]["cost_hints"]
+
+
+def test_guard_without_table_only_clamps(agent):
+    sql = agent.guard_sql("Large transfers", None, COSTLY_SQL, max_rows=100000)
+    assert sql == f"{COSTLY_SQL}\nLIMIT 100000"
+    assert agent.optimizations == []
+
+
+def test_dune_only_receives_guarded_sql_on_retry(agent):
+    fixing_to(agent, CHEAP_SQL)
+    table = agent.catalog.get("tokens.transfers")
+    executed = []
+
+    def execute(sql):
+        executed.append(sql)
+        return (None, 'syntax error at or near "FORM"') if len(executed) == 1 else ("rows", None)
+
+    execute_with_retries(
+        f"{CHEAP_SQL} LIMIT 10",
+        execute=execute,
+        fix=lambda sql, error: agent.retry_generate_sql_by_prompt("Weekly volume", sql, error, table),
+    )
+
+    assert executed[1] == f"{CHEAP_SQL}\nLIMIT {SQL_MAX_ROWS}"
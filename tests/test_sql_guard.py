@@ -0,0 +1,46 @@
+from agents.utils.sql_analysis import query_limit
+from agents.utils.sql_guard import clamp_limit
+
+
+def test_clamp_limit_adds_missing_limit():
+    assert clamp_limit("SELECT a FROM t;", max_rows=100) == "SELECT a FROM t\nLIMIT 100"
+
+
+def test_clamp_limit_keeps_smaller_limit():
+    assert clamp_limit("SELECT a FROM t LIMIT 10", max_rows=100) == "SELECT a FROM t LIMIT 10"
+
+
+def test_clamp_limit_lowers_larger_limit():
+    assert clamp_limit("SELECT a FROM t LIMIT 5000;", max_rows=100) == "SELECT a FROM t LIMIT 100"
+
+
+def test_clamp_limit_ignores_trailing_comment():
+    sql = clamp_limit("SELECT a FROM t LIMIT 100 -- top", max_rows=10000)
+    assert sql == "SELECT a FROM t LIMIT 100"
+    assert sql.upper().count("LIMIT") == 1
+
+
+def test_clamp_limit_lowers_limit_before_comments():
+    sql = clamp_limit("SELECT a FROM t /* all */ LIMIT 50000 ; -- top\n-- done\n", max_rows=10000)
+    assert sql == "SELECT a FROM t   LIMIT 10000"
+
+
+def test_clamp_limit_keeps_comment_markers_in_literals():
+    sql = clamp_limit("SELECT a FROM t WHERE b = '--x' LIMIT 5", max_rows=100)
+    assert sql == "SELECT a FROM t WHERE b = '--x' LIMIT 5"
+
+
+def test_clamp_limit_treats_fetch_first_as_limit():
+    assert clamp_limit("SELECT a FROM t FETCH FIRST 10 ROWS ONLY", max_rows=100) == (
+        "SELECT a FROM t FETCH FIRST 10 ROWS ONLY"
+    )
+    assert clamp_limit("SELECT a FROM t ORDER BY a FETCH NEXT 500 ROWS ONLY;", max_rows=100) == (
+        "SELECT a FROM t ORDER BY a FETCH NEXT 100 ROWS ONLY"
+    )
+    assert clamp_limit("SELECT a FROM t FETCH FIRST ROW ONLY", max_rows=100) == "SELECT a FROM t FETCH FIRST ROW ONLY"
+
+
+def test_query_limit_only_reads_outermost_query():
+    assert query_limit("SELECT * FROM (SELECT a FROM t LIMIT 10) s") is None
+    assert query_limit("SELECT a FROM t limit 20 -- top 20") == 20
+    assert query_limit("SELECT a FROM t FETCH FIRST 3 ROWS ONLY") == 3
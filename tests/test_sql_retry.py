@@ -0,0 +1,137 @@
+import pytest
+
+from agents.utils import deadline, sql_retry
+from agents.utils.deadline import deadline_scope
+from agents.utils.dune_client import QUERY_ERROR_PERMANENT, QUERY_ERROR_SQL, classify_query_error
+from agents.utils.rate_limit import RATE_LIMIT, TRANSIENT
+from agents.utils.sql_retry import execute_with_retries
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(sql_retry, "backoff_delay", lambda attempt: 0.0)
+
+
+class FakeDune:
+    """Answers the executions with the scripted (result, error) pairs in order"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.executed = []
+
+    def __call__(self, sql):
+        self.executed.append(sql)
+        return self.responses.pop(0)
+
+
+class FakeFixer:
+    def __init__(self, *fixed_sqls):
+        self.fixed_sqls = list(fixed_sqls)
+        self.calls = []
+
+    def __call__(self, sql, error):
+        self.calls.append((sql, error))
+        return self.fixed_sqls.pop(0)
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        ('syntax error at or near "FORM"', QUERY_ERROR_SQL),
+        ("column 'amount_usd' cannot be resolved", QUERY_ERROR_SQL),
+        ("something unexpected", QUERY_ERROR_SQL),
+        ("429 Client Error: Too Many Requests", RATE_LIMIT),
+        ("503 Server Error: Service Unavailable", TRANSIENT),
+        ("permission denied for table secret", QUERY_ERROR_PERMANENT),
+        ("You have exceeded the maximum number of credits", QUERY_ERROR_PERMANENT),
+    ],
+)
+def test_classify_query_error(error, expected):
+    assert classify_query_error(error) == expected
+
+
+def test_success_on_first_attempt():
+    execute = FakeDune(("rows", None))
+    fix = FakeFixer()
+    assert execute_with_retries("SELECT 1", execute, fix) == ("rows", None, "SELECT 1", 1)
+    assert fix.calls == []
+
+
+def test_sql_error_executes_the_fixed_query():
+    execute = FakeDune((None, 'syntax error at or near "FORM"'), ("rows", None))
+    fix = FakeFixer("SELECT a FROM t")
+
+    result = execute_with_retries("SELECT a FORM t", execute, fix, max_attempts=3)
+
+    assert result == ("rows", None, "SELECT a FROM t", 2)
+    assert fix.calls == [("SELECT a FORM t", 'syntax error at or near "FORM"')]
+    assert execute.executed == ["SELECT a FORM t", "SELECT a FROM t"]
+
+
+@pytest.mark.parametrize("error", ["429 Client Error: Too Many Requests", "503 Server Error: Service Unavailable"])
+def test_rate_limit_and_transient_errors_execute_the_same_query(error):
+    execute = FakeDune((None, error), ("rows", None))
+    fix = FakeFixer()
+
+    result = execute_with_retries("SELECT 1", execute, fix, max_attempts=3)
+
+    assert result == ("rows", None, "SELECT 1", 2)
+    assert execute.executed == ["SELECT 1", "SELECT 1"]
+    assert fix.calls == []
+
+
+def test_permanent_error_fails_right_away():
+    execute = FakeDune((None, "permission denied for table secret"))
+    fix = FakeFixer()
+
+    result = execute_with_retries("SELECT * FROM secret", execute, fix, max_attempts=3)
+
+    assert result == (None, "permission denied for table secret", "SELECT * FROM secret", 1)
+    assert fix.calls == []
+
+
+def test_stops_when_the_fix_was_already_tried():
+    error = 'column "x" does not exist'
+    execute = FakeDune((None, error), (None, error))
+    fix = FakeFixer("select x  from t", "SELECT x FROM t")
+
+    result = execute_with_retries("SELECT x FROM t", execute, fix, max_attempts=5)
+
+    # The first fix only differs in case and whitespace, the second is the original query
+    assert result[1] == error
+    assert len(fix.calls) == 1
+    assert execute.executed == ["SELECT x FROM t"]
+
+
+def test_stops_after_max_attempts():
+    error = "503 Server Error: Service Unavailable"
+    execute = FakeDune((None, error), (None, error), (None, error))
+    fix = FakeFixer()
+
+    result = execute_with_retries("SELECT 1", execute, fix, max_attempts=2)
+
+    assert result == (None, error, "SELECT 1", 2)
+    assert len(execute.executed) == 2
+
+
+def test_deadline_skips_the_sql_fix(monkeypatch):
+    monkeypatch.setitem(deadline.STAGE_MIN_SECONDS, "sql_retry", 30.0)
+    execute = FakeDune((None, 'syntax error at or near "FORM"'))
+    fix = FakeFixer("SELECT a FROM t")
+
+    with deadline_scope(5.0):
+        result = execute_with_retries("SELECT a FORM t", execute, fix, max_attempts=3)
+
+    assert result[3] == 1
+    assert fix.calls == []
+
+
+def test_deadline_skips_the_backoff(monkeypatch):
+    monkeypatch.setattr(sql_retry, "backoff_delay", lambda attempt: 10.0)
+    execute = FakeDune((None, "429 Client Error: Too Many Requests"))
+    fix = FakeFixer()
+
+    with deadline_scope(1.0):
+        result = execute_with_retries("SELECT 1", execute, fix, max_attempts=3)
+
+    assert result == (None, "429 Client Error: Too Many Requests", "SELECT 1", 1)
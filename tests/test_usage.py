@@ -0,0 +1,62 @@
+from datetime import date, timedelta
+
+import pytest
+
+from agents.utils import usage
+from agents.utils.tracing import request_context
+from agents.utils.usage import BudgetExceeded, UsageTracker, WalletUsageStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return WalletUsageStore(str(tmp_path / "usage.db"), retention_days=7)
+
+
+def test_wallet_usage_is_shared_through_the_store(store):
+    first, second = UsageTracker(wallet_store=store), UsageTracker(wallet_store=store)
+    with request_context("r1", wallet_address="0xabc"):
+        first.record("plan", prompt_tokens=100, completion_tokens=20, seconds=1.0, cost=0.01)
+    with request_context("r2", wallet_address="0xabc"):
+        second.record("plot", prompt_tokens=50, completion_tokens=5, seconds=0.5)
+
+    wallet = second.get_wallet_usage("0xabc")
+    assert wallet["calls"] == 2
+    assert wallet["total_tokens"] == 175
+    assert wallet["cost"] == pytest.approx(0.01)
+    # Requests stay with the process that served them
+    assert first.get_request_usage("r1")["stages"]["plan"]["total_tokens"] == 120
+    assert second.get_request_usage("r1") is None
+
+
+def test_days_beyond_retention_are_pruned(store):
+    today = date.today()
+    store.add("0xabc", {"calls": 1, "total_tokens": 10}, day=today - timedelta(days=30))
+    store.add("0xabc", {"calls": 1, "total_tokens": 20}, day=today - timedelta(days=3))
+    store.add("0xabc", {"calls": 1, "total_tokens": 30}, day=today)
+
+    assert store.get("0xabc", (today - timedelta(days=30)).isoformat())["total_tokens"] == 0
+    assert store.get("0xabc", (today - timedelta(days=3)).isoformat())["total_tokens"] == 20
+    assert store.get("0xabc", today.isoformat())["total_tokens"] == 30
+
+
+def test_check_budget_raises_once_the_wallet_budget_is_used(store, monkeypatch):
+    monkeypatch.setattr(usage, "WALLET_DAILY_TOKEN_BUDGET", 100)
+    tracker = UsageTracker(wallet_store=store)
+    with request_context("r1", wallet_address="0xabc"):
+        tracker.check_budget()
+        tracker.record("plan", prompt_tokens=90, completion_tokens=10, seconds=1.0)
+    with request_context("r2", wallet_address="0xabc"):
+        with pytest.raises(BudgetExceeded):
+            tracker.check_budget()
+    with request_context("r3", wallet_address="0xdef"):
+        tracker.check_budget()
+
+
+def test_planner_checks_the_budget_before_calling_the_llm(monkeypatch):
+    from agents.planner import Planner
+
+    monkeypatch.setattr(usage.usage_tracker, "budget_exceeded", lambda: True)
+    planner = Planner()
+    monkeypatch.setattr(planner, "split_task", lambda **kwargs: pytest.fail("The planner LLM was called"))
+    with pytest.raises(BudgetExceeded):
+        planner.split_task_by_prompt("Daily volume")